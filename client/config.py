@@ -10,13 +10,14 @@ class Config(object):
     FLASH_CONFIG_PATH = "/flash/data/config.txt"
     SD_CONFIG_PATH = "/sd/config.txt"
 
-    def __init__(self, host, image, meta, upload, wifis, port=80):
+    def __init__(self, host, image, meta, upload, wifis, port=80, ahead=0):
         self.host = host
         self.port = port
         self.image_path = image
         self.metadata_path = meta
         self.upload_path = upload
         self.wifi = wifis
+        self.ahead = ahead  # frames to fetch for later wakes, shown without wifi
 
     @staticmethod
     def load(debug=False, sd=None):
@@ -66,6 +67,7 @@ class Config(object):
         image = ""
         meta = ""
         upload = ""
+        ahead = 0
         wifi_list = {}
         current_ap = None
         for line in cfg_file:
@@ -92,12 +94,14 @@ class Config(object):
                     meta = line[5:].strip()
                 elif line.startswith("Up:"):
                     upload = line[3:].strip()
+                elif line.startswith("Ahead:"):
+                    ahead = int(line[6:])
             except ValueError:
                 if debug:
                     print("Can't process line")
 
         if host and len(wifi_list) > 0 and image and meta:
-            return Config(host, image, meta, upload, wifi_list, port)
+            return Config(host, image, meta, upload, wifi_list, port, ahead)
         else:
             return None
 
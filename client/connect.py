@@ -19,6 +19,8 @@ User-Agent: Widget-IoTDisplay/1.0\r
         self.address = socket.getaddrinfo(host, port)[0][4]
         self.debug = debug
         self.last_fetch_time = (0, 0, 0, 0, 0, 0)
+        self.last_frame = None
+        self.last_wake = None
 
     @staticmethod
     def simple_strptime(date_str):
@@ -94,17 +96,22 @@ User-Agent: Widget-IoTDisplay/1.0\r
         :param path: Path on the website to pull
         :param path_type: Content-Type (substring match)
         :param max_length: Maximum Content-Length to accept
-        :return: The content (no headers)
+        :return: The content (no headers), as a bytearray
         """
 
         length = self._do_get(max_length, path, path_type)
         # Force gc before we do some big allocs
         gc.collect()
 
-        # Keep getting until we've got what we were promised
-        content = b""
-        while len(content) < length:
-            content += self.socket.recv(length - len(content))
+        # All in one go, growing it as it comes in is quadratic and fragments the heap
+        content = bytearray(length)
+        view = memoryview(content)
+        got = 0
+        while got < length:
+            more = self.socket.readinto(view[got:])
+            if not more:
+                raise RuntimeError("Connection closed after %d bytes" % got)
+            got += more
 
         self._close_keep_alive()
         return content
@@ -178,6 +185,8 @@ User-Agent: Widget-IoTDisplay/1.0\r
         length = 0
         content_type = ""
         self.last_fetch_time = (0, 0, 0, 0, 0, 0)
+        self.last_frame = None
+        self.last_wake = None
         in_headers = True
         while in_headers:
             # Parse each line in turn, we'll check the current date and
@@ -185,7 +194,13 @@ User-Agent: Widget-IoTDisplay/1.0\r
             header_line = self.socket.readline().decode()
 
             arg = header_line.split(":")[-1].strip()
-            if "date" in header_line.lower():
+            if "x-frame" in header_line.lower():
+                # Server's id for the image, to ask for changes against next time
+                self.last_frame = arg
+            elif "x-wake" in header_line.lower():
+                # Server's next planned wake, to check a stored schedule against
+                self.last_wake = tuple(int(x) for x in arg.split(","))
+            elif "date" in header_line.lower():
                 # Grab time and keep it but we check the whole line with a regex
                 self.last_fetch_time = Connect.simple_strptime(header_line)
             elif "content-length" in header_line.lower():
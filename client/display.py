@@ -1,18 +1,19 @@
 import gc
+import struct
 
 from battery import Battery
 from config import Config
 from connect import Connect
-from epd import EPD
+from epd import EPD, BusyTimeout
 from machine import RTC, Pin, WDT, idle, deepsleep, DEEPSLEEP
-from os import mount
+from os import mount, remove, rename
 
 try:
     from os import unmount
 except ImportError:
     # This changed name in micropython 1.9
     from os import umount as unmount
-from time import sleep_ms
+from time import localtime, mktime, sleep_ms
 from wipy import heartbeat
 
 # Pins in use:
@@ -37,6 +38,18 @@ from wipy import heartbeat
 
 class Display(object):
     IMG_DIR = "/flash/imgs"
+    FRAME_PATH = "/flash/frame.bin"  # copy of what's on screen, to apply deltas to
+    FRAME_ID_PATH = "/flash/frame.id"  # the server's id for it
+    SCHEDULE_PATH = "/flash/schedule.json"  # metadata.json as last fetched
+    AHEAD_PATH = "/flash/ahead.json"  # frames fetched for later wakes
+    AHEAD_FRAME_PATH = "/flash/ahead%d.bin"  # copy of the one in each slot
+    AHEAD_SLOTS = (1, 2)  # spare EPD slots, slot 0 is for what's on screen now
+    SYNC_PATH = "/flash/synced"  # when the RTC was last set from the server
+
+    HEADER_SIZE = 16  # EPD format 0, sizes the rest of the file for any panel
+    DELTA_MAGIC = 0x44
+    PARTIAL_MAX_ROWS = 100  # more changed rows than this gets a flashing refresh
+    MAX_CHUNK = 250
 
     def __init__(self, debug=False):
         self.cfg = None
@@ -129,56 +142,405 @@ class Display(object):
         elif val == machine.SOFT_RESET:
             return "soft"
 
-    def set_alarm(self, now, json_metadata):
-        import json
-
-        json_dict = json.loads(json_metadata)
-
-        # Now we know the time too
-        self.rtc = RTC(datetime=now)
-        list_int = json_dict["wakeup"][:6]
-        time_str = ",".join([str(x) for x in list_int])
+    def set_alarm(self, schedule):
+        list_int = Display.next_wake(schedule, self.clock(schedule))
+        if list_int is None:
+            # Old style metadata, or it's run out, it'll fail below
+            list_int = schedule["wakeup"][:6]
+        alarm = self.alarm_time(list_int, schedule)
+        time_str = ",".join([str(x) for x in alarm])
 
         self.log("Setting alarm for " + time_str)
-        self.rtc.alarm(time=tuple(list_int))
+        self.rtc.alarm(time=alarm)
 
         if self.rtc.alarm_left() == 0:
             self.log("Alarm failed, setting for +1 hour")
             self.rtc.alarm(time=3600000)
 
-        del json
+    @staticmethod
+    def seconds(when):
+        """
+        :param when: Time tuple
+        :return: Seconds since the epoch
+        """
+        return mktime(tuple(when[:6]) + (0, 0))
+
+    @staticmethod
+    def drifted(when, drift, synced):
+        """
+        :param when: Time tuple
+        :param drift: From metadata.json, ppm the RTC runs slow
+        :param synced: Seconds when the RTC was last set
+        :return: when moved on by the drift since synced, as a time tuple
+        """
+        secs = Display.seconds(when)
+        # Whole ppm and seconds, as floats here are only single precision
+        return tuple(localtime(secs + (secs - synced) * drift // 1000000)[:6])
+
+    def save_synced(self):
+        with open(Display.SYNC_PATH, "w") as synced:
+            synced.write(str(Display.seconds(self.rtc.now())))
+
+    @staticmethod
+    def load_synced():
+        """
+        :return: Seconds when the RTC was last set from the server, or None
+        """
+        try:
+            with open(Display.SYNC_PATH, "r") as synced:
+                return int(synced.read())
+        except (OSError, ValueError):
+            return None
+
+    def clock(self, schedule):
+        """
+        :param schedule: Dict from metadata.json, with the drift the server measured
+        :return: GMT now as a tuple, the RTC corrected for its drift since it was set
+        """
+        now = tuple(self.rtc.now()[:6])
+        drift = schedule.get("drift", 0) if schedule else 0
+        synced = Display.load_synced()
+        if not drift or synced is None:
+            return now
+        return Display.drifted(now, drift, synced)
+
+    def alarm_time(self, wake, schedule):
+        """
+        :param wake: GMT time tuple
+        :param schedule: As for clock()
+        :return: What the RTC will read at the wake, as a time tuple
+        """
+        wake = tuple(wake[:6])
+        drift = schedule.get("drift", 0) if schedule else 0
+        synced = Display.load_synced()
+        if not drift or synced is None:
+            return wake
+        return Display.drifted(wake, -drift, synced)
+
+    @staticmethod
+    def next_wake(schedule, now):
+        """
+        :param schedule: Dict from metadata.json
+        :param now: Time tuple, GMT
+        :return: First planned wake after now as a tuple, or None if there isn't one
+        """
+        now = tuple(now[:6])
+        if not schedule or "schedule" not in schedule:
+            return None
+        if tuple(schedule["until"][:6]) < now:
+            return None
+        for wake in schedule["schedule"]:
+            if tuple(wake[:6]) > now:
+                return tuple(wake[:6])
+        return None
+
+    @staticmethod
+    def load_json(path):
+        """
+        :param path: File in flash
+        :return: What was saved there, or None
+        """
+        import json
+
+        try:
+            with open(path, "r") as saved:
+                return json.loads(saved.read())
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def load_schedule():
+        """
+        :return: Dict from metadata.json as last fetched, or None
+        """
+        return Display.load_json(Display.SCHEDULE_PATH)
+
+    @staticmethod
+    def save_ahead(ahead):
+        """
+        :param ahead: List of {at, slot, frame} for frames waiting in spare slots
+        """
+        import json
 
-    def display_file_image(self, file_obj):
-        towrite = 15016
-        max_chunk = 250
+        if ahead:
+            with open(Display.AHEAD_PATH, "w") as saved:
+                saved.write(json.dumps(ahead))
+        else:
+            try:
+                remove(Display.AHEAD_PATH)
+            except OSError:
+                pass
+
+    def fetch_schedule(self, c):
+        """
+        :param c: Connect to the server
+        :return: Dict from metadata.json, also saved for next time
+        """
+        import json
+
+        self.log("Fetching metadata from " + self.cfg.metadata_path)
+        metadata = c.get_quick(
+            self.cfg.metadata_path, max_length=1024, path_type="json"
+        )
+        schedule = json.loads(str(metadata, "utf-8"))
+        with open(Display.SCHEDULE_PATH, "wb") as saved:
+            saved.write(metadata)
+        return schedule
+
+    def display_file_image(
+        self,
+        file_obj,
+        header=None,
+        flash=True,
+        copy_path=None,
+        slot=EPD.DEFAULT_SLOT,
+        show=True,
+    ):
+        """
+        Stream a whole EPD image to the display and update it.  If the display
+        rejects a chunk it's sent again slower.  In debug the display's checksum
+        of it is compared too, but only logged, as the algorithm's not been
+        confirmed on a panel yet and summing in Python slows the upload.
+        :param file_obj: Anything with read(), a file or a socket
+        :param header: EPD header if it's already been read from file_obj
+        :param flash: Use the flashing update, needed for big changes
+        :param copy_path: Also save the image here
+        :param slot: EPD framebuffer slot to upload to
+        :param show: Update the display from it, otherwise it's kept for later
+        """
+        if not header:
+            header = file_obj.read(Display.HEADER_SIZE)
+        towrite = Display.image_size(header)
+        copy = open(copy_path, "wb") if copy_path else None
+        # The display only sums the image, not the header
+        checksum = EPD.CHECKSUM_INIT if self.debug else None
+        error = None
+        try:
+            self.epd.upload_image_data(header, slot=slot)
+        except ValueError as e:
+            error = e
+        if copy:
+            copy.write(header)
+        towrite -= len(header)
         while towrite > 0:
-            c = max_chunk if towrite > max_chunk else towrite
-            buff = file_obj.read(c)
-            self.epd.upload_image_data(buff, delay_us=2000)
+            c = Display.MAX_CHUNK if towrite > Display.MAX_CHUNK else towrite
+            # Straight into the command being sent, so nothing's allocated per chunk
+            buff = self.epd.payload(c)
+            Display.read_into(file_obj, buff)
+            if not error:
+                try:
+                    self.epd.upload_image_data(None, slot=slot, data_size=c)
+                except ValueError as e:
+                    # Keep reading so the copy's whole, it's sent again from that
+                    error = e
+                if checksum is not None:
+                    checksum = EPD.calculate_checksum(buff, skip=0, acc=checksum)
+            if copy:
+                copy.write(buff)
             self.feed_wdt()
             towrite -= c
 
-        self.epd.display_update()
+        if copy:
+            copy.close()
+
+        if not error and checksum is not None:
+            got = self.epd.get_checksum(slot)
+            if got != checksum:
+                self.log(
+                    "Warning: display checksum 0x%04x, expected 0x%04x"
+                    % (got, checksum)
+                )
+        if isinstance(error, BusyTimeout):
+            # Slower wouldn't help a display that's stuck busy
+            raise error
+        if error:
+            if not self.epd.slower():
+                raise ValueError("Display upload failed: " + str(error))
+            self.log(
+                "Display upload failed (%s), trying %d baud" % (error, self.epd.baud)
+            )
+            self.epd.image_erase_frame_buffer(slot)
+            if copy_path:
+                with open(copy_path, "rb") as pic:
+                    return self.display_file_image(
+                        pic, flash=flash, slot=slot, show=show
+                    )
+            file_obj.seek(0)
+            return self.display_file_image(file_obj, flash=flash, slot=slot, show=show)
+
+        if show:
+            self.epd.display_update(slot=slot, flash=flash)
+
+    def fetch_ahead(self, c, schedule):
+        """
+        Upload the frames for the next few wakes to spare slots, so those wakes
+        only have to switch to them
+        :param c: Connect to the server
+        :param schedule: Dict from metadata.json
+        """
+        now = tuple(self.rtc.now()[:6])
+        wakes = [
+            tuple(wake[:6])
+            for wake in schedule.get("schedule", [])
+            if tuple(wake[:6]) > now
+        ]
+        ahead = []
+        for slot, wake in zip(Display.AHEAD_SLOTS[: self.cfg.ahead], wakes):
+            image_path = self.cfg.image_path + "?at=" + ",".join([str(x) for x in wake])
+            self.log("Fetching frame ahead from " + image_path)
+            try:
+                length, socket = c.get_object(image_path)
+                header = socket.read(Display.HEADER_SIZE)
+                if length != Display.image_size(header):
+                    raise ValueError("Wrong data size for image: %d" % length)
+                self.epd.image_erase_frame_buffer(slot)
+                sleep_ms(1000)  # As for the frame on screen
+                self.feed_wdt()
+                self.display_file_image(
+                    socket,
+                    header=header,
+                    copy_path=Display.AHEAD_FRAME_PATH % slot,
+                    slot=slot,
+                    show=False,
+                )
+                c.get_object_done()
+            except (RuntimeError, ValueError, OSError) as e:
+                self.log("Stopped fetching ahead: " + str(e))
+                break
+            ahead.append({"at": wake, "slot": slot, "frame": c.last_frame})
+        Display.save_ahead(ahead)
+
+    def show_ahead(self):
+        """
+        Switch to a frame fetched for this wake in advance, without the network
+        :return: True if it did and the alarm is set for the next wake
+        """
+        ahead = Display.load_json(Display.AHEAD_PATH)
+        schedule = Display.load_schedule()
+        now = self.clock(schedule)
+        if not ahead or tuple(ahead[0]["at"]) > tuple(now[:6]):
+            return False
+        if Display.next_wake(schedule, now) is None:
+            # Nothing to set the alarm for without asking
+            return False
+
+        # Any missed are out of date, the latest due is what should be up
+        frame = ahead.pop(0)
+        while ahead and tuple(ahead[0]["at"]) <= tuple(now[:6]):
+            frame = ahead.pop(0)
+        self.log("Showing frame ahead from slot %d" % frame["slot"])
+        self.epd.display_update(slot=frame["slot"])
+        self.feed_wdt()
+
+        # It's what's on screen now, so what changes are sent against
+        self.forget_frame()
+        try:
+            remove(Display.FRAME_PATH)
+        except OSError:
+            pass
+        rename(Display.AHEAD_FRAME_PATH % frame["slot"], Display.FRAME_PATH)
+        if frame["frame"]:
+            Display.save_frame_id(frame["frame"])
+
+        Display.save_ahead(ahead)
+        self.set_alarm(schedule)
+        return True
+
+    @staticmethod
+    def read_into(file_obj, buff):
+        """
+        Fill buff, a socket can return less than asked for
+        :param file_obj: Anything with readinto(), a file or a socket
+        :param buff: memoryview to fill
+        """
+        got = file_obj.readinto(buff)
+        while got < len(buff):
+            more = file_obj.readinto(buff[got:])
+            if not more:
+                raise ValueError("Image cut short at %d bytes" % got)
+            got += more
+
+    def apply_delta(self, file_obj, top, rows, stride):
+        """
+        Patch the saved copy of the screen with the rows that changed
+        :param file_obj: Socket positioned after the delta header
+        :param top: First changed row
+        :param rows: Number of rows sent
+        :param stride: Bytes per row
+        """
+        with open(Display.FRAME_PATH, "r+b") as frame:
+            frame.seek(Display.HEADER_SIZE + top * stride)
+            towrite = rows * stride
+            while towrite > 0:
+                c = Display.MAX_CHUNK if towrite > Display.MAX_CHUNK else towrite
+                # The display's command buffer is free until it's sent below
+                buff = self.epd.payload(c)
+                Display.read_into(file_obj, buff)
+                frame.write(buff)
+                self.feed_wdt()
+                towrite -= c
+
+    @staticmethod
+    def image_size(header):
+        """
+        :param header: EPD header, format 0
+        :return: Bytes in the whole file, header included
+        """
+        width, height, bpp = struct.unpack_from(">2HB", header, 1)
+        return Display.HEADER_SIZE + (width * bpp + 7) // 8 * height
+
+    @staticmethod
+    def frame_id():
+        """
+        :return: Server's id for the frame on screen, or None if we don't know it
+        """
+        try:
+            with open(Display.FRAME_ID_PATH, "r") as frame_id:
+                return frame_id.read().strip()
+        except OSError:
+            return None
+
+    @staticmethod
+    def save_frame_id(fp):
+        with open(Display.FRAME_ID_PATH, "w") as frame_id:
+            frame_id.write(fp)
+
+    @staticmethod
+    def forget_frame():
+        """
+        The screen no longer matches the saved frame, ask for a whole one next time
+        """
+        try:
+            remove(Display.FRAME_ID_PATH)
+        except OSError:
+            pass
+
+    def display_message(self, msg, name):
+        """
+        Show one of the stored images.  If the display won't take it, carry on
+        regardless, so the device still goes to sleep
+        :param msg: What it says, for the log
+        :param name: Image in IMG_DIR, without the .bin
+        """
+        self.log("Displaying %s msg" % msg)
+        self.forget_frame()
+        try:
+            with open(Display.IMG_DIR + "/" + name + ".bin", "rb") as pic:
+                self.display_file_image(pic)
+        except ValueError as e:
+            self.log("Failed to show %s msg: %s" % (msg, e))
 
     def display_no_config(self):
-        self.log("Displaying no config msg")
-        with open(Display.IMG_DIR + "/no_config.bin", "rb") as pic:
-            self.display_file_image(pic)
+        self.display_message("no config", "no_config")
 
     def display_low_battery(self):
-        self.log("Displaying low battery msg")
-        with open(Display.IMG_DIR + "/low_battery.bin", "rb") as pic:
-            self.display_file_image(pic)
+        self.display_message("low battery", "low_battery")
 
     def display_cannot_connect(self):
-        self.log("Displaying no server comms msg")
-        with open(Display.IMG_DIR + "/no_server.bin", "rb") as pic:
-            self.display_file_image(pic)
+        self.display_message("no server comms", "no_server")
 
     def display_no_wifi(self):
-        self.log("Displaying no wifi msg")
-        with open(Display.IMG_DIR + "/no_wifi.bin", "rb") as pic:
-            self.display_file_image(pic)
+        self.display_message("no wifi", "no_wifi")
 
     def check_battery_level(self):
         now_batt = 200
@@ -244,8 +606,13 @@ class Display(object):
         if not self.check_battery_level():
             return False
 
+        # A rate dropped to for a flat battery or a cold night needn't be kept
+        # for good, power cycling starts again from the fastest
+        if Display.reset_cause() == "power":
+            self.epd.fastest()
+
         try:
-            self.epd.get_sensor_data()
+            self.epd.calibrate()
         except ValueError:
             self.log("Can't communicate with display, flashing light and giving up")
             heartbeat(True)
@@ -258,6 +625,10 @@ class Display(object):
             self.feed_wdt()
             return True
 
+        # The RTC only still has the time if we've been asleep
+        if not woken and Display.reset_cause() == "sleep" and self.show_ahead():
+            return True
+
         try:
             self.cfg = Config.load(sd=self.sd)
             self.log("Loaded config")
@@ -275,6 +646,8 @@ class Display(object):
 
         self.feed_wdt()
 
+        # Anything fetched ahead was for wakes before this one
+        Display.save_ahead([])
         self.connect_wifi()
 
         content = b""
@@ -292,31 +665,40 @@ class Display(object):
 
             if len(self.cfg.upload_path) > 0:
                 temp = self.epd.get_sensor_data()  # we read this already
+                # The drift this wake's alarm was set with, so the server can
+                # fit the whole drift rather than what's left of it
+                schedule = Display.load_schedule()
                 c.post(
                     self.cfg.upload_path,
                     battery=self.battery.value(),
                     reset=cause,
                     screen=temp,
+                    drift=schedule.get("drift", 0) if schedule else 0,
                 )
 
-            self.log("Fetching metadata from " + self.cfg.metadata_path)
-            metadata = c.get_quick(
-                self.cfg.metadata_path, max_length=1024, path_type="json"
-            )
-
-            # This will set the time to GMT, not localtime
-            self.set_alarm(c.last_fetch_time, metadata)
-
-            self.feed_wdt()
-            del metadata
             del self.battery
-            self.log("Fetching image from " + self.cfg.image_path)
-            self.epd.image_erase_frame_buffer()
-            self.feed_wdt()
-
-            length, socket = c.get_object(self.cfg.image_path)
-
-            if length != 15016:
+            # Tell the server what we're showing so it can just send the changes
+            image_path = self.cfg.image_path
+            base = self.frame_id()
+            if base:
+                image_path += "?base=" + base
+            self.log("Fetching image from " + image_path)
+
+            length, socket = c.get_object(image_path)
+            # Now we know the time too, this will set it to GMT, not localtime
+            self.rtc = RTC(datetime=c.last_fetch_time)
+            self.save_synced()
+            server_wake = c.last_wake
+            header = socket.read(Display.HEADER_SIZE)
+
+            rows = None
+            if header[0] == Display.DELTA_MAGIC:
+                top, rows, stride = struct.unpack_from(">3H", header, 1)
+                expected = Display.HEADER_SIZE + rows * stride
+            else:
+                expected = Display.image_size(header)
+
+            if length != expected:
                 raise ValueError("Wrong data size for image: %d" % length)
 
             self.feed_wdt()
@@ -327,11 +709,57 @@ class Display(object):
             self.rtc.alarm(time=3600000)
             return True
 
-        sleep_ms(1000)  # How do we make the write to display more reliable?
+        if rows == 0:
+            self.log("Frame unchanged")
+            c.get_object_done()
+        else:
+            self.epd.image_erase_frame_buffer()
+            sleep_ms(1000)  # How do we make the write to display more reliable?
+            self.feed_wdt()
+            # Until it's all in, the saved copy no longer matches its id
+            self.forget_frame()
+            try:
+                if rows is None:
+                    self.log("Uploading to display")
+                    self.display_file_image(
+                        socket, header=header, copy_path=Display.FRAME_PATH
+                    )
+                    c.get_object_done()  # close off socket
+                else:
+                    self.log("Applying %d changed rows from %d" % (rows, top))
+                    self.apply_delta(socket, top, rows, stride)
+                    c.get_object_done()  # close off socket
+                    with open(Display.FRAME_PATH, "rb") as pic:
+                        self.display_file_image(
+                            pic, flash=rows > Display.PARTIAL_MAX_ROWS
+                        )
+            except (RuntimeError, ValueError, OSError) as e:
+                # Dropped connection, or not even the slowest rate got it through
+                self.log("Failed to show image: " + str(e))
+                self.display_cannot_connect()
+                self.rtc.alarm(time=3600000)
+                return True
+
+            if c.last_frame:
+                self.save_frame_id(c.last_frame)
+
+        # Only ask for the schedule again if it's run out or the server's changed it
+        schedule = Display.load_schedule()
+        wake = Display.next_wake(schedule, self.rtc.now())
+        if wake is None or (server_wake and server_wake != wake):
+            try:
+                schedule = self.fetch_schedule(c)
+            except (RuntimeError, ValueError, OSError) as e:
+                self.log("Failed to get metadata: " + str(e))
+                self.rtc.alarm(time=3600000)
+                return True
+        else:
+            self.log("Keeping stored schedule, next wake " + str(wake))
+        self.set_alarm(schedule)
         self.feed_wdt()
-        self.log("Uploading to display")
-        self.display_file_image(socket)
-        c.get_object_done()  # close off socket
+
+        if self.cfg.ahead:
+            self.fetch_ahead(c, schedule)
 
         if self.cfg.src == "sd":
             # If we've got a working config from SD instead of flash
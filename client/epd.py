@@ -5,8 +5,16 @@ from machine import SPI, Pin
 from binascii import hexlify
 
 
+class BusyTimeout(ValueError):
+    """
+    The display stayed busy too long.  It's not the SPI rate's fault, so this
+    doesn't slow it down
+    """
+
+
 class EPD(object):
     MAX_READ = 45
+    MAX_DATA = 251  # Thus speaks the datasheet
     SW_NORMAL_PROCESSING = 0x9000
     EP_FRAMEBUFFER_SLOT_OVERRUN = 0x6A84  # too much data fed in
     EP_SW_INVALID_LE = 0x6C00  # Wrong expected length
@@ -16,7 +24,56 @@ class EPD(object):
 
     DEFAULT_SLOT = 0  # always the *oldest*, should wear-level then I think
 
-    def __init__(self, debug=False, baud=100000):
+    CHECKSUM_INIT = 0x6363
+    BAUDS = (12000000, 8000000, 4000000, 2000000, 1000000, 100000)  # fastest first
+    BAUD_PATH = "/flash/epd.baud"  # fastest that's worked, so it's found once
+    BUSY_TIMEOUT_MS = 2000
+
+    def __init__(self, debug=False, baud=None):
+        self.spi = SPI(0)
+        self.baud = baud or EPD.load_baud()
+        self.init_spi()
+
+        # These are all active low!
+        self.tc_en_bar = Pin("GP4", mode=Pin.OUT)
+
+        self.disable()
+
+        self.tc_busy_bar = Pin("GP5", mode=Pin.IN)
+        # Wakes machine.idle() as soon as it's ready, see wait_ready()
+        self.tc_busy_bar.irq(trigger=Pin.IRQ_RISING)
+        self.tc_cs_bar = Pin("GP17", mode=Pin.ALT, alt=7)
+
+        self.debug = debug
+
+        # Every command is built and answered in these, so sending allocates nothing
+        self.command = bytearray(5 + EPD.MAX_DATA)  # INS, P1, P2, Lc, data, Le
+        self.response = bytearray(EPD.MAX_READ)
+        # Views into them by length, there's only a few lengths ever used
+        self.payloads = {}
+        self.commands = {}
+        self.responses = {}
+
+    @staticmethod
+    def view(views, buff, start, size):
+        """
+        :param views: Dict of views into buff already made
+        :return: memoryview of size bytes of buff from start
+        """
+        view = views.get(size)
+        if view is None:
+            view = views[size] = memoryview(buff)[start : start + size]
+        return view
+
+    def payload(self, size):
+        """
+        Fill this then send_command() with data_size, so the data isn't copied
+        :param size: Bytes of data
+        :return: memoryview of where the command's data goes
+        """
+        return EPD.view(self.payloads, self.command, 4, size)
+
+    def init_spi(self):
         # From datasheet
         # Bit rate – up to 12 MHz1
         # ▪ Polarity – CPOL = 1; clock transition high-to-low on the leading edge and low-to-high on the
@@ -24,11 +81,10 @@ class EPD(object):
         # ▪ Phase – CPHA = 1; setup on the leading edge and sample on the trailing edge
         # ▪ Bit order – MSB first
         # ▪ Chip select polarity – active low
-        self.spi = SPI(0)
         try:
             self.spi.init(
                 mode=SPI.MASTER,
-                baudrate=baud,
+                baudrate=self.baud,
                 bits=8,
                 polarity=1,
                 phase=1,
@@ -37,7 +93,7 @@ class EPD(object):
             )  # CLK, MOSI, MISO
         except AttributeError:
             self.spi.init(
-                baudrate=baud,
+                baudrate=self.baud,
                 bits=8,
                 polarity=1,
                 phase=1,
@@ -45,16 +101,72 @@ class EPD(object):
                 pins=("GP31", "GP16", "GP30"),
             )  # CLK, MOSI, MISO
 
-        # These are all active low!
-        self.tc_en_bar = Pin("GP4", mode=Pin.OUT)
-
-        self.disable()
+    @staticmethod
+    def load_baud():
+        """
+        :return: Baud rate saved by slower() and kept until a power on reset, or
+        the fastest to try first
+        """
+        try:
+            with open(EPD.BAUD_PATH, "r") as saved:
+                return int(saved.read())
+        except (OSError, ValueError):
+            return EPD.BAUDS[0]
 
-        self.tc_busy_bar = Pin("GP5", mode=Pin.IN)
-        self.tc_busy_bar.irq(trigger=Pin.IRQ_RISING)  # Wake up when it changes
-        self.tc_cs_bar = Pin("GP17", mode=Pin.ALT, alt=7)
+    def slower(self):
+        """
+        Drop to the next baud rate down and remember it
+        :return: False if it's already as slow as it goes
+        """
+        slower = [baud for baud in EPD.BAUDS if baud < self.baud]
+        if not slower:
+            return False
+        self.baud = slower[0]
+        self.init_spi()
+        with open(EPD.BAUD_PATH, "w") as saved:
+            saved.write(str(self.baud))
+        return True
+
+    def fastest(self):
+        """
+        Go back to the fastest baud rate, for calibrate() to slow down from
+        """
+        self.baud = EPD.BAUDS[0]
+        self.init_spi()
+        with open(EPD.BAUD_PATH, "w") as saved:
+            saved.write(str(self.baud))
 
-        self.debug = debug
+    def calibrate(self):
+        """
+        Find the fastest baud rate the display answers at, starting from the
+        last that worked.  Uploads slow it down more if the display still
+        rejects the data at that rate.
+        :return: Screen temperature, from the command used to check
+        """
+        while True:
+            try:
+                return self.get_sensor_data()
+            except BusyTimeout:
+                raise
+            except ValueError as e:
+                if not self.slower():
+                    raise
+                if self.debug:
+                    print("%s, trying %d baud" % (e, self.baud))
+
+    def wait_ready(self, timeout_ms=BUSY_TIMEOUT_MS):
+        """
+        Sleep until /tc_busy goes high, the busy IRQ wakes us as soon as it does
+        :param timeout_ms: Give up after this long, None to wait as long as it takes
+        """
+        start = time.ticks_ms()
+        while self.tc_busy_bar() == 0:
+            if (
+                timeout_ms is not None
+                and time.ticks_diff(time.ticks_ms(), start) > timeout_ms
+            ):
+                raise BusyTimeout("Display busy for over %dms" % timeout_ms)
+            machine.idle()
 
     def enable(self):
         self.tc_en_bar.value(0)  # Power up
@@ -66,21 +178,46 @@ class EPD(object):
     def disable(self):
         self.tc_en_bar.value(1)  # Off
 
-    def send_command(self, ins, p1, p2, data=None, expected=None):
-
-        # These command variables are always sent
-        cmd = struct.pack("3B", ins, p1, p2)
+    def send_command(
+        self,
+        ins,
+        p1,
+        p2,
+        data=None,
+        expected=None,
+        data_size=0,
+        timeout_ms=BUSY_TIMEOUT_MS,
+    ):
+        """
+        :param data: Bytes to send with it
+        :param expected: Bytes of response, 0 for null-terminated, None for none
+        :param data_size: Instead of data, this many bytes already in payload()
+        :param timeout_ms: How long it can stay busy, as for wait_ready()
+        :return: The response, without the status word
+        """
+        # Only start once it's finished with the last one
+        self.wait_ready(timeout_ms)
 
         # Looks like data is only sent with the length (Lc)
         if data:
-            assert len(data) <= 251  # Thus speaks the datasheet
-            cmd += struct.pack("B", len(data))
-            cmd += data
+            data_size = len(data)
+            assert data_size <= EPD.MAX_DATA
+            self.command[4 : 4 + data_size] = data
+
+        # These command variables are always sent
+        if data_size:
+            struct.pack_into("4B", self.command, 0, ins, p1, p2, data_size)
+            length = 4 + data_size
+        else:
+            struct.pack_into("3B", self.command, 0, ins, p1, p2)
+            length = 3
 
         # Expected data is either not present at all, 0 for null-terminated, or a number for fixed
         if expected is not None:
-            cmd += struct.pack("B", expected)
+            self.command[length] = expected
+            length += 1
 
+        cmd = EPD.view(self.commands, self.command, 0, length)
         if self.debug:
             print("Sending: " + hexlify(cmd).decode())
 
@@ -88,42 +225,40 @@ class EPD(object):
 
         # Wait for a little while
         time.sleep_us(15)  # This should take at most 14.5us
-        while self.tc_busy_bar() == 0:
-            machine.idle()
+        self.wait_ready(timeout_ms)
 
         # Request a response
-        if expected is not None:
-            if expected > 0:
-                result_bytes = self.spi.read(2 + expected)
-            else:
-                result_bytes = self.spi.read(EPD.MAX_READ)
-                strlen = result_bytes.find(b"\x00")
-                result_bytes = (
-                    result_bytes[:strlen] + result_bytes[strlen + 1 : strlen + 3]
-                )
+        if expected == 0:
+            result_bytes = self.spi.read(EPD.MAX_READ)
+            strlen = result_bytes.find(b"\x00")
+            result_bytes = result_bytes[:strlen] + result_bytes[strlen + 1 : strlen + 3]
         else:
-            result_bytes = self.spi.read(2)
+            result_bytes = EPD.view(
+                self.responses, self.response, 0, 2 + (expected or 0)
+            )
+            self.spi.readinto(result_bytes)
 
         if self.debug:
             print("Received: " + hexlify(result_bytes).decode())
 
-        (result,) = struct.unpack_from(">H", result_bytes[-2:])
+        (result,) = struct.unpack_from(">H", result_bytes, len(result_bytes) - 2)
 
         if result != EPD.SW_NORMAL_PROCESSING:
             raise ValueError("Bad result code: 0x%x" % result)
 
-        return result_bytes[:-2]
+        # Only commands that return something pay for a copy of it
+        return bytes(result_bytes[:-2]) if len(result_bytes) > 2 else b""
 
     @staticmethod
-    def calculate_checksum(data, skip=16):
+    def calculate_checksum(data, skip=16, acc=CHECKSUM_INIT):
         """
         Initial checksum value is 0x6363
 
         :param data:
         :param skip: Skip some data as slices are expensive
+        :param acc: Checksum so far, to carry on from for the next chunk
         :return:
         """
-        acc = 0x6363
         for byte in data:
             if skip > 0:
                 skip -= 1
@@ -154,7 +289,8 @@ class EPD(object):
         cmd = 0x86
         if flash:
             cmd = 0x24
-        self.send_command(cmd, 1, slot)
+        # A refresh takes seconds, longer when it's cold, so no limit on it
+        self.send_command(cmd, 1, slot, timeout_ms=None)
 
     def reset_data_pointer(self):
         self.send_command(0x20, 0xD, 0)
@@ -167,16 +303,23 @@ class EPD(object):
         (cksum,) = struct.unpack(">H", cksum_val)
         return cksum
 
-    def upload_image_data(self, data, slot=0, delay_us=1000):
-        self.send_command(0x20, 1, slot, data)
-        time.sleep_us(delay_us)
+    def upload_image_data(self, data, slot=0, delay_us=0, data_size=0):
+        """
+        :param data: Up to 250 bytes of the image, or None if it's in payload()
+        :param slot: Slot framebuffer number to use
+        :param delay_us: Extra delay after, send_command() already waits until
+        the display's ready for more
+        :param data_size: Bytes in payload(), when there's no data
+        """
+        self.send_command(0x20, 1, slot, data, data_size=data_size)
+        if delay_us:
+            time.sleep_us(delay_us)
 
     def upload_whole_image(self, img, slot=0):
         """
         Chop up chunks and send it
         :param img: Image to send in EPD format
         :param slot: Slot framebuffer number to use
-        :param delay_us: Delay between packets? 450us and the Tbusy line never comes back
         :return:
         """
         total = len(img)
@@ -24,6 +24,7 @@ Pass: different_secret
 Image: data.bin
 Meta: metadata.json
 Up: upload.php
+Ahead: 2
 """
         with StringIO(pretend) as sio:
             cfg = Config.load_file(sio)
@@ -32,6 +33,7 @@ Up: upload.php
             self.assertEqual(cfg.port, 80)
             self.assertEqual(cfg.metadata_path, "metadata.json")
             self.assertEqual(cfg.upload_path, "upload.php")
+            self.assertEqual(cfg.ahead, 2)
             self.assertDictEqual(
                 cfg.wifi, {"MySSID": "ssshItsSecret", "Another": "different_secret"}
             )
@@ -1,9 +1,21 @@
-from datetime import datetime
+import json
+import os.path
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import datetime, timedelta, timezone
 from logging.config import dictConfig
 
-from flask import Flask, abort, request
+import metrics
+from flask import Flask, Response, abort, g, jsonify, request
+from frame_delta import FrameCache, make_delta
+from frame_index import FrameIndex
 from lxml import etree
+from status_log import StatusLog
 from tzlocal import get_localzone
+from wake_schedule import DeviceDrift, WakeSchedule
+from wake_slots import WakeSlots
 from werkzeug.middleware.proxy_fix import ProxyFix
 
 dictConfig(
@@ -32,6 +44,85 @@ tz = get_localzone()
 
 SERVER_METADATA = "/static/server.xml"
 MAX_ENTRIES = 1000
+STATUS_LOG = StatusLog(MAX_ENTRIES)
+FRAMES = FrameIndex(os.path.join(app.static_folder, "frames"))
+FRAME_CACHE = FrameCache()
+WAKES = WakeSchedule(os.path.join(app.static_folder, "metadata.json"))
+DRIFT = DeviceDrift(os.path.join(app.static_folder, "drift.json"))
+# Spread the fleet's wakes over WAKE_WINDOW seconds, at most WAKE_CONCURRENCY a slot
+SLOTS = WakeSlots(
+    window=int(os.environ.get("WAKE_WINDOW", 600)),
+    slot_seconds=int(os.environ.get("WAKE_SLOT_SECONDS", 10)),
+    max_concurrent=int(os.environ.get("WAKE_CONCURRENCY", 4)),
+    path=os.path.join(app.static_folder, "slots.json"),
+)
+# The updater's render_service.py, for previews
+RENDER_URL = os.environ.get("RENDER_URL", "http://localhost:5001")
+
+REQUESTS = metrics.Counter(
+    "iot_http_requests_total", "Requests handled", ("route", "method", "status")
+)
+REQUEST_LATENCY = metrics.Histogram(
+    "iot_http_request_duration_seconds", "Time to handle a request", ("route",)
+)
+BYTES_SERVED = metrics.Counter(
+    "iot_http_response_bytes_total", "Response body bytes sent", ("route",)
+)
+NOT_MODIFIED_RATIO = metrics.Gauge(
+    "iot_http_not_modified_ratio", "304 responses per 200 response", ("route",)
+)
+BEACONS = metrics.Counter("iot_beacons_total", "Beacons received", ("device",))
+LAST_BEACON = metrics.Gauge(
+    "iot_beacon_last_timestamp_seconds", "When a device last beaconed", ("device",)
+)
+BATTERY = metrics.Gauge(
+    "iot_device_battery_percent", "Last reported battery charge", ("device",)
+)
+SCREEN_TEMP = metrics.Gauge(
+    "iot_device_screen_temperature", "Last reported screen temperature", ("device",)
+)
+STORAGE_WRITE_LATENCY = metrics.Histogram(
+    "iot_storage_write_duration_seconds", "Time to save a beacon to the XML", ()
+)
+WAKE_SLOT = metrics.Gauge(
+    "iot_device_wake_slot", "Slot in the wake window a device is given", ("device",)
+)
+WAKE_OFFSET = metrics.Gauge(
+    "iot_device_wake_offset_seconds",
+    "How long after the planned wake a device is told to wake",
+    ("device",),
+)
+WAKE_SLOT_PEAK = metrics.Gauge(
+    "iot_wake_slot_peak_devices", "Most devices sharing one wake slot", ()
+)
+RTC_DRIFT = metrics.Gauge(
+    "iot_device_rtc_drift_ppm",
+    "How fast a device's clock drifts, + if slow",
+    ("device",),
+)
+
+
+@app.before_request
+def start_timer():
+    g.start_time = time.perf_counter()
+
+
+@app.after_request
+def record_request(response):
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    REQUESTS.inc(route, request.method, response.status_code)
+    REQUEST_LATENCY.observe(time.perf_counter() - g.start_time, route)
+    if response.status_code != 304 and response.content_length:
+        BYTES_SERVED.inc(route, amount=response.content_length)
+    return response
+
+
+def wake_offset():
+    """
+    :return: Seconds the requesting device wakes after the planned time, only
+    devices that have beaconed are given a slot
+    """
+    return SLOTS.offset(request.remote_addr, assign=False)
 
 
 @app.route("/upload.php", methods=["POST"])
@@ -76,6 +167,8 @@ def hello_world():
 
     # Set timezone on the time
     now = tz.localize(datetime.now())
+    # localize() can't tell which pass through the hour the clocks go back it is
+    utc = time.time()
 
     # Store current values
     latest = etree.SubElement(client_node, "log")
@@ -84,15 +177,73 @@ def hello_world():
     latest.attrib["screen"] = screen
     latest.attrib["ip"] = request.remote_addr
     latest.attrib["time"] = now.strftime("%Y-%m-%dT%H:%M:%S")
+    # Unlike the local time this only goes up, so readers can resume from it
+    latest.attrib["utc"] = "%.3f" % utc
+    # Older devices don't say what drift they corrected their alarm by
+    drift = request.form.get("drift")
+    if drift:
+        latest.attrib["drift"] = drift
 
+    write_start = time.perf_counter()
     metadata.write(SERVER_METADATA, xml_declaration=True, pretty_print=True)
+    STORAGE_WRITE_LATENCY.observe(time.perf_counter() - write_start)
+
+    # If it's not loaded yet it'll be read from the XML when first asked for
+    if STATUS_LOG.loaded:
+        STATUS_LOG.append(utc, latest.attrib)
+
+    device = request.remote_addr
+    # Placed now, so browsers and scrapers never take up a slot
+    SLOTS.slot(device)
+    BEACONS.inc(device)
+    LAST_BEACON.set(utc, device)
+    try:
+        BATTERY.set(int(battery), device)
+        SCREEN_TEMP.set(int(screen), device)
+    except ValueError:
+        app.logger.info("Non-numeric telemetry from %s", device)
     return ""
 
 
 @app.route("/data.bin")
 def data_bin():
     app.logger.debug("Binary image requested")
-    return app.send_static_file("data.bin")
+    name = "data.bin"
+    at = request.args.get("at")
+    if at:
+        # The frame for a later wake, which the device keeps until then
+        try:
+            when = datetime(*(int(part) for part in at.split(",")), tzinfo=timezone.utc)
+        except (TypeError, ValueError):
+            abort(400)
+        # The device asked for its own wake, which is later than the frame's
+        frame = FRAMES.starting(when - timedelta(seconds=wake_offset()))
+        if not frame:
+            abort(404)
+    else:
+        frame = FRAMES.current()
+    if frame:
+        app.logger.debug("Serving frame valid from %s", frame["valid_from"])
+        name = FRAMES.path(frame)
+
+    try:
+        fp, data = FRAME_CACHE.load(os.path.join(app.static_folder, name))
+    except OSError:
+        abort(404)
+
+    # The device says what it's showing, if we still have that send the changes
+    base = FRAME_CACHE.get(request.args.get("base", ""))
+    delta = make_delta(base, data) if base else None
+    if delta is not None and len(delta) < len(data):
+        app.logger.debug("Sending %d byte delta", len(delta))
+        rsp = Response(delta, mimetype="application/octet-stream")
+    else:
+        rsp = app.send_static_file(name)
+    rsp.headers["X-Frame"] = fp
+    wake = WAKES.header(wake_offset())
+    if wake:
+        rsp.headers["X-Wake"] = wake
+    return rsp
 
 
 @app.route("/data.png")
@@ -101,13 +252,95 @@ def data_png():
     return app.send_static_file("data.png")
 
 
+@app.route("/preview.png", defaults={"fmt": "png"})
+@app.route("/preview.bin", defaults={"fmt": "epd"})
+def preview(fmt):
+    """
+    Render at another time, via the updater's render service which caches them
+    """
+    query = urllib.parse.urlencode(
+        {"time": request.args.get("time", ""), "format": fmt}
+    )
+    app.logger.debug("Preview requested for %s", request.args.get("time"))
+    try:
+        with urllib.request.urlopen(
+            "%s/render?%s" % (RENDER_URL, query), timeout=30
+        ) as rsp:
+            return Response(rsp.read(), mimetype=rsp.headers.get_content_type())
+    except urllib.error.HTTPError as e:
+        abort(e.code)
+    except OSError:
+        app.logger.warning("Render service unavailable at %s", RENDER_URL)
+        abort(503)
+
+
 @app.route("/status.html")
 def send_status():
     app.logger.debug("Status page")
     return app.send_static_file("status.html")
 
 
+@app.route("/status.json")
+def send_status_data():
+    app.logger.debug("Status data")
+    since = request.args.get("since", 0, type=float)
+    limit = request.args.get("limit", 100, type=int)
+    STATUS_LOG.load(SERVER_METADATA)
+    cursor, events = STATUS_LOG.since(since, limit)
+
+    wakeup = WAKES.next_wake()
+    if wakeup:
+        wakeup = datetime(*wakeup).isoformat()
+    else:
+        app.logger.info("No wakeup to report")
+
+    image_time = None
+    try:
+        image_time = datetime.fromtimestamp(
+            os.path.getmtime(os.path.join(app.static_folder, "data.png"))
+        ).isoformat()
+    except OSError:
+        app.logger.info("No image to report")
+
+    return jsonify(cursor=cursor, wakeup=wakeup, image_time=image_time, events=events)
+
+
+@app.route("/chart.svg")
+def send_chart():
+    app.logger.debug("Status chart")
+    return app.send_static_file("chart.svg")
+
+
+@app.route("/trend.svg")
+def send_trend():
+    app.logger.debug("Status trend chart")
+    return app.send_static_file("trend.svg")
+
+
 @app.route("/metadata.json")
 def send_metadata():
     app.logger.debug("Metadata")
-    return app.send_static_file("metadata.json")
+    metadata = WAKES.for_device(wake_offset(), DRIFT.drift(request.remote_addr))
+    if metadata is None:
+        abort(404)
+    return Response(json.dumps(metadata), mimetype="application/json")
+
+
+@app.route("/metrics")
+def send_metrics():
+    # Ratios are cheap to derive, so only work them out when scraped
+    # Summed over methods, HEAD and conditional requests can be 304'd too
+    full, not_modified = {}, {}
+    for (route, _, status), count in REQUESTS.items():
+        if status == 200:
+            full[route] = full.get(route, 0) + count
+        elif status == 304:
+            not_modified[route] = not_modified.get(route, 0) + count
+    for route, count in full.items():
+        NOT_MODIFIED_RATIO.set(not_modified.get(route, 0) / count, route)
+    for device, slot in SLOTS.items():
+        WAKE_SLOT.set(slot, device)
+        WAKE_OFFSET.set(slot * SLOTS.slot_seconds, device)
+        RTC_DRIFT.set(DRIFT.drift(device), device)
+    WAKE_SLOT_PEAK.set(max(SLOTS.occupancy()))
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
@@ -0,0 +1,102 @@
+"""
+Row-based differences between EPD frames, so a device that already shows
+one frame only has to download the rows that changed for the next
+"""
+
+import hashlib
+import os.path
+import struct
+from collections import OrderedDict
+
+EPD_HEADER = 16
+DELTA_MAGIC = 0x44  # full frames start with 0x33
+
+# Magic, first changed row, number of rows, bytes per row, padded like the EPD header
+DELTA_HEADER = ">B3H9x"
+
+
+def fingerprint(data):
+    """
+    :param data: Whole EPD file
+    :return: Short hex id the device hands back to say what it's showing
+    """
+    return hashlib.sha1(data).hexdigest()[:16]
+
+
+def row_bytes(data):
+    """
+    :param data: Whole EPD file, header format 0
+    :return: Bytes per row of pixels
+    """
+    width, _, bpp = struct.unpack_from(">2HB", data, 1)
+    return (width * bpp + 7) // 8
+
+
+def make_delta(old, new):
+    """
+    :param old: EPD file the device has
+    :param new: EPD file it should show
+    :return: Delta header plus the changed rows, or None if the frames aren't comparable
+    """
+    if old[:EPD_HEADER] != new[:EPD_HEADER] or len(old) != len(new):
+        return None
+
+    stride = row_bytes(new)
+    rows = (len(new) - EPD_HEADER) // stride
+    changed = [
+        row
+        for row in range(rows)
+        if old[EPD_HEADER + row * stride : EPD_HEADER + (row + 1) * stride]
+        != new[EPD_HEADER + row * stride : EPD_HEADER + (row + 1) * stride]
+    ]
+    if not changed:
+        return struct.pack(DELTA_HEADER, DELTA_MAGIC, 0, 0, stride)
+
+    top = changed[0]
+    count = changed[-1] - top + 1
+    return struct.pack(DELTA_HEADER, DELTA_MAGIC, top, count, stride) + bytes(
+        new[EPD_HEADER + top * stride : EPD_HEADER + (top + count) * stride]
+    )
+
+
+class FrameCache(object):
+    """
+    The last few frames served, by fingerprint, as the bases deltas are made from
+    """
+
+    def __init__(self, max_frames=16):
+        self.max_frames = max_frames
+        self.frames = OrderedDict()
+        self.files = {}
+
+    def load(self, path):
+        """
+        Read a frame, only touching the disk when the file has changed
+        :param path: EPD file
+        :return: (fingerprint, data)
+        """
+        mtime = os.path.getmtime(path)
+        cached = self.files.get(path)
+        if cached and cached[0] == mtime and cached[1] in self.frames:
+            fp = cached[1]
+            self.frames.move_to_end(fp)
+            return fp, self.frames[fp]
+
+        with open(path, "rb") as frame_file:
+            data = frame_file.read()
+        fp = fingerprint(data)
+        self.files[path] = (mtime, fp)
+        self.frames[fp] = data
+        self.frames.move_to_end(fp)
+        if len(self.frames) > self.max_frames:
+            while len(self.frames) > self.max_frames:
+                self.frames.popitem(last=False)
+            self.files = {p: v for p, v in self.files.items() if v[1] in self.frames}
+        return fp, data
+
+    def get(self, fp):
+        """
+        :param fp: Fingerprint the device reported
+        :return: Frame data, or None if it's too old to remember
+        """
+        return self.frames.get(fp)
@@ -0,0 +1,74 @@
+"""
+Picks the pre-rendered frame to serve from the updater's render-ahead queue
+"""
+
+import json
+import os.path
+from bisect import bisect_right
+from datetime import datetime, timezone
+
+
+class FrameIndex(object):
+    """
+    Reads frames/frames.json, only re-parsing it when the updater replaces it
+    """
+
+    def __init__(self, frame_dir):
+        self.frame_dir = frame_dir
+        self.index_path = os.path.join(frame_dir, "frames.json")
+        self.mtime = None
+        self.starts = []
+        self.frames = []
+
+    def _refresh(self):
+        try:
+            mtime = os.path.getmtime(self.index_path)
+        except OSError:
+            self.mtime = None
+            self.starts = []
+            self.frames = []
+            return
+        if mtime == self.mtime:
+            return
+        try:
+            with open(self.index_path) as index_file:
+                frames = json.load(index_file)["frames"]
+        except (OSError, ValueError, KeyError):
+            return
+        self.mtime = mtime
+        self.frames = frames
+        self.starts = [
+            datetime.fromisoformat(frame["valid_from"]).timestamp() for frame in frames
+        ]
+
+    def current(self, now=None):
+        """
+        :param now: For testing, defaults to the current time
+        :return: Frame entry valid now, or None if there's no queue covering it
+        """
+        self._refresh()
+        if now is None:
+            now = datetime.now(timezone.utc)
+        idx = bisect_right(self.starts, now.timestamp())
+        if idx == 0:
+            return None
+        return self.frames[idx - 1]
+
+    def starting(self, when):
+        """
+        :param when: Timezone-aware time
+        :return: Frame entry that becomes valid exactly then, or None
+        """
+        self._refresh()
+        idx = bisect_right(self.starts, when.timestamp())
+        if idx == 0 or self.starts[idx - 1] != when.timestamp():
+            return None
+        return self.frames[idx - 1]
+
+    def path(self, frame, key="epd"):
+        """
+        :param frame: Entry from current()
+        :param key: "epd" or "png"
+        :return: Path of the file relative to the static folder
+        """
+        return os.path.join(os.path.basename(self.frame_dir), frame[key])
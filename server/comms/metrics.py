@@ -0,0 +1,152 @@
+"""
+Minimal in-process metrics, exported in the Prometheus text format.
+
+Updates to a label set already seen take no lock: they're a single dict lookup
+and an integer add, so the cost on the request path is a few hundred
+nanoseconds, and the worst a race can do is drop an increment, which is fine
+for monitoring.  Only adding a new label set takes the metric's lock, so a
+scrape can snapshot the values under it without the dict changing size while
+it's read.
+"""
+
+import threading
+from bisect import bisect_left
+
+REGISTRY = []
+
+# Seconds, tuned for a small Flask app serving files off local disk
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = (
+        '%s="%s"'
+        % (k, str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"'))
+        for k, v in pairs
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+class Metric(object):
+    TYPE = "untyped"
+
+    def __init__(self, name, doc, labels=()):
+        self.name = name
+        self.doc = doc
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _series(self, label_values, initial):
+        """
+        :param initial: Callable for the value of a new label set
+        :return: The current value for the label set, added if it's new
+        """
+        value = self.values.get(label_values)
+        if value is None:
+            with self.lock:
+                value = self.values.setdefault(label_values, initial())
+        return value
+
+    def items(self):
+        """
+        :return: List of (label values, value), safe to read while requests add more
+        """
+        with self.lock:
+            return list(self.values.items())
+
+    def samples(self):
+        """
+        :return: Iterable of (name suffix, label values, extra label, value)
+        """
+        for key, value in sorted(self.items()):
+            yield "", key, None, value
+
+    def render(self):
+        lines = [
+            "# HELP %s %s" % (self.name, self.doc),
+            "# TYPE %s %s" % (self.name, self.TYPE),
+        ]
+        for suffix, key, extra, value in self.samples():
+            lines.append(
+                "%s%s%s %s"
+                % (
+                    self.name,
+                    suffix,
+                    _format_labels(self.labels, key, extra),
+                    _format_value(value),
+                )
+            )
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    TYPE = "counter"
+
+    def inc(self, *label_values, amount=1):
+        self.values[label_values] = self._series(label_values, int) + amount
+
+    def get(self, *label_values):
+        return self.values.get(label_values, 0)
+
+
+class Gauge(Metric):
+    TYPE = "gauge"
+
+    def set(self, value, *label_values):
+        if label_values in self.values:
+            self.values[label_values] = value
+        else:
+            with self.lock:
+                self.values[label_values] = value
+
+
+class Histogram(Metric):
+    """
+    Fixed-bucket histogram.  Each label set keeps a list of per-bucket counts
+    (non-cumulative, so an observation touches one slot) plus a running sum.
+    """
+
+    TYPE = "histogram"
+
+    def __init__(self, name, doc, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, doc, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *label_values):
+        # Last slot is the +Inf bucket, then the sum
+        series = self._series(
+            label_values, lambda: [0] * (len(self.buckets) + 1) + [0.0]
+        )
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def samples(self):
+        for key, series in sorted(self.items()):
+            running = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series[:-1]):
+                running += count
+                yield "_bucket", key, ("le", _format_value(float(bound))), running
+            yield "_sum", key, None, series[-1]
+            yield "_count", key, None, running
+
+
+def render():
+    """
+    :return: Every registered metric in the Prometheus text exposition format
+    """
+    return "\n".join(metric.render() for metric in REGISTRY) + "\n"
@@ -0,0 +1,80 @@
+"""
+In-memory copy of the client log for the status page's JSON endpoint
+"""
+
+from bisect import bisect_right
+from datetime import datetime
+
+from lxml import etree
+
+
+class StatusLog(object):
+    """
+    Beacons held in time order so a poll only pays for the points it hasn't
+    seen.  The XML is parsed once, after that beacons are appended as they
+    arrive.
+
+    They're ordered by UTC epoch seconds, which unlike the local times shown
+    don't repeat an hour when the clocks go back.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.loaded = False
+        self.times = []
+        self.events = []
+
+    def load(self, path):
+        """
+        Pull in the existing <log> nodes, only does anything the first time
+        :param path: Server metadata XML
+        """
+        if self.loaded:
+            return
+        self.loaded = True
+        try:
+            metadata = etree.parse(path)
+        except OSError:
+            return
+        for node in metadata.iterfind("./client/log"):
+            if "utc" in node.attrib:
+                utc = float(node.attrib["utc"])
+            else:
+                # Logged before comms wrote utc, only the local time to go on
+                when = datetime.strptime(
+                    node.attrib["time"].split("+")[0], "%Y-%m-%dT%H:%M:%S"
+                )
+                utc = when.timestamp()
+                if self.times and utc <= self.times[-1]:
+                    # The second time through the hour the clocks went back
+                    utc = max(utc, when.replace(fold=1).timestamp())
+            self.append(utc, node.attrib)
+
+    def append(self, utc, attrib):
+        """
+        :param utc: Epoch seconds the beacon arrived
+        :param attrib: time, battery, reset and screen values as logged
+        """
+        self.times.append(utc)
+        self.events.append(
+            {
+                "time": attrib.get("time", "").split("+")[0],
+                "battery": attrib.get("battery"),
+                "reset": attrib.get("reset"),
+                "screen": attrib.get("screen"),
+            }
+        )
+        # Trim in batches so appends stay cheap
+        if len(self.times) > 2 * self.max_entries:
+            del self.times[: -self.max_entries]
+            del self.events[: -self.max_entries]
+
+    def since(self, cursor, limit):
+        """
+        :param cursor: UTC epoch seconds of the last point the caller has
+        :param limit: Maximum number of (the newest) points to return
+        :return: New cursor, list of events
+        """
+        start = max(bisect_right(self.times, cursor), len(self.times) - limit)
+        new_cursor = self.times[-1] if self.times else cursor
+        return new_cursor, self.events[start:]
@@ -0,0 +1,132 @@
+import os
+import os.path
+import struct
+import tempfile
+from unittest import TestCase
+
+from frame_delta import (
+    DELTA_HEADER,
+    DELTA_MAGIC,
+    EPD_HEADER,
+    FrameCache,
+    fingerprint,
+    make_delta,
+)
+
+WIDTH, HEIGHT = 32, 10
+STRIDE = WIDTH // 8
+
+
+def frame(rows=None, width=WIDTH, height=HEIGHT):
+    """
+    :param rows: Dict of row number to fill byte, the rest are 0xFF
+    :return: EPD file, header format 0
+    """
+    header = struct.pack(">B2H2B9x", 0x33, width, height, 1, 0)
+    stride = (width + 7) // 8
+    data = bytearray(b"\xff" * stride * height)
+    for row, fill in (rows or {}).items():
+        data[row * stride : (row + 1) * stride] = bytes([fill]) * stride
+    return header + bytes(data)
+
+
+def apply_delta(old, delta):
+    """
+    What the client's Display.apply_delta() does to its saved copy
+    """
+    magic, top, rows, stride = struct.unpack_from(DELTA_HEADER, delta)
+    assert magic == DELTA_MAGIC
+    patched = bytearray(old)
+    start = EPD_HEADER + top * stride
+    patched[start : start + rows * stride] = delta[EPD_HEADER:]
+    return bytes(patched)
+
+
+class TestMakeDelta(TestCase):
+    def test_unchanged(self):
+        delta = make_delta(frame(), frame())
+        self.assertEqual(len(delta), EPD_HEADER)
+        self.assertEqual(
+            struct.unpack(DELTA_HEADER, delta), (DELTA_MAGIC, 0, 0, STRIDE)
+        )
+
+    def test_changed_rows(self):
+        old = frame({4: 0x00})
+        new = frame({2: 0x0F, 6: 0xF0})
+        delta = make_delta(old, new)
+        # From the first changed row to the last, the unchanged one between too
+        self.assertEqual(
+            struct.unpack_from(DELTA_HEADER, delta), (DELTA_MAGIC, 2, 5, STRIDE)
+        )
+        self.assertEqual(len(delta), EPD_HEADER + 5 * STRIDE)
+        self.assertEqual(apply_delta(old, delta), new)
+
+    def test_top_and_bottom_rows(self):
+        old = frame()
+        top = frame({0: 0x00})
+        delta = make_delta(old, top)
+        self.assertEqual(struct.unpack_from(DELTA_HEADER, delta)[1:3], (0, 1))
+        self.assertEqual(apply_delta(old, delta), top)
+
+        bottom = frame({HEIGHT - 1: 0x00})
+        delta = make_delta(old, bottom)
+        self.assertEqual(struct.unpack_from(DELTA_HEADER, delta)[1:3], (HEIGHT - 1, 1))
+        self.assertEqual(apply_delta(old, delta), bottom)
+
+        both = frame({0: 0x00, HEIGHT - 1: 0x00})
+        delta = make_delta(old, both)
+        self.assertEqual(struct.unpack_from(DELTA_HEADER, delta)[1:3], (0, HEIGHT))
+        self.assertEqual(apply_delta(old, delta), both)
+
+    def test_not_comparable(self):
+        self.assertIsNone(make_delta(frame(), frame(height=HEIGHT + 1)))
+        self.assertIsNone(make_delta(frame(), frame(width=WIDTH + 8)))
+        other = bytearray(frame())
+        other[0] = 0x34
+        self.assertIsNone(make_delta(frame(), bytes(other)))
+
+
+class TestFrameCache(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, name, data):
+        path = os.path.join(self.tmp.name, name)
+        with open(path, "wb") as frame_file:
+            frame_file.write(data)
+        return path
+
+    def test_load_and_get(self):
+        data = frame({1: 0x00})
+        path = self.write("a.bin", data)
+        cache = FrameCache()
+        fp, loaded = cache.load(path)
+        self.assertEqual(fp, fingerprint(data))
+        self.assertEqual(loaded, data)
+        self.assertIs(cache.load(path)[1], loaded)
+        self.assertEqual(cache.get(fp), data)
+        self.assertIsNone(cache.get("unknown"))
+
+        # A new file at the same path is read again
+        changed = frame({2: 0x00})
+        self.write("a.bin", changed)
+        os.utime(path, (1, 1))
+        self.assertEqual(cache.load(path), (fingerprint(changed), changed))
+
+    def test_eviction_prunes_files(self):
+        cache = FrameCache(max_frames=2)
+        paths = [self.write("%d.bin" % i, frame({i: 0x00})) for i in range(3)]
+        fps = [cache.load(path)[0] for path in paths]
+
+        self.assertEqual(list(cache.frames), fps[1:])
+        self.assertIsNone(cache.get(fps[0]))
+        self.assertEqual(sorted(cache.files), sorted(paths[1:]))
+
+        # Touching one keeps it over the one loaded before it
+        cache.load(paths[1])
+        cache.load(paths[0])
+        self.assertEqual(list(cache.frames), [fps[1], fps[0]])
+        self.assertEqual(sorted(cache.files), sorted([paths[0], paths[1]]))
@@ -0,0 +1,82 @@
+import json
+import os
+import os.path
+import tempfile
+from datetime import datetime, timedelta, timezone
+from unittest import TestCase
+
+from frame_index import FrameIndex
+
+START = datetime(2024, 5, 1, 1, tzinfo=timezone.utc)
+
+
+class TestFrameIndex(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.frame_dir = os.path.join(self.tmp.name, "frames")
+        os.makedirs(self.frame_dir)
+        self.starts = [START + timedelta(hours=6 * i) for i in range(3)]
+        self.write(self.starts)
+        self.index = FrameIndex(self.frame_dir)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, starts, mtime=None):
+        path = os.path.join(self.frame_dir, "frames.json")
+        frames = [
+            {
+                "valid_from": when.isoformat(),
+                "epd": "%d.bin" % when.timestamp(),
+                "png": "%d.png" % when.timestamp(),
+            }
+            for when in starts
+        ]
+        with open(path, "w") as index_file:
+            json.dump({"inputs": "x", "frames": frames}, index_file)
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+
+    def test_current(self):
+        second = self.starts[1]
+        self.assertIsNone(self.index.current(START - timedelta(seconds=1)))
+        self.assertEqual(self.index.current(START)["valid_from"], START.isoformat())
+        # A frame is served from the moment it's valid
+        self.assertEqual(
+            self.index.current(second - timedelta(seconds=1))["valid_from"],
+            START.isoformat(),
+        )
+        self.assertEqual(self.index.current(second)["valid_from"], second.isoformat())
+        # The last carries on until there's a new queue
+        self.assertEqual(
+            self.index.current(self.starts[-1] + timedelta(days=1))["valid_from"],
+            self.starts[-1].isoformat(),
+        )
+
+    def test_starting(self):
+        second = self.starts[1]
+        self.assertEqual(self.index.starting(second)["valid_from"], second.isoformat())
+        self.assertIsNone(self.index.starting(second + timedelta(seconds=1)))
+        self.assertIsNone(self.index.starting(START - timedelta(hours=1)))
+
+    def test_path(self):
+        frame = self.index.current(START)
+        self.assertEqual(
+            self.index.path(frame), os.path.join("frames", "%d.bin" % START.timestamp())
+        )
+        self.assertEqual(
+            self.index.path(frame, "png"),
+            os.path.join("frames", "%d.png" % START.timestamp()),
+        )
+
+    def test_replaced_and_removed(self):
+        self.assertIsNotNone(self.index.current(START))
+        later = [START + timedelta(days=1)]
+        self.write(later, mtime=1)
+        self.assertIsNone(self.index.current(START))
+        self.assertEqual(
+            self.index.current(later[0])["valid_from"], later[0].isoformat()
+        )
+
+        os.remove(os.path.join(self.frame_dir, "frames.json"))
+        self.assertIsNone(self.index.current(later[0]))
@@ -0,0 +1,78 @@
+from unittest import TestCase
+
+import metrics
+
+
+class TestMetrics(TestCase):
+    def setUp(self):
+        # Only what each test registers, not the app's metrics
+        self.registry = metrics.REGISTRY[:]
+        del metrics.REGISTRY[:]
+
+    def tearDown(self):
+        metrics.REGISTRY[:] = self.registry
+
+    def test_counter_render(self):
+        requests = metrics.Counter("requests_total", "Requests", ("route", "status"))
+        requests.inc("/image", 200)
+        requests.inc("/image", 200)
+        requests.inc('/a"b', 304, amount=3)
+
+        self.assertEqual(requests.get("/image", 200), 2)
+        self.assertEqual(
+            metrics.render(),
+            "# HELP requests_total Requests\n"
+            "# TYPE requests_total counter\n"
+            'requests_total{route="/a\\"b",status="304"} 3\n'
+            'requests_total{route="/image",status="200"} 2\n',
+        )
+
+    def test_gauge_render(self):
+        battery = metrics.Gauge("battery", "Charge", ("device",))
+        battery.set(80, "clock")
+        battery.set(75.5, "clock")
+        self.assertIn('battery{device="clock"} 75.5', battery.render())
+
+    def test_histogram_buckets_inclusive(self):
+        latency = metrics.Histogram("latency", "Time", (), buckets=(0.1, 1))
+        latency.observe(0.1)
+        latency.observe(0.5)
+        latency.observe(1)
+        latency.observe(5)
+
+        lines = latency.render().split("\n")[2:]
+        self.assertEqual(
+            lines,
+            [
+                'latency_bucket{le="0.1"} 1',
+                'latency_bucket{le="1.0"} 3',
+                'latency_bucket{le="+Inf"} 4',
+                "latency_sum 6.6",
+                "latency_count 4",
+            ],
+        )
+
+    def test_items_is_a_snapshot(self):
+        requests = metrics.Counter("requests_total", "Requests", ("route",))
+        requests.inc("/image")
+        items = requests.items()
+        requests.inc("/metadata.json")
+        self.assertEqual(items, [(("/image",), 1)])
+
+
+class TestMetricsEndpoint(TestCase):
+    def test_metrics_response(self):
+        import app
+
+        client = app.app.test_client()
+        client.get("/metrics")
+        response = client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, "text/plain")
+        body = response.get_data(as_text=True)
+        self.assertIn("# TYPE iot_http_requests_total counter", body)
+        self.assertIn(
+            'iot_http_requests_total{route="/metrics",method="GET",status="200"} 1',
+            body,
+        )
+        self.assertIn("iot_wake_slot_peak_devices 0", body)
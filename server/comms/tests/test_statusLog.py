@@ -0,0 +1,93 @@
+import os
+import os.path
+import tempfile
+import time
+from unittest import TestCase
+
+from lxml import etree
+from status_log import StatusLog
+
+
+def log_node(client, when, battery, utc=None):
+    node = etree.SubElement(
+        client, "log", battery=str(battery), reset="sleep", screen="20", time=when
+    )
+    if utc is not None:
+        node.attrib["utc"] = "%.3f" % utc
+    return node
+
+
+class TestStatusLog(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "server.xml")
+        # Clocks go back at 02:00 BST on 27 Oct 2024
+        self.tz = os.environ.get("TZ")
+        os.environ["TZ"] = "Europe/London"
+        time.tzset()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+        if self.tz is None:
+            del os.environ["TZ"]
+        else:
+            os.environ["TZ"] = self.tz
+        time.tzset()
+
+    def write(self, root):
+        etree.ElementTree(root).write(self.path)
+
+    def test_load_and_since(self):
+        root = etree.Element("display")
+        client = etree.SubElement(root, "client")
+        # Both passes through 01:30, then after
+        log_node(client, "2024-10-27T01:30:00", 50, 1729989000)
+        log_node(client, "2024-10-27T01:30:00", 49, 1729992600)
+        log_node(client, "2024-10-27T02:30:00", 48, 1729996200)
+        self.write(root)
+
+        status = StatusLog(10)
+        status.load(self.path)
+        cursor, events = status.since(0, 100)
+        self.assertEqual([ev["battery"] for ev in events], ["50", "49", "48"])
+        self.assertEqual(cursor, 1729996200)
+
+        # The repeated hour isn't taken for points already seen
+        cursor, events = status.since(1729989000, 100)
+        self.assertEqual([ev["battery"] for ev in events], ["49", "48"])
+        self.assertEqual(status.since(cursor, 100), (cursor, []))
+        # Only the newest when there's more than the limit
+        self.assertEqual(len(status.since(0, 2)[1]), 2)
+        self.assertEqual(status.since(0, 2)[1][0]["battery"], "49")
+
+        # Only loaded once
+        status.load(self.path)
+        self.assertEqual(len(status.times), 3)
+
+    def test_load_without_utc(self):
+        root = etree.Element("display")
+        client = etree.SubElement(root, "client")
+        log_node(client, "2024-10-27T01:30:00", 50)
+        log_node(client, "2024-10-27T01:30:00", 49)
+        self.write(root)
+
+        status = StatusLog(10)
+        status.load(self.path)
+        # The second one's taken as the later pass through the hour
+        self.assertEqual(status.times, [1729989000, 1729992600])
+
+    def test_missing_file(self):
+        status = StatusLog(10)
+        status.load(os.path.join(self.tmp.name, "none.xml"))
+        self.assertTrue(status.loaded)
+        self.assertEqual(status.since(5, 10), (5, []))
+
+    def test_append_trims(self):
+        status = StatusLog(3)
+        status.loaded = True
+        for i in range(7):
+            status.append(1000 + i, {"time": "2024-01-01T00:00:%02d" % i})
+        # Trimmed back to max once it passes twice that
+        self.assertEqual(status.times, [1004, 1005, 1006])
+        self.assertEqual(status.events[0]["time"], "2024-01-01T00:00:04")
+        self.assertEqual(status.since(1004, 10)[1][0]["time"], "2024-01-01T00:00:05")
@@ -0,0 +1,81 @@
+import datetime
+import json
+import os.path
+import tempfile
+from unittest import TestCase
+
+from wake_schedule import DeviceDrift, WakeSchedule, shift
+
+
+def next_wake(schedule, now):
+    """
+    The first wake after now, as the client's Display.next_wake() picks it
+    """
+    for wake in schedule["schedule"]:
+        if tuple(wake[:6]) > tuple(now[:6]):
+            return tuple(wake[:6])
+    return None
+
+
+class TestWakeSchedule(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "metadata.json")
+        first = datetime.datetime(2024, 12, 31, 23, 59, 30)
+        times = [first + datetime.timedelta(hours=6 * i) for i in range(3)]
+        with open(self.path, "w") as metadata_file:
+            # As the updater writes it, wakeup is a whole time tuple
+            json.dump(
+                {
+                    "wakeup": list(first.timetuple()),
+                    "schedule": [list(when.timetuple()[:6]) for when in times],
+                    "until": list(times[-1].timetuple()[:6]),
+                },
+                metadata_file,
+            )
+        self.wakes = WakeSchedule(self.path)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_header_matches_stored_schedule(self):
+        now = (2024, 12, 31, 23, 0, 0)
+        for offset in (0, 10, 590):
+            header = self.wakes.header(offset)
+            # How the client's Connect reads X-Wake
+            server_wake = tuple(int(x) for x in header.split(","))
+            metadata = self.wakes.for_device(offset)
+            self.assertEqual(server_wake, next_wake(metadata, now))
+
+        self.assertEqual(self.wakes.header(40), "2025,1,1,0,0,10")
+
+    def test_for_device_shifts_every_wake(self):
+        metadata = self.wakes.for_device(60, drift=12)
+        self.assertEqual(
+            metadata["schedule"],
+            [[2025, 1, 1, 0, 0, 30], [2025, 1, 1, 6, 0, 30], [2025, 1, 1, 12, 0, 30]],
+        )
+        self.assertEqual(metadata["until"], [2025, 1, 1, 12, 0, 30])
+        self.assertEqual(metadata["wakeup"][:6], [2025, 1, 1, 0, 0, 30])
+        self.assertEqual(len(metadata["wakeup"]), 9)
+        self.assertEqual(metadata["drift"], 12)
+        # The stored copy isn't changed for the next device
+        self.assertEqual(self.wakes.for_device()["until"], [2025, 1, 1, 11, 59, 30])
+        self.assertNotIn("drift", self.wakes.for_device())
+
+    def test_missing(self):
+        wakes = WakeSchedule(os.path.join(self.tmp.name, "none.json"))
+        self.assertIsNone(wakes.header(10))
+        self.assertIsNone(wakes.for_device(10))
+
+    def test_shift(self):
+        self.assertEqual(shift([2024, 2, 28, 23, 59, 0], 120), [2024, 2, 29, 0, 1, 0])
+        self.assertEqual(shift([2024, 2, 28, 23, 59, 0], 0), [2024, 2, 28, 23, 59, 0])
+
+    def test_drift(self):
+        path = os.path.join(self.tmp.name, "drift.json")
+        with open(path, "w") as drift_file:
+            json.dump({"clock": {"drift": 20}}, drift_file)
+        drift = DeviceDrift(path)
+        self.assertEqual(drift.drift("clock"), 20)
+        self.assertEqual(drift.drift("other"), 0)
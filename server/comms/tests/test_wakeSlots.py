@@ -0,0 +1,71 @@
+import json
+import os.path
+import tempfile
+import threading
+from unittest import TestCase
+
+from wake_slots import WakeSlots
+
+
+def same_slot(slots, count):
+    """
+    :return: count device names that all prefer the same slot
+    """
+    names = {}
+    i = 0
+    while True:
+        name = "10.0.0.%d" % i
+        names.setdefault(slots.preferred(name), []).append(name)
+        for group in names.values():
+            if len(group) == count:
+                return group
+        i += 1
+
+
+class TestWakeSlots(TestCase):
+    def test_cap_wraps_to_next_free_slot(self):
+        slots = WakeSlots(window=60, slot_seconds=10, max_concurrent=2)
+        devices = same_slot(slots, 5)
+        start = slots.preferred(devices[0])
+
+        placed = [slots.slot(device) for device in devices]
+        self.assertEqual(placed[:2], [start, start])
+        self.assertEqual(placed[2:4], [(start + 1) % 6] * 2)
+        self.assertEqual(placed[4], (start + 2) % 6)
+        self.assertLessEqual(max(slots.occupancy()), 2)
+        # Kept, not placed again
+        self.assertEqual(slots.slot(devices[0]), start)
+        self.assertEqual(slots.offset(devices[2]), placed[2] * 10)
+        self.assertEqual(slots.offset("unknown", assign=False), 0)
+
+    def test_full_window_takes_least_loaded(self):
+        slots = WakeSlots(window=20, slot_seconds=10, max_concurrent=1)
+        for i in range(3):
+            slots.slot("device%d" % i)
+        self.assertEqual(sorted(slots.occupancy()), [1, 2])
+
+    def test_cap_held_across_threads(self):
+        slots = WakeSlots(window=60, slot_seconds=10, max_concurrent=2)
+        devices = same_slot(slots, 12)
+        threads = [
+            threading.Thread(target=slots.slot, args=(device,)) for device in devices
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(slots.occupancy(), [2] * 6)
+
+    def test_saved_and_loaded(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "slots.json")
+            slots = WakeSlots(window=60, slot_seconds=10, path=path)
+            slot = slots.slot("clock")
+            self.assertEqual(os.listdir(tmp), ["slots.json"])
+            with open(path) as slots_file:
+                self.assertEqual(json.load(slots_file), {"clock": slot})
+
+            self.assertEqual(WakeSlots(window=60, path=path).assigned, {"clock": slot})
+            # A narrower window drops slots past its end
+            narrow = WakeSlots(window=10, slot_seconds=10, path=path)
+            self.assertEqual(narrow.slot("clock"), 0)
@@ -0,0 +1,116 @@
+"""
+The wakes the updater planned, as published in metadata.json, and how far
+each device's clock drifts from them
+"""
+
+import json
+import os.path
+from datetime import datetime, timedelta
+
+
+class UpdaterJson(object):
+    """
+    A JSON file the updater writes, only re-parsed when it's replaced
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.mtime = None
+        self.metadata = None
+
+    def _refresh(self):
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            self.mtime = None
+            self.metadata = None
+            return
+        if mtime == self.mtime:
+            return
+        try:
+            with open(self.path) as metadata_file:
+                metadata = json.load(metadata_file)
+        except (OSError, ValueError):
+            return
+        self.mtime = mtime
+        self.metadata = metadata
+
+
+class DeviceDrift(UpdaterJson):
+    """
+    drift.json, from the updater's rtc_drift.py
+    """
+
+    def drift(self, device):
+        """
+        :param device: Device name
+        :return: How fast its RTC drifts in whole ppm, positive if it wakes
+        late, or 0 if that's not known
+        """
+        self._refresh()
+        try:
+            return int(self.metadata[device]["drift"])
+        except (KeyError, TypeError, ValueError):
+            return 0
+
+
+class WakeSchedule(UpdaterJson):
+    """
+    metadata.json
+    """
+
+    def next_wake(self, offset=0):
+        """
+        :param offset: Seconds to move it on by, for the device asking
+        :return: Next wake as [Y, m, d, H, M, S] in GMT, or None if there isn't one
+        """
+        self._refresh()
+        try:
+            return shift(self.metadata["wakeup"][:6], offset)
+        except (KeyError, TypeError):
+            return None
+
+    def header(self, offset=0):
+        """
+        :param offset: As for next_wake()
+        :return: X-Wake value, so a device with a stored schedule can tell
+        whether it still agrees without fetching metadata.json
+        """
+        wake = self.next_wake(offset)
+        return ",".join(str(part) for part in wake) if wake else None
+
+    def for_device(self, offset=0, drift=0):
+        """
+        :param offset: As for next_wake()
+        :param drift: From DeviceDrift.drift(), the device corrects its alarms
+        by it.  The times stay as planned, so they still match X-Wake.
+        :return: metadata.json with every wake moved on by offset, or None if
+        there isn't one
+        """
+        self._refresh()
+        if self.metadata is None:
+            return None
+        metadata = dict(self.metadata)
+        if drift:
+            metadata["drift"] = drift
+        if "wakeup" in metadata:
+            metadata["wakeup"] = shift(metadata["wakeup"], offset)
+        if "schedule" in metadata:
+            metadata["schedule"] = [
+                shift(when, offset) for when in metadata["schedule"]
+            ]
+        if "until" in metadata:
+            metadata["until"] = shift(metadata["until"], offset)
+        return metadata
+
+
+def shift(when, offset):
+    """
+    :param when: [Y, m, d, H, M, S], or a whole GMT time tuple
+    :param offset: Seconds
+    :return: The same fields offset seconds later
+    """
+    if not offset:
+        return list(when)
+    later = datetime(*when[:6]) + timedelta(seconds=offset)
+    return list(later.utctimetuple()[: len(when)])
@@ -0,0 +1,144 @@
+"""
+Spreads the fleet's wakes over a window, so every clock at a station doesn't
+hit the server in the same second
+"""
+
+import json
+import logging
+import os
+import tempfile
+import threading
+import zlib
+
+logger = logging.getLogger(__name__)
+
+
+class WakeSlots(object):
+    """
+    Each device gets a fixed slot in a window after every planned wake and is
+    told to wake that much later.  The preferred slot comes from a hash of the
+    device's name, so it's the same on every restart.  A slot takes at most
+    max_concurrent devices, one whose slot is full takes the next with room.
+    Devices are placed in the order they're first seen and kept, so a new
+    device never moves one already placed.
+    """
+
+    def __init__(self, window=600, slot_seconds=10, max_concurrent=4, path=None):
+        """
+        :param window: Seconds wakes are spread over, 0 to not spread them
+        :param slot_seconds: Width of a slot, about how long a wake keeps the server busy
+        :param max_concurrent: Most devices in one slot
+        :param path: JSON file the assignments are kept in, or None to not keep them
+        """
+        self.slots = max(1, window // slot_seconds) if window > 0 else 1
+        self.slot_seconds = slot_seconds
+        self.max_concurrent = max_concurrent
+        self.path = path
+        self.assigned = {}
+        # Placing a device reads, adds to and saves assigned under this, so two
+        # requests can't both take the last place in a slot
+        self.lock = threading.RLock()
+        self.load()
+
+    def load(self):
+        if not self.path:
+            return
+        try:
+            with open(self.path) as slots_file:
+                assigned = json.load(slots_file)
+        except (OSError, ValueError):
+            return
+        # Slots past the end are from a wider window, place those devices again
+        self.assigned = {
+            device: slot
+            for device, slot in assigned.items()
+            if isinstance(slot, int) and 0 <= slot < self.slots
+        }
+
+    def save(self):
+        if not self.path:
+            return
+        tmp_path = None
+        try:
+            # Through a temporary file, so a crash mid-write can't lose every slot
+            fd, tmp_path = tempfile.mkstemp(
+                dir=os.path.dirname(self.path) or ".", suffix=".tmp"
+            )
+            with os.fdopen(fd, "w") as slots_file:
+                json.dump(dict(self.items()), slots_file, indent=1, sort_keys=True)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            logger.exception("Can't save wake slots to %s", self.path)
+            if tmp_path and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def preferred(self, device):
+        """
+        :param device: Device name
+        :return: Slot from the name alone, crc32 as hash() differs between runs
+        """
+        return zlib.crc32(device.encode()) % self.slots
+
+    def occupancy(self):
+        """
+        :return: List of devices in each slot
+        """
+        counts = [0] * self.slots
+        for _, slot in self.items():
+            counts[slot] += 1
+        return counts
+
+    def items(self):
+        """
+        :return: List of (device, slot), safe to read while devices are placed
+        """
+        with self.lock:
+            return list(self.assigned.items())
+
+    def slot(self, device):
+        """
+        :param device: Device name
+        :return: Slot index, placing the device if it's new
+        """
+        slot = self.assigned.get(device)
+        if slot is not None:
+            return slot
+
+        with self.lock:
+            return self._place(device)
+
+    def _place(self, device):
+        """
+        :param device: Device name, called with the lock held
+        :return: Slot it's given, which is saved
+        """
+        slot = self.assigned.get(device)
+        if slot is not None:
+            # Placed by another request while we waited for the lock
+            return slot
+
+        counts = self.occupancy()
+        start = self.preferred(device)
+        for step in range(self.slots):
+            slot = (start + step) % self.slots
+            if counts[slot] < self.max_concurrent:
+                break
+        else:
+            # More devices than the window holds, least loaded slot it is
+            slot = min(range(self.slots), key=lambda s: (counts[s], s != start))
+            logger.warning(
+                "%d devices is more than the wake window holds", len(self.assigned) + 1
+            )
+        self.assigned[device] = slot
+        self.save()
+        return slot
+
+    def offset(self, device, assign=True):
+        """
+        :param device: Device name
+        :param assign: Place the device if it's new, else a new one has no offset
+        :return: Seconds this device wakes after the planned time
+        """
+        if assign:
+            return self.slot(device) * self.slot_seconds
+        return self.assigned.get(device, 0) * self.slot_seconds
@@ -0,0 +1,176 @@
+"""
+Client telemetry kept as ready-to-plot series between runs
+"""
+
+import datetime
+import json
+import logging
+
+from downsample import lttb
+
+
+def local_time(text):
+    """
+    :param text: Naive local time attribute, as comms writes it
+    :return: Epoch seconds, the earlier one in the hour the clocks go back
+    """
+    return datetime.datetime.strptime(
+        text.split("+")[0], "%Y-%m-%dT%H:%M:%S"
+    ).timestamp()
+
+
+def event_time(ev):
+    """
+    :param ev: A client/log event
+    :return: Epoch seconds it arrived.  From its utc attribute, which only goes
+    up; events from before comms wrote that only have the local time
+    """
+    utc = ev.attrib.get("utc")
+    if utc is not None:
+        return float(utc)
+    return local_time(ev.attrib["time"])
+
+
+def saved_cursor(cursor):
+    """
+    :param cursor: As saved, older files kept the last event's local time
+    :return: Epoch seconds
+    """
+    if isinstance(cursor, str):
+        return local_time(cursor) if cursor else 0
+    return cursor
+
+
+def events_since(events, cursor):
+    """
+    :param events: The client/log events in the XML, oldest first
+    :param cursor: event_time() of the last event already seen
+    :return: List of the events after the cursor, oldest first
+    """
+    new_events = []
+    for ev in reversed(events):
+        if event_time(ev) <= cursor:
+            break
+        new_events.append(ev)
+    new_events.reverse()
+    return new_events
+
+
+class ChartSeries(object):
+    """
+    Battery and screen temperature series for the status chart.
+
+    The <log> nodes are only ever appended to, so we remember the time of the
+    last one we parsed and only look at newer nodes on the next run.  Times are
+    held as epoch seconds to keep the saved file small.
+
+    However long the window, points() hands back at most `budget` points per
+    series so the SVG stays the same size.  The points picked are saved with
+    the series, keyed by the window and budget they were picked for, so a
+    chart redrawn from unchanged data doesn't pick them again.
+    """
+
+    def __init__(self, days=28, budget=500):
+        self.days = days
+        self.budget = budget
+        self.cursor = 0
+        self.times = []
+        self.battery = []
+        self.screen = []
+        # Series name -> {"window": ..., "indices": ...}, see selected()
+        self._selected = {}
+
+    @staticmethod
+    def load(path, days=28, budget=500):
+        """
+        :param path: JSON file written by save()
+        :param days: How much history to keep
+        :param budget: Maximum points per series to plot
+        :return: ChartSeries, empty if the file was missing or unreadable
+        """
+        series = ChartSeries(days, budget)
+        try:
+            with open(path) as series_file:
+                saved = json.load(series_file)
+            series.cursor = saved_cursor(saved["cursor"])
+            series.times = saved["time"]
+            series.battery = saved["battery"]
+            series.screen = saved["screen"]
+            series._selected = saved.get("selected", {})
+        except FileNotFoundError:
+            logging.info("No chart series saved yet")
+        except (ValueError, KeyError):
+            logging.warning("Discarding unreadable chart series at %s", path)
+            series = ChartSeries(days, budget)
+        return series
+
+    def save(self, path):
+        with open(path, "w") as series_file:
+            json.dump(
+                {
+                    "cursor": self.cursor,
+                    "time": self.times,
+                    "battery": self.battery,
+                    "screen": self.screen,
+                    "selected": self._selected,
+                },
+                series_file,
+            )
+
+    def update(self, events, now=None):
+        """
+        Fold in any log events newer than the cursor and drop expired points
+        :param events: The client/log events in the XML, oldest first
+        :param now: For testing, defaults to the current time
+        :return: True if the series changed
+        """
+        new_events = events_since(events, self.cursor)
+        for ev in new_events:
+            if "screen" not in ev.attrib:
+                continue
+            self.times.append(event_time(ev))
+            self.battery.append(int(ev.attrib["battery"]))
+            self.screen.append(int(ev.attrib["screen"]))
+
+        if new_events:
+            self.cursor = event_time(new_events[-1])
+
+        if now is None:
+            now = datetime.datetime.now()
+        cutoff = (now - datetime.timedelta(days=self.days)).timestamp()
+        expired = 0
+        while expired < len(self.times) and self.times[expired] < cutoff:
+            expired += 1
+        if expired:
+            del self.times[:expired]
+            del self.battery[:expired]
+            del self.screen[:expired]
+
+        return bool(new_events or expired)
+
+    def selected(self, name):
+        """
+        Indices of the points worth plotting, remembered for the current window.
+        Appending or expiring points moves the window, so they're picked again.
+        :param name: "battery" or "screen"
+        :return: List of indices into the series
+        """
+        if not self.times:
+            return []
+        window = [self.times[0], self.times[-1], len(self.times), self.budget]
+        cached = self._selected.get(name)
+        if cached is None or cached["window"] != window:
+            indices = lttb(self.times, getattr(self, name), self.budget).tolist()
+            cached = self._selected[name] = {"window": window, "indices": indices}
+        return cached["indices"]
+
+    def points(self, name):
+        """
+        :param name: "battery" or "screen"
+        :return: (datetime, value) pairs as pygal wants them, downsampled
+        """
+        values = getattr(self, name)
+        return [
+            (datetime.datetime.fromtimestamp(self.times[i]), values[i])
+            for i in self.selected(name)
+        ]
@@ -1,26 +1,88 @@
 import math
 from datetime import datetime, timedelta
+from functools import lru_cache
 
+import numpy as np
+from dither import to_1bpp
 from epd_generator import EPDGenerator
 from ephem_tools import EphemerisHandler
-from PIL import Image, ImageDraw, ImageFont
+from font_cache import load_font, moon_atlas, text_bbox
+from panel import DEFAULT_PANEL
+from PIL import Image, ImageDraw
+
+LITTLE_HAND_DIM = (0.05, 0.55)
+BIG_HAND_DIM = (0.075, 0.9)
+
+
+@lru_cache(maxsize=None)
+def clock_hand_table(tl, br):
+    """
+    Polygons for both hands at every minute of a 12 hour clock, worked out in
+    one go for a clock face box
+    :param tl: Top-left of the clock
+    :param br: Bottom-right of the clock
+    :return: List indexed by minutes past 12 of (big hand, little hand), each
+    a flat [x0, y0, x1, y1, ...] list ready for ImageDraw.polygon
+    """
+    minutes = np.arange(12 * 60)
+    minute = (minutes % 60) / 60
+    hour = (minutes // 60 + minute) / 12
+
+    # Tail, side, tip, other side
+    offsets = np.array([0.5, 0.25, 0, -0.25])
+
+    def hand(angle, dim):
+        mags = np.array([dim[0], dim[0], dim[1], dim[0]])
+        x, y = DisplayRenderer.polar_to_cartesian_array(
+            tl, br, mags, angle[:, np.newaxis] + offsets
+        )
+        return np.stack((x, y), axis=-1).reshape(len(angle), -1)
+
+    return list(
+        zip(hand(minute, BIG_HAND_DIM).tolist(), hand(hour, LITTLE_HAND_DIM).tolist())
+    )
 
 
 class DisplayRenderer(object):
-    RES = (400, 300)
+    DAYLIGHT_SPACING = 5
+
+    # Layers of everything that's the same from frame to frame, see background()
+    _backgrounds = {}
 
     def __init__(
-        self, tide1, tide2=None, battery=-1, location=(0, 0), weather=None, tz=None
+        self,
+        tide1,
+        tide2=None,
+        battery=-1,
+        location=(0, 0),
+        weather=None,
+        tz=None,
+        when=None,
+        dither="diffusion",
+        panel=DEFAULT_PANEL,
+        curve=None,
     ):
+        """
+        :param when: Time the frame is for, defaults to now
+        :param dither: How greys are turned to black and white, see dither.MODES
+        :param panel: panel.PanelProfile giving the resolution and layout
+        :param curve: tide_curve object, for the height now and the day's curve
+        """
+        self.dither = dither
+        self.tz = tz
+        self.curve = curve
+        self.panel = panel
+        self.layout = panel.layout
+        self.when = when if when else datetime.now(tz)
         # Work in greyscale, and we can dither to monochrome
-        self.surface = Image.new("L", DisplayRenderer.RES, 255)
-        self.large_font = ImageFont.load("fonts/ubuntu-big.pil")
-        self.small_font = ImageFont.load("fonts/ubuntu-small.pil")
+        self.surface = Image.new("L", panel.res, 255)
+        self.large_font = load_font("ubuntu-big.pil")
+        self.small_font = load_font("ubuntu-small.pil")
 
-        # This doesn't convert to a bitmap sadly
-        self.moon_font = ImageFont.truetype("fonts/moon_phases.ttf", 42)
+        # This doesn't convert to a bitmap sadly, so the phases are rasterised once
+        self.moon_glyphs = moon_atlas(42)
 
-        self.ephem = EphemerisHandler(location)
+        self.ephem = EphemerisHandler(location, self.when.date(), tables=True)
 
         self.surface_bw = None
         self.draw = ImageDraw.Draw(self.surface)
@@ -40,6 +102,12 @@ class DisplayRenderer(object):
         self.tide1_type = tide1.type.upper()
         self.tide1_height = tide1.height
 
+        self.height_now = None
+        if curve:
+            height = curve.heights([self.when.timestamp()])[0]
+            if np.isfinite(height):
+                self.height_now = float(height)
+
         self.battery_charge = battery
         self.weather = weather
         if tide2:
@@ -57,23 +125,54 @@ class DisplayRenderer(object):
             self.tide2_type = "LOW" if self.tide1_type == "HIGH" else "HIGH"
 
     def _gen_bw(self):
-        self.surface_bw = self.surface.convert("1")
+        self.surface_bw = to_1bpp(self.surface, self.dither)
+
+    def draw_background(self):
+        """
+        Draw the parts of the display that don't depend on the data: dividers,
+        the clock face, the battery outline and fixed labels
+        """
+        for divider in self.layout["dividers"]:
+            self.draw.line(divider, fill=0)
+
+        self.draw_clock_face(*self.layout["clock"])
+
+        self.draw.text(self.layout["daylight"], "Daylight:", font=self.small_font)
+
+        if self.battery_charge > -1:
+            self.draw_battery_outline(self.layout["battery"])
+
+    def background(self):
+        """
+        The static layer for this panel, drawn on first use and then shared by
+        every renderer in the process
+        :return: Image to start each frame from
+        """
+        key = (self.panel.name, self.panel.res, self.battery_charge > -1)
+        base = DisplayRenderer._backgrounds.get(key)
+        if base is None:
+            self.draw_background()
+            base = DisplayRenderer._backgrounds[key] = self.surface.copy()
+        return base
 
     def render(self):
+        self.surface.paste(self.background())
 
         self.draw_centre_text(
-            (130, 19), "Next %s tide" % self.tide1_type, self.large_font
+            self.layout["title"], "Next %s tide" % self.tide1_type, self.large_font
         )
 
-        self.draw.line((255, 50, 255, 250), fill=0)
-        self.draw.line((290, 80, 370, 80), fill=0)
-        self.draw.line((290, 210, 370, 210), fill=0)
+        self.draw_clock_hands(*self.layout["clock"], self.tide1_time)
 
-        self.draw_clock((20, 50), (240, 265), self.tide1_time)
+        if self.height_now is None:
+            msg = "Tide height: %.1fm" % self.tide1_height
+        else:
+            msg = "Height: %.1fm, now %.1fm" % (self.tide1_height, self.height_now)
+        self.draw_centre_text(self.layout["tide_height"], msg, self.small_font)
 
-        self.draw_centre_text(
-            (120, 290), "Tide height: %.1fm" % self.tide1_height, self.small_font
-        )
+        # The weather goes in the same space, when there is any
+        if self.curve and "curve" in self.layout and not self.weather:
+            self.draw_tide_curve(*self.layout["curve"])
 
         if self.tide2_time:
             msg = "Next %s tide -\n  Time: %s\n  Height: %.1fm" % (
@@ -83,31 +182,42 @@ class DisplayRenderer(object):
             )
         else:
             msg = "Next %s tide\n tomorrow" % self.tide2_type
-        self.draw.multiline_text((270, 10), msg, font=self.small_font, align="left")
+        self.draw.multiline_text(
+            self.layout["next_tide"], msg, font=self.small_font, align="left"
+        )
 
-        # Print daylight hours
-        msg = "Daylight:\n%s\n%s" % (
+        # Print daylight hours, under the label in the background
+        msg = "%s\n%s" % (
             self.sunrise_time.strftime("%H:%M"),
             self.sunset_time.strftime("%H:%M"),
         )
+        line_height = (
+            self.draw.textbbox((0, 0), "A", font=self.small_font)[3]
+            + DisplayRenderer.DAYLIGHT_SPACING
+        )
         self.draw.multiline_text(
-            (270, 215), msg, font=self.small_font, align="left", spacing=5
+            (self.layout["daylight"][0], self.layout["daylight"][1] + line_height),
+            msg,
+            font=self.small_font,
+            align="left",
+            spacing=DisplayRenderer.DAYLIGHT_SPACING,
         )
 
         # Draw moon (which is a font here)
-        self.draw.text(
-            (341, 228), self.ephem.calculate_moon_phase(), font=self.moon_font
+        self.moon_glyphs.draw(
+            self.surface, self.layout["moon"], self.ephem.calculate_moon_phase()
         )
 
         # Battery icon and percentage
         if self.battery_charge > -1:
-            self.draw_battery((210, 280))
+            self.draw_battery(self.layout["battery"], outline=False)
 
         # Date this ran on
-        msg = "%s" % datetime.now().strftime("%a, %d %b %Y")
-        size = self.small_font.getbbox(msg)
+        msg = "%s" % self.when.strftime("%a, %d %b %Y")
+        size = text_bbox(self.small_font, msg)
+        margin, top = self.layout["date"]
         self.draw.text(
-            (DisplayRenderer.RES[0] - (8 + size[2]), 280), msg, font=self.small_font
+            (self.panel.res[0] - (margin + size[2]), top), msg, font=self.small_font
         )
 
         if self.weather:
@@ -115,11 +225,11 @@ class DisplayRenderer(object):
             if self.weather.onshore:
                 # Wind direction as reported is where it's blowing FROM of course
                 wind_dir = (self.weather.get_wind_direction() + 180) % 360
-                pos = (265, 100)
+                pos, pos_right = self.layout["wind"]
 
                 if wind_dir < 180:
                     # Jiggle the centre based on direction so we take up less space
-                    pos = (250, 100)
+                    pos = pos_right
                 self.draw_wind(
                     pos,
                     (pos[0] + 60, pos[1] + 60),
@@ -132,19 +242,18 @@ class DisplayRenderer(object):
             if self.weather.offshore:
                 msg += "\nSea: %.1f°C" % self.weather.get_sea_temp()
                 self.draw.multiline_text(
-                    (320, 90), msg, font=self.small_font, align="right"
+                    self.layout["temperature"], msg, font=self.small_font, align="right"
                 )
 
                 msg = "Waves: %.1fm\nUV: %s" % (
                     self.weather.get_wave_height(),
                     self.weather.get_uv(),
                 )
-                self.draw.multiline_text((270, 165), msg, font=self.small_font)
+                self.draw.multiline_text(self.layout["sea"], msg, font=self.small_font)
 
-    def draw_battery(self, pos):
+    def draw_battery_outline(self, pos):
         """
-        Draw a picture of a battery at the given position and fill it up from right to left
-        based on the charge in self.battery_charge
+        Draw an empty battery at the given position
         """
         self.draw.rectangle(
             ((pos[0] + 2, pos[1] + 5), (pos[0] + 5, pos[1] + 10)), outline=0
@@ -152,6 +261,14 @@ class DisplayRenderer(object):
         self.draw.rectangle(
             ((pos[0] + 5, pos[1]), (pos[0] + 35, pos[1] + 15)), outline=0
         )
+
+    def draw_battery(self, pos, outline=True):
+        """
+        Draw a picture of a battery at the given position and fill it up from right to left
+        based on the charge in self.battery_charge
+        """
+        if outline:
+            self.draw_battery_outline(pos)
         inner_width = int(26.0 * self.battery_charge / 100)
         self.draw.rectangle(
             ((pos[0] + 33 - inner_width, pos[1] + 2), (pos[0] + 33, pos[1] + 13)),
@@ -195,7 +312,7 @@ class DisplayRenderer(object):
         self.draw_centre_text(centre, speed, font=self.small_font)
 
     def draw_centre_text(self, xy, msg, font, fill=0):
-        width = font.getbbox(msg)
+        width = text_bbox(font, msg)
         self.draw.text(
             (xy[0] - (width[2] / 2), xy[1] - (width[3] / 2)), msg, font=font, fill=fill
         )
@@ -211,21 +328,65 @@ class DisplayRenderer(object):
 
         return x, y
 
+    @staticmethod
+    def polar_to_cartesian_array(tl, br, mag, angle):
+        """
+        polar_to_cartesian() over arrays of magnitudes and angles
+        :return: (x array, y array)
+        """
+        size = (br[0] - tl[0], br[1] - tl[1])
+        centre = (tl[0] + size[0] / 2, tl[1] + size[1] / 2)
+        rad = 2 * angle * np.pi
+
+        x = centre[0] + np.trunc(0.5 * mag * size[0] * np.sin(rad))
+        y = centre[1] - np.trunc(0.5 * mag * size[1] * np.cos(rad))
+
+        return x, y
+
+    def draw_tide_curve(self, tl, br, step=600):
+        """
+        Plot the tide height over the frame's day in the box from top-left to
+        bottom-right, with a mark at the frame's time
+        :param step: Seconds between samples
+        """
+        local = self.when.astimezone(self.tz) if self.tz else self.when
+        midnight = local.replace(hour=0, minute=0, second=0, microsecond=0)
+        start = midnight.timestamp()
+        times = np.arange(start, start + 86400 + step, step)
+        heights = self.curve.heights(times)
+        known = np.isfinite(heights)
+        if not known.any():
+            return
+
+        low, high = heights[known].min(), heights[known].max()
+        span = (high - low) or 1
+        x = tl[0] + (times - start) / 86400 * (br[0] - tl[0])
+        y = br[1] - (heights - low) / span * (br[1] - tl[1])
+
+        self.draw.rectangle((tl, br), outline=0)
+        # A line per run of known heights, so gaps in the data stay gaps
+        breaks = np.flatnonzero(np.diff(known.astype(np.int8))) + 1
+        for run in np.split(np.arange(len(times)), breaks):
+            if known[run[0]] and len(run) > 1:
+                self.draw.line(
+                    np.column_stack((x[run], y[run])).ravel().tolist(), fill=0, width=2
+                )
+
+        now = tl[0] + (self.when.timestamp() - start) / 86400 * (br[0] - tl[0])
+        self.draw.line((now, tl[1], now, br[1]), fill=100)
+
     def draw_clock(self, tl, br, time):
         """
         Draw a clockface in the square from top-left to bottom-right, and mark hands to
         show a time based on a HH:MM string.
         """
+        self.draw_clock_face(tl, br)
+        self.draw_clock_hands(tl, br, time)
 
-        hour, minute = time.split(":")
-        hour = int(hour)
-        minute = int(minute)
-        if hour > 12:
-            hour -= 12
-        minute = float(minute) / 60
-        hour = (float(hour) + minute) / 12
-
-        # Face
+    def draw_clock_face(self, tl, br):
+        """
+        Draw the hour marks of a clock in the square from top-left to bottom-right
+        """
         for i in range(12):
             r = float(i) / 12
             self.draw.line(
@@ -236,23 +397,14 @@ class DisplayRenderer(object):
                 fill=0,
             )
 
-        little_hand_dim = (0.05, 0.55)
-        big_hand_dim = (0.075, 0.9)
-
-        # Little hand
-        little_hand = [
-            DisplayRenderer.polar_to_cartesian(tl, br, little_hand_dim[0], hour + 0.5),
-            DisplayRenderer.polar_to_cartesian(tl, br, little_hand_dim[0], hour + 0.25),
-            DisplayRenderer.polar_to_cartesian(tl, br, little_hand_dim[1], hour),
-            DisplayRenderer.polar_to_cartesian(tl, br, little_hand_dim[0], hour - 0.25),
-        ]
-
-        # Big hand
-        big_hand = [
-            DisplayRenderer.polar_to_cartesian(tl, br, big_hand_dim[0], minute + 0.5),
-            DisplayRenderer.polar_to_cartesian(tl, br, big_hand_dim[0], minute + 0.25),
-            DisplayRenderer.polar_to_cartesian(tl, br, big_hand_dim[1], minute),
-            DisplayRenderer.polar_to_cartesian(tl, br, big_hand_dim[0], minute - 0.25),
+    def draw_clock_hands(self, tl, br, time):
+        """
+        Draw the hands for the clock in the square from top-left to bottom-right
+        to show a time based on a HH:MM string.
+        """
+        hour, minute = time.split(":")
+        big_hand, little_hand = clock_hand_table(tl, br)[
+            (int(hour) % 12) * 60 + int(minute)
         ]
 
         self.draw.polygon(big_hand, outline=0, fill=200)
@@ -274,6 +426,6 @@ if __name__ == "__main__":
     d.render()
     d.save("data.png")
 
-    e = EPDGenerator(d.surface_bw)
+    e = EPDGenerator(d.surface_bw, panel=d.panel)
     e.save("data.bin")
     print("Checksum is 0x%x" % e.checksum())
@@ -0,0 +1,103 @@
+"""
+Greyscale to 1bpp conversion for the e-paper display, and a benchmark of the
+modes on the cmdline
+"""
+
+import numpy as np
+from PIL import Image
+
+# Ordered dither thresholds, the classic recursive Bayer pattern
+BAYER_4 = np.array(
+    [
+        [0, 8, 2, 10],
+        [12, 4, 14, 6],
+        [3, 11, 1, 9],
+        [15, 7, 13, 5],
+    ]
+)
+
+MODES = ("diffusion", "threshold", "bayer")
+
+
+def _from_mask(white):
+    """
+    :param white: Boolean array, True where the pixel is white
+    :return: PIL mode "1" image
+    """
+    return Image.fromarray(white)
+
+
+def threshold(surface, level=128):
+    """
+    Fastest, but greys turn solid black or white
+    :param surface: Greyscale PIL image
+    :param level: Values at or above this are white
+    :return: PIL mode "1" image
+    """
+    return _from_mask(np.asarray(surface) >= level)
+
+
+def bayer(surface):
+    """
+    Ordered dithering, greys become a regular pattern that suits the hands' fill
+    :param surface: Greyscale PIL image
+    :return: PIL mode "1" image
+    """
+    pixels = np.asarray(surface)
+    # Thresholds spread evenly across 0-255 so pure black and white stay pure
+    levels = (BAYER_4 + 0.5) * (256 / BAYER_4.size)
+    rows, cols = pixels.shape
+    tiled = np.tile(levels, (rows // 4 + 1, cols // 4 + 1))[:rows, :cols]
+    return _from_mask(pixels > tiled)
+
+
+def diffusion(surface):
+    """
+    PIL's Floyd-Steinberg error diffusion, the original behaviour
+    :param surface: Greyscale PIL image
+    :return: PIL mode "1" image
+    """
+    return surface.convert("1")
+
+
+def to_1bpp(surface, mode="diffusion"):
+    """
+    :param surface: PIL image, converted to greyscale if need be
+    :param mode: One of MODES
+    :return: PIL mode "1" image
+    """
+    if surface.mode == "1":
+        return surface
+    if mode == "diffusion":
+        return diffusion(surface)
+    if surface.mode != "L":
+        surface = surface.convert("L")
+    if mode == "threshold":
+        return threshold(surface)
+    if mode == "bayer":
+        return bayer(surface)
+    raise ValueError("Unknown dither mode: %s" % mode)
+
+
+if __name__ == "__main__":
+    import argparse
+    import timeit
+
+    parser = argparse.ArgumentParser(description="Benchmark the dither modes")
+    parser.add_argument("-i", "--input", help="Greyscale image, else a gradient")
+    parser.add_argument("-n", "--number", type=int, default=100)
+    parser.add_argument(
+        "-o", "--output", help="Save each mode's result with this prefix"
+    )
+    args = parser.parse_args()
+
+    if args.input:
+        source = Image.open(args.input).convert("L")
+    else:
+        source = Image.linear_gradient("L").resize((400, 300))
+
+    for name in MODES:
+        secs = timeit.timeit(lambda: to_1bpp(source, name), number=args.number)
+        print("%-10s %.3fms" % (name, secs * 1000 / args.number))
+        if args.output:
+            to_1bpp(source, name).save("%s_%s.png" % (args.output, name))
@@ -0,0 +1,60 @@
+"""
+Reduces long series to a fixed number of points for charting
+"""
+
+import numpy as np
+
+
+def lttb(x, y, budget):
+    """
+    Largest-triangle-three-buckets downsampling (Steinarsson, 2013).
+
+    The first and last points are always kept.  The rest are split into
+    budget - 2 buckets and from each we keep the point making the largest
+    triangle with the previously kept point and the average of the next bucket,
+    which keeps the peaks and troughs a plain decimation would lose.
+
+    :param x: Monotonic x values (e.g. epoch seconds)
+    :param y: Values
+    :param budget: Maximum number of points to return
+    :return: numpy array of the indices to keep, in order
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(x)
+    if budget >= n or budget < 3:
+        return np.arange(n)
+
+    # Bucket boundaries over the inner points, as the step is >= 1 none are empty
+    edges = np.linspace(1, n - 1, budget - 1).astype(int)
+    counts = np.diff(edges)
+
+    # The third vertex for each bucket is the average of the one after it,
+    # and the final point for the last bucket
+    avg_x = np.append((np.add.reduceat(x[: n - 1], edges[:-1]) / counts)[1:], x[-1])
+    avg_y = np.append((np.add.reduceat(y[: n - 1], edges[:-1]) / counts)[1:], y[-1])
+
+    selected = np.empty(budget, dtype=int)
+    selected[0] = 0
+    selected[-1] = n - 1
+    a = 0
+    for i in range(budget - 2):
+        lo, hi = edges[i], edges[i + 1]
+        # Twice the triangle area, for every candidate in the bucket at once
+        area = np.abs(
+            (x[a] - avg_x[i]) * (y[lo:hi] - y[a])
+            - (x[a] - x[lo:hi]) * (avg_y[i] - y[a])
+        )
+        a = lo + int(np.argmax(area))
+        selected[i + 1] = a
+
+    return selected
+
+
+if __name__ == "__main__":
+    import timeit
+
+    xs = np.arange(100000, dtype=float)
+    ys = np.sin(xs / 1000) + np.random.default_rng(0).normal(0, 0.1, len(xs))
+    secs = timeit.timeit(lambda: lttb(xs, ys, 500), number=10) / 10
+    print("100000 points to 500 in %.1fms" % (secs * 1000))
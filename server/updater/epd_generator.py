@@ -4,9 +4,10 @@ Class for managing EPD files and also generates them on the cmdline
 
 import glob
 import os
-import struct
 
 from bitstring import BitStream
+from dither import to_1bpp
+from panel import DEFAULT_PANEL
 from PIL import Image
 
 
@@ -15,11 +16,19 @@ class EPDGenerator(object):
     Takes PIL images and converts them to monochrome, then can save them out
     """
 
-    def __init__(self, surface):
-        if surface.mode == "1":
-            self.surface = surface
-        else:
-            self.surface = surface.convert("1")
+    def __init__(self, surface, dither="diffusion", panel=DEFAULT_PANEL):
+        """
+        :param surface: PIL image, dithered to monochrome if it isn't already
+        :param dither: One of dither.MODES
+        :param panel: panel.PanelProfile the file is for, sets the header
+        """
+        if panel.bpp != 1:
+            # The pixels are always packed a bit each, the header would disagree
+            raise ValueError(
+                "Can't generate %d bpp images for panel %s" % (panel.bpp, panel.name)
+            )
+        self.surface = to_1bpp(surface, dither)
+        self.panel = panel
 
     @staticmethod
     def from_file(path):
@@ -67,21 +76,25 @@ class EPDGenerator(object):
             acc ^= (acc & 0xFF00) >> 5
         return acc
 
-    def save(self, path):
+    def to_bytes(self):
         """
         EPD format 0 so you know
+        :return: Whole EPD file
+        """
+        # Invert it on the way for the display
+        img_gen = (x ^ 0xFF for x in (self.surface.getdata()))
+        # Get header
+        header = self.panel.header(self.surface.size)
+        return header + BitStream(img_gen).bytes
+
+    def save(self, path):
+        """
         :param path:
         :return:
         """
         with open(path, "wb") as output:
-            # Invert it on the way for the display
-            img_gen = (x ^ 0xFF for x in (self.surface.getdata()))
-            # Get header
-            header = struct.pack(
-                ">B2H2B", 0x33, self.surface.size[0], self.surface.size[1], 1, 0
-            ) + (b"\x00" * 9)
             # Splat out
-            output.write(header + BitStream(img_gen).bytes)
+            output.write(self.to_bytes())
 
 
 if __name__ == "__main__":
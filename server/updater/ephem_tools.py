@@ -1,44 +1,278 @@
-from datetime import date
+import logging
+import os.path
+import tempfile
+import zipfile
+from datetime import date, datetime, time, timezone
+from functools import lru_cache
 from math import radians as rad
 
 import ephem
+import numpy as np
 import pytz
 
+# Yearly tables persist here between runs, they're cheap to rebuild if lost
+# The containers keep them in the data volume, the temp dir is for running by hand
+TABLE_DIR = os.environ.get(
+    "EPHEMERIS_DIR", os.path.join(tempfile.gettempdir(), "tideclock-ephemeris")
+)
+
+# Off for runs that mustn't write anything, like simulate.py
+SAVE_TABLES = True
+
+# Marks a day the sun doesn't rise or set, left to the live calculation
+NO_EVENT = -1
+
+
+def moon_symbol(lunation):
+    """
+    :param lunation: Fraction of the way from the last new moon to the next
+    :return: Character in the moon phase font
+    """
+    # for use w. moon_phases.ttf A -> just past  newmoon,
+    # Z just before newmoon
+    # '0' is full, '1' is new
+    symbol = lunation * 26
+    # print("Lunation as a 1/26 is: %f" % symbol)
+    if symbol < 0.5 or symbol > 25.5:
+        return "*"  # new moon
+    return chr(ord("A") + int(symbol + 0.5) - 1)
+
+
+class EphemerisTable(object):
+    """
+    A year of sunrises, sunsets and moon phases for one location, indexed by
+    day so a lookup is just arithmetic.  Values are as EphemerisHandler gives
+    for an observer at midnight GMT on each day.
+    """
+
+    def __init__(self, latlong_dd, year, sunrise, sunset, moon):
+        """
+        :param latlong_dd: Location in decimal degrees
+        :param year: Year covered
+        :param sunrise: Epoch seconds per day, NO_EVENT if there isn't one
+        :param sunset: Epoch seconds per day, NO_EVENT if there isn't one
+        :param moon: Moon font character code per day
+        """
+        self.latlong = tuple(latlong_dd)
+        self.year = year
+        self.first = date(year, 1, 1).toordinal()
+        self.sunrise = sunrise
+        self.sunset = sunset
+        self.moon = moon
+
+    @staticmethod
+    def build(latlong_dd, year):
+        """
+        Work the whole year out in one go
+        :param latlong_dd: Location in decimal degrees
+        :param year: Year to cover
+        :return: EphemerisTable
+        """
+        first = date(year, 1, 1).toordinal()
+        days = date(year + 1, 1, 1).toordinal() - first
+        midnights = np.array(
+            [float(ephem.Date(date.fromordinal(first + i))) for i in range(days)]
+        )
+
+        handler = EphemerisHandler(latlong_dd)
+        sun = ephem.Sun()
+        sunrise = np.full(days, NO_EVENT, dtype=np.int64)
+        sunset = np.full(days, NO_EVENT, dtype=np.int64)
+        for i, midnight in enumerate(midnights):
+            handler.observer.date = midnight
+            try:
+                sunrise[i] = _epoch(handler.observer.next_rising(sun, use_center=False))
+            except ephem.CircumpolarError:
+                pass
+            handler.observer.date = midnight
+            try:
+                sunset[i] = _epoch(handler.observer.next_setting(sun, use_center=False))
+            except ephem.CircumpolarError:
+                pass
+
+        # Every new moon from before the year to after it, then each day's
+        # lunation is just where it falls between them
+        new_moons = [ephem.previous_new_moon(midnights[0])]
+        while new_moons[-1] <= midnights[-1]:
+            new_moons.append(ephem.next_new_moon(new_moons[-1]))
+        new_moons = np.array([float(moon) for moon in new_moons])
+        following = np.searchsorted(new_moons, midnights, side="right")
+        lunation = (midnights - new_moons[following - 1]) / (
+            new_moons[following] - new_moons[following - 1]
+        )
+        moon = np.array(
+            [ord(moon_symbol(fraction)) for fraction in lunation], dtype=np.uint8
+        )
+
+        return EphemerisTable(latlong_dd, year, sunrise, sunset, moon)
+
+    @staticmethod
+    def load(path, latlong_dd, year):
+        """
+        :param path: File written by save()
+        :param latlong_dd: Location it should be for
+        :param year: Year it should be for
+        :return: EphemerisTable, or None if it's missing or for somewhere else
+        """
+        try:
+            with np.load(path) as saved:
+                if (
+                    tuple(saved["latlong"]) != tuple(latlong_dd)
+                    or int(saved["year"]) != year
+                ):
+                    return None
+                return EphemerisTable(
+                    latlong_dd, year, saved["sunrise"], saved["sunset"], saved["moon"]
+                )
+        except (OSError, KeyError, ValueError, EOFError, zipfile.BadZipFile):
+            # A truncated file is rebuilt like a missing one
+            return None
+
+    def save(self, path):
+        """
+        :param path: .npz file, about 6KB a year
+        """
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Each writer gets its own temporary file, as several processes can
+        # build the same year at once
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as table_file:
+                np.savez_compressed(
+                    table_file,
+                    latlong=np.array(self.latlong),
+                    year=self.year,
+                    sunrise=self.sunrise,
+                    sunset=self.sunset,
+                    moon=self.moon,
+                )
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def _index(self, day):
+        index = day.toordinal() - self.first
+        if 0 <= index < len(self.moon):
+            return index
+        return None
+
+    def sunrise_on(self, day):
+        """
+        :param day: date
+        :return: Epoch seconds, or None if the table can't say
+        """
+        index = self._index(day)
+        if index is None or self.sunrise[index] == NO_EVENT:
+            return None
+        return int(self.sunrise[index])
+
+    def sunset_on(self, day):
+        """
+        :param day: date
+        :return: Epoch seconds, or None if the table can't say
+        """
+        index = self._index(day)
+        if index is None or self.sunset[index] == NO_EVENT:
+            return None
+        return int(self.sunset[index])
+
+    def moon_on(self, day):
+        """
+        :param day: date
+        :return: Moon font character, or None if the table can't say
+        """
+        index = self._index(day)
+        if index is None:
+            return None
+        return chr(self.moon[index])
+
+
+def _epoch(when):
+    """
+    :param when: ephem.Date, which is UTC
+    :return: Whole epoch seconds
+    """
+    # Truncated like the times shown, so the minute never rounds up
+    return int(when.datetime().replace(tzinfo=timezone.utc).timestamp())
+
+
+@lru_cache(maxsize=16)
+def ephemeris_table(latlong_dd, year):
+    """
+    The table for a location and year, from TABLE_DIR or worked out and saved there
+    :param latlong_dd: Location in decimal degrees, as a tuple
+    :param year: Year to cover
+    :return: EphemerisTable
+    """
+    path = os.path.join(
+        TABLE_DIR, "%.4f_%.4f_%d.npz" % (latlong_dd[0], latlong_dd[1], year)
+    )
+    table = EphemerisTable.load(path, latlong_dd, year)
+    if table is None:
+        logging.info("Building ephemeris table for %s in %d", latlong_dd, year)
+        table = EphemerisTable.build(latlong_dd, year)
+        if not SAVE_TABLES:
+            return table
+        try:
+            table.save(path)
+        except OSError:
+            logging.warning("Couldn't save ephemeris table to %s", path)
+    return table
+
 
 class EphemerisHandler(object):
-    def __init__(self, latlong_dd):
+    def __init__(self, latlong_dd, day=None, tables=False):
+        """
+        :param latlong_dd: Location in decimal degrees
+        :param day: Date to calculate for, defaults to today
+        :param tables: Look days up in ephemeris_table() rather than solving each time
+        """
+        self.latlong = tuple(latlong_dd)
+        self.tables = tables
         self.observer = ephem.Observer()
         self.observer.name = "Somewhere"
         self.observer.lat = rad(latlong_dd[0])  # lat/long in decimal degrees
         self.observer.long = rad(latlong_dd[1])
         self.observer.elevation = 0
 
-        self.observer.date = date.today()
+        self.observer.date = day if day else date.today()
 
         self.observer.pressure = 1000
         self.gmt = pytz.timezone("GMT")
         # self.observer.horizon = 0
 
+    def _table_day(self):
+        """
+        :return: Date to look up in the tables, or None if they don't apply
+        """
+        if not self.tables:
+            return None
+        when = self.observer.date.datetime()
+        # Tables only hold the values for midnight
+        if when.time() != time(0):
+            return None
+        return when.date()
+
+    def _table(self, day):
+        return ephemeris_table(self.latlong, day.year)
+
     def calculate_moon_phase(self):
+        day = self._table_day()
+        if day:
+            symbol = self._table(day).moon_on(day)
+            if symbol:
+                return symbol
 
         m = ephem.Moon()
         m.compute(self.observer)
 
         nnm = ephem.next_new_moon(self.observer.date)
         pnm = ephem.previous_new_moon(self.observer.date)
-        # for use w. moon_phases.ttf A -> just past  newmoon,
-        # Z just before newmoon
-        # '0' is full, '1' is new
         # note that we cannot use m.phase as this is the percentage of the moon
         # that is illuminated which is not the same as the phase!
         lunation = (self.observer.date - pnm) / (nnm - pnm)
-        symbol = lunation * 26
-        # print("Lunation as a 1/26 is: %f" % symbol)
-        if symbol < 0.5 or symbol > 25.5:
-            symbol = "*"  # new moon
-        else:
-            symbol = chr(ord("A") + int(symbol + 0.5) - 1)
-        return symbol
+        return moon_symbol(lunation)
 
         # print(ephem.localtime(g.date).time(), deg(m.alt),deg(m.az),
         #  ephem.localtime(g.date).time().strftime("%H%M"),
@@ -49,6 +283,12 @@ class EphemerisHandler(object):
 
         :return: ALWAYS IN GMT
         """
+        day = self._table_day()
+        if day:
+            when = self._table(day).sunrise_on(day)
+            if when is not None:
+                return self._from_epoch(when)
+
         s = ephem.Sun()
         return self.gmt.localize(
             self.observer.next_rising(s, use_center=False).datetime()
@@ -59,7 +299,16 @@ class EphemerisHandler(object):
 
         :return: ALWAYS IN GMT
         """
+        day = self._table_day()
+        if day:
+            when = self._table(day).sunset_on(day)
+            if when is not None:
+                return self._from_epoch(when)
+
         s = ephem.Sun()
         return self.gmt.localize(
             self.observer.next_setting(s, use_center=False).datetime()
         )
+
+    def _from_epoch(self, when):
+        return datetime.fromtimestamp(when, self.gmt)
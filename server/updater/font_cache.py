@@ -0,0 +1,71 @@
+"""
+Fonts, glyphs and text sizes shared by every DisplayRenderer in the process
+"""
+
+import os.path
+from functools import lru_cache
+
+from PIL import Image, ImageDraw, ImageFont
+
+FONT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fonts")
+
+MOON_GLYPHS = [chr(c) for c in range(ord("A"), ord("Z") + 1)] + ["*"]
+
+
+@lru_cache(maxsize=None)
+def load_font(name, size=None):
+    """
+    :param name: File in the fonts directory, a PIL bitmap font or a TrueType one
+    :param size: Point size, TrueType only
+    :return: Font object, loaded once per process
+    """
+    path = os.path.join(FONT_DIR, name)
+    if size is None:
+        return ImageFont.load(path)
+    return ImageFont.truetype(path, size)
+
+
+@lru_cache(maxsize=4096)
+def text_bbox(font, msg):
+    """
+    Memoised font.getbbox(), the same strings are measured over and over
+    :param font: Font from load_font()
+    :param msg: Text to measure
+    :return: (left, top, right, bottom)
+    """
+    return font.getbbox(msg)
+
+
+class GlyphAtlas(object):
+    """
+    Pre-rasterised glyphs for a symbol font, so drawing one is a masked paste
+    rather than a trip through FreeType
+    """
+
+    def __init__(self, font, chars):
+        self.glyphs = {}
+        for char in chars:
+            bbox = font.getbbox(char)
+            mask = Image.new("L", (bbox[2] - bbox[0], bbox[3] - bbox[1]), 0)
+            ImageDraw.Draw(mask).text((-bbox[0], -bbox[1]), char, font=font, fill=255)
+            self.glyphs[char] = (bbox[0], bbox[1], mask)
+
+    def draw(self, surface, xy, char, fill=0):
+        """
+        Same result as ImageDraw.text(xy, char, font=font, fill=fill)
+        :param surface: Image to draw on
+        :param xy: Top-left, as for ImageDraw.text
+        :param char: One of the characters in the atlas
+        :param fill: Ink colour
+        """
+        left, top, mask = self.glyphs[char]
+        surface.paste(fill, (int(xy[0] + left), int(xy[1] + top)), mask)
+
+
+@lru_cache(maxsize=None)
+def moon_atlas(size=42):
+    """
+    :param size: Point size of the moon phase font
+    :return: GlyphAtlas of the phases, 'A' to 'Z' and '*' for new moon
+    """
+    return GlyphAtlas(load_font("moon_phases.ttf", size), MOON_GLYPHS)
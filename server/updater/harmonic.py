@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+Offline tide prediction from harmonic constituents, so tides for any span can
+be worked out without asking EasyTide.  On the cmdline it fits constituents
+to the tides already stored in server.xml and prints them as config.
+
+Heights are Z0 + sum(A cos(speed * t - phase)), with t in hours since the
+Unix epoch and phases relative to it.  There are no nodal corrections, so
+refit every few months rather than using a fit from years ago.
+"""
+
+import argparse
+import math
+
+import numpy as np
+from tide import TideTable, find_tides_node
+
+# Angular speeds in degrees per hour
+SPEEDS = {
+    "M2": 28.9841042,
+    "S2": 30.0,
+    "N2": 28.4397295,
+    "K2": 30.0821373,
+    "K1": 15.0410686,
+    "O1": 13.9430356,
+    "P1": 14.9589314,
+    "Q1": 13.3986609,
+    "M4": 57.9682084,
+    "MS4": 58.9841042,
+    "M6": 86.9523127,
+}
+
+# Enough to fit from about a fortnight of highs and lows
+DEFAULT_FIT = ("M2", "S2", "N2", "K1", "O1", "M4")
+
+# Sampling step when searching for highs and lows, refined after
+SEARCH_STEP = 600
+
+
+class HarmonicModel(object):
+    """
+    Heights at a station as a sum of constituents
+    """
+
+    def __init__(self, z0, constituents):
+        """
+        :param z0: Mean level, metres above chart datum
+        :param constituents: Dict of name to (amplitude in metres, phase in degrees)
+        """
+        self.z0 = z0
+        self.names = list(constituents)
+        unknown = set(self.names) - set(SPEEDS)
+        if unknown:
+            raise ValueError("Unknown constituents: %s" % ", ".join(sorted(unknown)))
+        self.speeds = np.radians([SPEEDS[name] for name in self.names]) / 3600
+        self.amplitudes = np.array([constituents[name][0] for name in self.names])
+        self.phases = np.radians([constituents[name][1] for name in self.names])
+
+    @staticmethod
+    def from_config(config, section="Harmonics"):
+        """
+        [Harmonics]
+        Z0 = 2.1
+        M2 = 1.35, 317.2
+
+        :param config: ConfigParser
+        :param section: Section holding Z0 and one "amplitude, phase" per constituent
+        :return: HarmonicModel
+        """
+        constituents = {}
+        for key, value in config.items(section):
+            if key.lower() == "z0":
+                continue
+            amplitude, phase = (float(part) for part in value.split(","))
+            constituents[key.upper()] = (amplitude, phase)
+        return HarmonicModel(config.getfloat(section, "Z0"), constituents)
+
+    def to_config(self):
+        """
+        :return: Lines for a config file section, as from_config() reads
+        """
+        lines = ["[Harmonics]", "Z0 = %.3f" % self.z0]
+        for name, amplitude, phase in zip(self.names, self.amplitudes, self.phases):
+            lines.append("%s = %.4f, %.2f" % (name, amplitude, math.degrees(phase)))
+        return "\n".join(lines)
+
+    def heights(self, times):
+        """
+        :param times: Array of epoch seconds
+        :return: Array of heights in metres
+        """
+        times = np.asarray(times, dtype=np.float64)
+        args = np.multiply.outer(times, self.speeds) - self.phases
+        return self.z0 + np.cos(args) @ self.amplitudes
+
+    def rates(self, times):
+        """
+        :param times: Array of epoch seconds
+        :return: Array of rates of change, metres per second
+        """
+        times = np.asarray(times, dtype=np.float64)
+        args = np.multiply.outer(times, self.speeds) - self.phases
+        return -np.sin(args) @ (self.amplitudes * self.speeds)
+
+    def extremes(self, start, end):
+        """
+        Every high and low water between two times
+        :param start: Epoch seconds
+        :param end: Epoch seconds
+        :return: TideTable
+        """
+        times = np.arange(start - SEARCH_STEP, end + 2 * SEARCH_STEP, SEARCH_STEP)
+        heights = self.heights(times)
+        rising = np.diff(heights) > 0
+        # Sample i is a turning point if the slope changes sign either side of it
+        turns = np.nonzero(rising[:-1] != rising[1:])[0] + 1
+        high = rising[turns - 1]
+
+        # Fit a parabola through each turning point and its neighbours
+        y0, y1, y2 = heights[turns - 1], heights[turns], heights[turns + 1]
+        curve = y0 - 2 * y1 + y2
+        offset = np.divide(
+            0.5 * (y0 - y2), curve, out=np.zeros_like(curve), where=curve != 0
+        )
+        found = times[turns] + offset * SEARCH_STEP
+
+        keep = (found >= start) & (found < end)
+        found = np.round(found[keep]).astype(np.int64)
+        return TideTable(found, self.heights(found), np.packbits(high[keep]))
+
+    @staticmethod
+    def fit(times, heights, names=DEFAULT_FIT, turning=None):
+        """
+        Least squares fit of constituents to observed heights
+        :param times: Array of epoch seconds
+        :param heights: Array of heights at those times
+        :param names: Constituents to fit
+        :param turning: Optional array of epoch seconds where the height is known
+        to be a high or low, which adds a zero rate of change at each
+        :return: HarmonicModel
+        """
+        speeds = np.radians([SPEEDS[name] for name in names]) / 3600
+        args = np.multiply.outer(np.asarray(times, dtype=np.float64), speeds)
+        # h = z0 + sum(a cos(wt) + b sin(wt)), which is linear in z0, a and b
+        rows = [np.column_stack((np.ones(len(times)), np.cos(args), np.sin(args)))]
+        values = [np.asarray(heights, dtype=np.float64)]
+        if turning is not None and len(turning):
+            args = np.multiply.outer(np.asarray(turning, dtype=np.float64), speeds)
+            # Rates are scaled to metres per hour to weigh about the same as heights
+            scale = speeds * 3600
+            rows.append(
+                np.column_stack(
+                    (
+                        np.zeros(len(turning)),
+                        -np.sin(args) * scale,
+                        np.cos(args) * scale,
+                    )
+                )
+            )
+            values.append(np.zeros(len(turning)))
+
+        design, observed = np.vstack(rows), np.concatenate(values)
+        solution = np.linalg.lstsq(design, observed, rcond=None)[0]
+        a, b = solution[1 : len(names) + 1], solution[len(names) + 1 :]
+        return HarmonicModel(
+            solution[0],
+            {
+                name: (math.hypot(a_i, b_i), math.degrees(math.atan2(b_i, a_i)) % 360)
+                for name, a_i, b_i in zip(names, a, b)
+            },
+        )
+
+    @staticmethod
+    def fit_extremes(table, names=DEFAULT_FIT):
+        """
+        :param table: TideTable of past highs and lows
+        :param names: Constituents to fit
+        :return: HarmonicModel
+        """
+        # Two equations per tide, so that bounds how much can be fitted
+        if 2 * len(table) < 2 * len(names) + 1:
+            raise ValueError("Need more tides to fit %d constituents" % len(names))
+        return HarmonicModel.fit(table.times, table.heights, names, turning=table.times)
+
+
+if __name__ == "__main__":
+    from lxml import etree
+
+    parser = argparse.ArgumentParser(description="Fit constituents to stored tides")
+    parser.add_argument("-x", "--tides", help="server.xml", default="server.xml")
+    parser.add_argument(
+        "-s", "--station", help="Stored station to fit to, default first"
+    )
+    parser.add_argument(
+        "-n", "--names", help="Constituents", default=",".join(DEFAULT_FIT)
+    )
+    args = parser.parse_args()
+
+    stored = TideTable.load_xml(find_tides_node(etree.parse(args.tides), args.station))
+    model = HarmonicModel.fit_extremes(stored, args.names.split(","))
+    print(model.to_config())
+
+    predicted = model.extremes(
+        int(stored.times[0]) - 3600, int(stored.times[-1]) + 3600
+    )
+    if len(predicted) == len(stored):
+        print(
+            "; RMS error %.2fm, %.0f minutes"
+            % (
+                np.sqrt(np.mean((predicted.heights - stored.heights) ** 2)),
+                np.sqrt(np.mean((predicted.times - stored.times) ** 2)) / 60,
+            )
+        )
+    else:
+        print(
+            "; Predicted %d tides where %d are stored" % (len(predicted), len(stored))
+        )
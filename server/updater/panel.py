@@ -0,0 +1,96 @@
+"""
+Panel profiles: everything that depends on which e-paper display is fitted
+"""
+
+import struct
+
+# EPD file format 0: panel type, width, height, bits per pixel, pixel format
+HEADER_FORMAT = ">B2H2B9x"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+
+class PanelProfile(object):
+    """
+    Resolution, bit depth and EPD header for a panel, plus where everything
+    goes on it.  Renderers key their caches (background layers, clock hand
+    tables) on the profile, so each panel pays for its setup once.
+    """
+
+    def __init__(self, name, res, type_code, layout, bpp=1, pixel_format=0):
+        """
+        :param name: Short name, used in config files
+        :param res: (width, height)
+        :param type_code: First byte of the EPD header, identifies the panel
+        :param layout: Dict of positions, see PANEL_4_2 for the keys.  "curve" is
+        a ((left, top), (right, bottom)) box for a plot of the day's tide, left
+        out on panels without room for one
+        :param bpp: Bits per pixel
+        :param pixel_format: EPD pixel data format
+        """
+        self.name = name
+        self.res = tuple(res)
+        self.type_code = type_code
+        self.layout = layout
+        self.bpp = bpp
+        self.pixel_format = pixel_format
+
+    @property
+    def row_bytes(self):
+        return (self.res[0] * self.bpp + 7) // 8
+
+    @property
+    def image_size(self):
+        """Bytes in an EPD file for this panel, header included"""
+        return HEADER_SIZE + self.row_bytes * self.res[1]
+
+    def header(self, size=None):
+        """
+        :param size: (width, height) if the image isn't the panel's resolution
+        :return: EPD file header
+        """
+        width, height = size if size else self.res
+        return struct.pack(
+            HEADER_FORMAT, self.type_code, width, height, self.bpp, self.pixel_format
+        )
+
+    @staticmethod
+    def image_size_from_header(header):
+        """
+        :param header: First HEADER_SIZE bytes of an EPD file
+        :return: Bytes in the whole file
+        """
+        _, width, height, bpp, _ = struct.unpack(HEADER_FORMAT, header)
+        return HEADER_SIZE + (width * bpp + 7) // 8 * height
+
+    def __repr__(self):
+        return "PanelProfile(%s, %dx%d)" % (self.name, self.res[0], self.res[1])
+
+
+# The 4.2" 400x300 panel the clock was built with
+PANEL_4_2 = PanelProfile(
+    "4.2",
+    (400, 300),
+    0x33,
+    {
+        "title": (130, 19),
+        "dividers": ((255, 50, 255, 250), (290, 80, 370, 80), (290, 210, 370, 210)),
+        "clock": ((20, 50), (240, 265)),
+        "tide_height": (120, 290),
+        "next_tide": (270, 10),
+        "daylight": (270, 215),
+        "moon": (341, 228),
+        "battery": (210, 280),
+        # Right margin and top of the date
+        "date": (8, 280),
+        # Wind dial, and where it goes when the arrow points right
+        "wind": ((265, 100), (250, 100)),
+        "temperature": (320, 90),
+        "sea": (270, 165),
+        # Between the dividers, where the weather goes when there is any
+        "curve": ((270, 95), (370, 195)),
+    },
+)
+
+PANELS = {PANEL_4_2.name: PANEL_4_2}
+
+DEFAULT_PANEL = PANEL_4_2
@@ -0,0 +1,183 @@
+"""
+Renders the frames for the next few wakes in one go, so comms can hand a
+device the right one as soon as it asks
+"""
+
+import datetime
+import glob
+import hashlib
+import json
+import logging
+import os.path
+
+import pytz
+from display_renderer import DisplayRenderer
+from epd_generator import EPDGenerator
+from lxml import etree
+
+gmt = pytz.timezone("GMT")
+
+FRAME_INDEX = "frames.json"
+
+
+def choose_tides(tides, when, tz=None):
+    """
+    Which tides the display shows at a given time, and when that stops being true
+    :param tides: TideTable
+    :param when: Timezone-aware time of the frame
+    :param tz: Local timezone, for finding the start of the day
+    :return: (tide1, tide2 or None, time the next tide passes or None)
+    """
+    future_tides = tides.next_tides(when, 2)
+    if len(future_tides) == 2:
+        return future_tides[0], future_tides[1], future_tides[0].time
+    elif len(future_tides) == 1:
+        return future_tides[0], None, future_tides[0].time
+
+    # For the sake of something to show we show this morning's, as next morning
+    local = when.astimezone(tz) if tz else when
+    day_start = local.replace(hour=0, minute=0, second=0, microsecond=0)
+    today_tide = tides.next_tide(day_start)
+    if today_tide:
+        return today_tide, None, None
+    return None, None, None
+
+
+def plan_frames(tides, start, count, tz=None, breaks=()):
+    """
+    :param tides: TideTable
+    :param start: Timezone-aware time of the first frame, normally now
+    :param count: Maximum number of frames
+    :param tz: Local timezone
+    :param breaks: Other times to start a new frame at, such as planned wakes
+    :return: List of (valid from, tide1, tide2), one per change of tide or break
+    """
+    breaks = sorted(when for when in breaks if when > start)
+    frames = []
+    when = start
+    while len(frames) < count:
+        tide1, tide2, changes = choose_tides(tides, when, tz)
+        if tide1 is None:
+            break
+        frames.append((when, tide1, tide2))
+        while breaks and breaks[0] <= when:
+            breaks.pop(0)
+        if breaks and (changes is None or breaks[0] < changes):
+            changes = breaks[0]
+        if changes is None:
+            break
+        when = changes
+    return frames
+
+
+def fingerprint(tides, count, **inputs):
+    """
+    :param tides: TideTable
+    :param count: Number of frames wanted
+    :param inputs: Everything else passed to the renderer
+    :return: Hex digest that changes whenever the frames would
+    """
+    digest = hashlib.sha1()
+    digest.update(tides.to_bytes())
+    digest.update(str(count).encode())
+    weather = inputs.pop("weather", None)
+    if weather:
+        for tree in (weather.land, weather.marine):
+            if tree is not None:
+                digest.update(etree.tostring(tree))
+    digest.update(repr(sorted(inputs.items())).encode())
+    return digest.hexdigest()
+
+
+class FrameQueue(object):
+    """
+    A directory of pre-rendered EPD (and PNG) frames plus an index of when
+    each becomes valid, that comms reads to pick what to serve.
+    """
+
+    def __init__(self, frame_dir):
+        self.frame_dir = frame_dir
+        self.index_path = os.path.join(frame_dir, FRAME_INDEX)
+
+    def load_index(self):
+        """
+        :return: The saved index, or an empty one
+        """
+        try:
+            with open(self.index_path) as index_file:
+                return json.load(index_file)
+        except (OSError, ValueError):
+            return {"inputs": None, "frames": []}
+
+    def clear(self):
+        """
+        Remove the index, so comms goes back to serving the single frame
+        """
+        if os.path.exists(self.index_path):
+            logging.info("Removing frame queue index")
+            os.remove(self.index_path)
+
+    def render(self, tides, start, count, tz=None, breaks=(), **renderer_args):
+        """
+        Render and save frames for the next wakes, unless nothing has changed
+        since last time and the queue still covers start
+        :param tides: TideTable
+        :param start: Timezone-aware time of the first frame
+        :param count: Maximum number of frames
+        :param tz: Local timezone
+        :param breaks: As for plan_frames(), so a device can fetch the frame for a wake early
+        :param renderer_args: battery, location, weather, panel, curve for DisplayRenderer
+        :return: True if the queue was rewritten
+        """
+        inputs = fingerprint(
+            tides, count, tz=str(tz), breaks=list(breaks), **renderer_args
+        )
+        index = self.load_index()
+        if index["inputs"] == inputs and len(index["frames"]) > 1:
+            second = datetime.datetime.fromisoformat(index["frames"][1]["valid_from"])
+            if second > start:
+                logging.info("Frame queue is up to date")
+                return False
+
+        os.makedirs(self.frame_dir, exist_ok=True)
+        weather = renderer_args.pop("weather", None)
+        frames = []
+        for when, tide1, tide2 in plan_frames(tides, start, count, tz, breaks):
+            d = DisplayRenderer(
+                tide1,
+                tide2,
+                tz=tz,
+                when=when.astimezone(tz) if tz else when,
+                weather=weather.at(when) if weather else None,
+                **renderer_args,
+            )
+            d.render()
+            name = "%d" % when.timestamp()
+            d.save(os.path.join(self.frame_dir, name + ".png"))
+            EPDGenerator(d.surface_bw, panel=d.panel).save(
+                os.path.join(self.frame_dir, name + ".bin")
+            )
+            frames.append(
+                {
+                    "valid_from": when.astimezone(gmt).isoformat(),
+                    "epd": name + ".bin",
+                    "png": name + ".png",
+                }
+            )
+            logging.debug("Rendered frame for %s", when)
+
+        # Swap the index in whole so comms never reads half of one
+        with open(self.index_path + ".tmp", "w") as index_file:
+            json.dump({"inputs": inputs, "frames": frames}, index_file, indent=1)
+        os.replace(self.index_path + ".tmp", self.index_path)
+
+        # Tidy up frames from the last queue
+        keep = {f["epd"] for f in frames} | {f["png"] for f in frames}
+        for path in glob.glob(os.path.join(self.frame_dir, "*.bin")) + glob.glob(
+            os.path.join(self.frame_dir, "*.png")
+        ):
+            if os.path.basename(path) not in keep:
+                os.remove(path)
+
+        logging.info("Rendered %d frames ahead", len(frames))
+        return True
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+"""
+Read-only preview renders, served over HTTP for comms to pass on.  Uses the
+tides and battery the generator last stored and builds any ephemeris tables
+in memory, so nothing is written and the display can be checked at any time
+without disturbing the device.
+
+GET /render?time=HH:MM[&format=png|epd]
+GET /render?time=YYYY-MM-DD HH:MM
+"""
+
+import argparse
+import configparser
+import datetime
+import io
+import logging
+import os.path
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import ephem_tools
+from display_renderer import DisplayRenderer
+from epd_generator import EPDGenerator
+from lxml import etree
+from panel import DEFAULT_PANEL, PANELS
+from render_ahead import choose_tides, fingerprint
+from tide import TideTable, find_tides_node, station
+from tide_curve import curve_from_config
+
+# MUST BE TZLOCAL 4.x!
+from tzlocal import get_localzone
+
+SERVER_METADATA = "server.xml"
+
+FORMATS = {"png": "image/png", "epd": "application/octet-stream"}
+
+
+def parse_time(text, tz, today=None):
+    """
+    :param text: "HH:MM" for today, or "YYYY-MM-DD HH:MM"
+    :param tz: Local timezone
+    :param today: For testing, defaults to the current local date
+    :return: Timezone-aware time
+    """
+    try:
+        when = datetime.datetime.strptime(text, "%Y-%m-%d %H:%M")
+    except ValueError:
+        clock = datetime.datetime.strptime(text, "%H:%M").time()
+        if today is None:
+            today = datetime.datetime.now(tz).date()
+        when = datetime.datetime.combine(today, clock)
+    return tz.localize(when) if hasattr(tz, "localize") else when.replace(tzinfo=tz)
+
+
+class RenderCache(object):
+    """
+    The last few renders, by a fingerprint of everything that went into them
+    """
+
+    def __init__(self, max_renders=32):
+        self.max_renders = max_renders
+        self.renders = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """
+        :param key: Input fingerprint
+        :return: Rendered bytes, or None
+        """
+        data = self.renders.get(key)
+        if data is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.renders.move_to_end(key)
+        return data
+
+    def put(self, key, data):
+        self.renders[key] = data
+        self.renders.move_to_end(key)
+        while len(self.renders) > self.max_renders:
+            self.renders.popitem(last=False)
+
+
+class RenderService(object):
+    """
+    Renders frames for arbitrary times from the stored server metadata
+    """
+
+    def __init__(self, config, data_dir, tz=None, max_renders=32):
+        """
+        :param config: ConfigParser, as for tideclock_generator
+        :param data_dir: Where the generator keeps its files
+        :param tz: Local timezone, defaults to the system's
+        :param max_renders: Size of the LRU of finished renders
+        """
+        self.metadata_path = config.get(
+            "General",
+            "ServerMetadata",
+            fallback=os.path.join(data_dir, SERVER_METADATA),
+        )
+        self.tz = tz if tz else get_localzone()
+        self.location = (
+            config.getfloat("Geo", "Latitude", fallback=0),
+            config.getfloat("Geo", "Longitude", fallback=0),
+        )
+        self.dither = config.get("Display", "Dither", fallback="diffusion")
+        self.panel = PANELS[config.get("Display", "Panel", fallback=DEFAULT_PANEL.name)]
+        self.config = config
+        self.cache = RenderCache(max_renders)
+        self.mtime = None
+        self.tides = TideTable()
+        self.battery = -1
+
+    def _refresh(self):
+        """
+        Re-read the stored tides and battery if the generator has changed them
+        """
+        try:
+            mtime = os.path.getmtime(self.metadata_path)
+        except OSError:
+            self.mtime = None
+            self.tides = TideTable()
+            return
+        if mtime == self.mtime:
+            return
+
+        try:
+            metadata = etree.parse(self.metadata_path)
+        except (etree.XMLSyntaxError, OSError):
+            # Likely caught mid-write, keep what we had and try again next time
+            logging.warning("Can't read %s, using the last tides", self.metadata_path)
+            return
+        self.tides = TideTable.load_xml(find_tides_node(metadata, station(self.config)))
+        last_log_node = metadata.find("./client/log[last()]")
+        try:
+            self.battery = int(last_log_node.attrib["battery"])
+        except (AttributeError, KeyError, ValueError):
+            self.battery = -1
+        self.mtime = mtime
+
+    def render(self, when, fmt="png"):
+        """
+        :param when: Timezone-aware time to show
+        :param fmt: Key of FORMATS
+        :return: Rendered file as bytes, or None if there are no tides to show
+        """
+        self._refresh()
+        tide1, tide2, _ = choose_tides(self.tides, when, self.tz)
+        if tide1 is None:
+            return None
+
+        # Everything the frame depends on, to the minute shown in the date line
+        curve = curve_from_config(self.config, self.tides)
+        key = fingerprint(
+            self.tides,
+            1,
+            when=when.replace(second=0, microsecond=0).isoformat(),
+            fmt=fmt,
+            tz=str(self.tz),
+            battery=self.battery,
+            location=self.location,
+            dither=self.dither,
+            panel=self.panel.name,
+            curve=curve,
+        )
+        data = self.cache.get(key)
+        if data is not None:
+            logging.debug("Preview for %s from cache", when)
+            return data
+
+        d = DisplayRenderer(
+            tide1,
+            tide2,
+            battery=self.battery,
+            location=self.location,
+            tz=self.tz,
+            when=when,
+            dither=self.dither,
+            panel=self.panel,
+            curve=curve,
+        )
+        d.render()
+        d._gen_bw()
+        if fmt == "epd":
+            data = EPDGenerator(d.surface_bw, panel=self.panel).to_bytes()
+        else:
+            png = io.BytesIO()
+            d.surface_bw.save(png, "PNG")
+            data = png.getvalue()
+
+        self.cache.put(key, data)
+        logging.info("Rendered preview for %s", when)
+        return data
+
+
+class RenderHandler(BaseHTTPRequestHandler):
+    """
+    Only GET /render, everything else is a 404
+    """
+
+    service = None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != "/render":
+            self.send_error(404)
+            return
+
+        query = parse_qs(url.query)
+        fmt = query.get("format", ["png"])[0]
+        if fmt not in FORMATS:
+            self.send_error(400, "Unknown format")
+            return
+        try:
+            when = parse_time(query["time"][0], self.service.tz)
+        except (KeyError, ValueError):
+            self.send_error(400, "Need a time as HH:MM or YYYY-MM-DD HH:MM")
+            return
+
+        data = self.service.render(when, fmt)
+        if data is None:
+            self.send_error(404, "No tides stored for that time")
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", FORMATS[fmt])
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        logging.debug(format, *args)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve preview renders")
+    parser.add_argument("-d", "--dir", default=".")
+    parser.add_argument("-c", "--config", help="Configuration", required=True)
+    parser.add_argument("-p", "--port", type=int, default=5001)
+    parser.add_argument(
+        "-n", "--renders", help="Renders to cache", type=int, default=32
+    )
+    parser.add_argument(
+        "-v", "--verbose", action="store_const", const=True, default=False
+    )
+    args = parser.parse_args()
+
+    # Leave the ephemeris tables to the generator
+    ephem_tools.SAVE_TABLES = False
+
+    logging.basicConfig(
+        format="%(asctime)s %(levelname)s %(message)s",
+        level=logging.DEBUG if args.verbose else logging.INFO,
+    )
+
+    config = configparser.ConfigParser()
+    config.read(args.config)
+
+    RenderHandler.service = RenderService(config, args.dir, max_renders=args.renders)
+    server = HTTPServer(("", args.port), RenderHandler)
+    logging.info("Serving previews on port %d", args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
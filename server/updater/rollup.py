@@ -0,0 +1,337 @@
+"""
+Round-robin telemetry rollups, in the style of RRDtool
+"""
+
+import datetime
+import json
+import logging
+from bisect import bisect_left
+
+from chart_series import event_time, events_since, saved_cursor
+
+# Name, seconds per slot, number of slots
+TIERS = (
+    ("raw", 60, 7 * 24 * 60),
+    ("hourly", 60 * 60, 92 * 24),
+    ("daily", 24 * 60 * 60, 5 * 366),
+)
+
+# Offsets into a slot record
+START, COUNT = 0, 1
+BATT_MIN, BATT_MAX, BATT_SUM = 2, 3, 4
+SCREEN_MIN, SCREEN_MAX, SCREEN_SUM = 5, 6, 7
+RESETS = 8
+# Running totals up to and including the slot, so a range's sums need two slots
+CUM_COUNT, CUM_BATT, CUM_SCREEN = 9, 10, 11
+
+
+class Tier(object):
+    """
+    A fixed number of fixed-width time slots.  A timestamp always maps to the
+    same slot, keyed by (start // step) % size with the slot's start kept in
+    it; a slot whose start doesn't match is from a previous lap around the
+    ring and is overwritten in place.
+
+    Only occupied slots are stored, as most minutes have no beacon in them.
+    Beacons arrive in time order, so each new slot's start is appended to
+    starts and a range is found by bisecting rather than stepping through
+    every empty slot in it.  Starts of lapped slots are left in there until
+    the next reindex(), reads skip them.  A beacon older than the newest slot
+    only marks the tier for a reindex() before the next read, so adding is
+    always O(1).
+    """
+
+    def __init__(self, name, step, size):
+        self.name = name
+        self.step = step
+        self.size = size
+        self.slots = {}
+        self.starts = []
+        self.dirty = False
+
+    def _slot(self, start):
+        """
+        :return: The slot starting at start, or None if it's been lapped
+        """
+        slot = self.slots.get((start // self.step) % self.size)
+        if slot is None or slot[START] != start:
+            return None
+        return slot
+
+    @property
+    def newest(self):
+        """Start of the newest slot, or None if it's empty"""
+        return self.starts[-1] if self.starts else None
+
+    def expire(self):
+        """
+        Drop slots from before the newest lap, so they aren't saved
+        """
+        if not self.slots:
+            return
+        oldest = max(slot[START] for slot in self.slots.values()) - self.span
+        self.slots = {
+            idx: slot for idx, slot in self.slots.items() if slot[START] > oldest
+        }
+
+    def reindex(self):
+        """
+        Rebuild the order and running totals, after loading or an add out of order
+        """
+        self.expire()
+        self.starts = sorted(slot[START] for slot in self.slots.values())
+        count = battery = screen = 0
+        for start in self.starts:
+            slot = self._slot(start)
+            count += slot[COUNT]
+            battery += slot[BATT_SUM]
+            screen += slot[SCREEN_SUM]
+            slot[CUM_COUNT:] = [count, battery, screen]
+        self.dirty = False
+
+    def _index(self):
+        if self.dirty:
+            self.reindex()
+
+    @property
+    def span(self):
+        """Seconds of history this tier can hold"""
+        return self.step * self.size
+
+    def add(self, when, battery, screen, reset):
+        """
+        :param when: Epoch seconds
+        :param battery: Charge percentage
+        :param screen: Screen temperature
+        :param reset: Reset cause string
+        """
+        start = int(when) - int(when) % self.step
+        idx = (start // self.step) % self.size
+        newest = self.newest
+        if newest is not None and start <= newest - self.span:
+            # Older than the ring reaches back
+            return
+        in_order = newest is None or start >= newest
+        slot = self.slots.get(idx)
+        if slot is None or slot[START] != start:
+            # Totals carry on from the newest slot, fixed up later if it's not this
+            totals = self._slot(newest)[CUM_COUNT:] if in_order and newest else [0] * 3
+            record = [start, 0, battery, battery, 0, screen, screen, 0, {}] + totals
+            if slot is None:
+                slot = self.slots[idx] = record
+            else:
+                slot[:] = record
+            if in_order:
+                self.starts.append(start)
+                # Lapped starts pile up otherwise
+                if len(self.starts) > 2 * self.size:
+                    self.dirty = True
+        slot[COUNT] += 1
+        slot[BATT_MIN] = min(slot[BATT_MIN], battery)
+        slot[BATT_MAX] = max(slot[BATT_MAX], battery)
+        slot[BATT_SUM] += battery
+        slot[SCREEN_MIN] = min(slot[SCREEN_MIN], screen)
+        slot[SCREEN_MAX] = max(slot[SCREEN_MAX], screen)
+        slot[SCREEN_SUM] += screen
+        slot[RESETS][reset] = slot[RESETS].get(reset, 0) + 1
+        if start == self.newest:
+            slot[CUM_COUNT] += 1
+            slot[CUM_BATT] += battery
+            slot[CUM_SCREEN] += screen
+        else:
+            self.dirty = True
+
+    def _range(self, start, end):
+        """
+        :return: (first, last + 1) indices into starts of the slots in the range
+        """
+        slot_start = int(start) - int(start) % self.step
+        # Never go round the ring more than once
+        slot_start = max(slot_start, int(end) - self.span)
+        return bisect_left(self.starts, slot_start), bisect_left(self.starts, end)
+
+    def fetch(self, start, end):
+        """
+        :param start: Epoch seconds, inclusive
+        :param end: Epoch seconds, exclusive
+        :return: Slot records in time order, skipping any without data
+        """
+        self._index()
+        first, last = self._range(start, end)
+        slots = [self._slot(slot_start) for slot_start in self.starts[first:last]]
+        return [slot for slot in slots if slot is not None]
+
+    def totals(self, start, end):
+        """
+        Reads two slots however long the range is
+        :param start: Epoch seconds, inclusive
+        :param end: Epoch seconds, exclusive
+        :return: (count, battery sum, screen sum) over the slots in the range
+        """
+        self._index()
+        first, last = self._range(start, end)
+        # Step past any lapped slots, there's only ever a few at the old end
+        while first < last and self._slot(self.starts[first]) is None:
+            first += 1
+        while first < last and self._slot(self.starts[last - 1]) is None:
+            last -= 1
+        if first >= last:
+            return 0, 0, 0
+        before = self._slot(self.starts[first])
+        after = self._slot(self.starts[last - 1])
+        return (
+            after[CUM_COUNT] - before[CUM_COUNT] + before[COUNT],
+            after[CUM_BATT] - before[CUM_BATT] + before[BATT_SUM],
+            after[CUM_SCREEN] - before[CUM_SCREEN] + before[SCREEN_SUM],
+        )
+
+
+class RollupStore(object):
+    """
+    Per-device raw, hourly and daily tiers of battery, screen temperature and
+    reset causes.  Every beacon goes into every tier; reads pick the finest
+    tier that still covers the range asked for.
+    """
+
+    def __init__(self):
+        self.cursor = 0
+        self.devices = {}
+
+    @staticmethod
+    def load(path):
+        """
+        :param path: JSON file written by save()
+        :return: RollupStore, empty if the file was missing or unreadable
+        """
+        store = RollupStore()
+        try:
+            with open(path) as rollup_file:
+                saved = json.load(rollup_file)
+            store.cursor = saved_cursor(saved["cursor"])
+            for device, tiers in saved["devices"].items():
+                for tier in store.tiers(device):
+                    tier.slots = {int(k): v for k, v in tiers[tier.name].items()}
+                    tier.reindex()
+        except FileNotFoundError:
+            logging.info("No rollups saved yet")
+        except (ValueError, KeyError):
+            logging.warning("Discarding unreadable rollups at %s", path)
+            store = RollupStore()
+        return store
+
+    def save(self, path):
+        for tiers in self.devices.values():
+            for tier in tiers:
+                tier.expire()
+        with open(path, "w") as rollup_file:
+            json.dump(
+                {
+                    "cursor": self.cursor,
+                    "devices": {
+                        device: {tier.name: tier.slots for tier in tiers}
+                        for device, tiers in self.devices.items()
+                    },
+                },
+                rollup_file,
+            )
+
+    def tiers(self, device):
+        """
+        :param device: Device name, created if it's new
+        :return: List of Tier, finest first
+        """
+        tiers = self.devices.get(device)
+        if tiers is None:
+            tiers = self.devices[device] = [Tier(*spec) for spec in TIERS]
+        return tiers
+
+    def add(self, device, when, battery, screen, reset):
+        """
+        Record one beacon in every tier
+        :param device: Device name
+        :param when: Epoch seconds
+        """
+        for tier in self.tiers(device):
+            tier.add(when, battery, screen, reset)
+
+    def update(self, events):
+        """
+        Fold in any log events newer than the cursor
+        :param events: The client/log events in the XML, oldest first
+        :return: True if anything was added
+        """
+        new_events = events_since(events, self.cursor)
+        for ev in new_events:
+            if "screen" not in ev.attrib:
+                continue
+            self.add(
+                ev.attrib.get("ip", "unknown"),
+                event_time(ev),
+                int(ev.attrib["battery"]),
+                int(ev.attrib["screen"]),
+                ev.attrib["reset"],
+            )
+        if new_events:
+            self.cursor = event_time(new_events[-1])
+        return bool(new_events)
+
+    def tier(self, device, start, min_step=0, now=None):
+        """
+        :param device: Device name
+        :param start: Epoch seconds
+        :param min_step: Don't use tiers finer than this many seconds per slot
+        :param now: For testing, defaults to the current time
+        :return: The finest Tier covering start, or None for an unknown device
+        """
+        if now is None:
+            now = datetime.datetime.now().timestamp()
+        if device not in self.devices:
+            return None
+        tiers = self.devices[device]
+        for tier in tiers:
+            if tier.step >= min_step and now - tier.span <= start:
+                break
+        return tier
+
+    def query(self, device, start, end, min_step=0, now=None):
+        """
+        Choosing the tier costs O(tiers), after that it's a bisect and then one
+        step per slot with data in the range.
+
+        :param device: Device name
+        :param start: Epoch seconds
+        :param end: Epoch seconds
+        :param min_step: As for tier()
+        :param now: For testing, defaults to the current time
+        :return: (tier name, slot records) from the finest tier covering start
+        """
+        tier = self.tier(device, start, min_step, now)
+        if tier is None:
+            return None, []
+        return tier.name, tier.fetch(start, end)
+
+    def summary(self, device, start, end, now=None):
+        """
+        Count and means over any range, O(tiers) as it's two slots of one tier
+        :param device: Device name
+        :param start: Epoch seconds
+        :param end: Epoch seconds
+        :param now: For testing, defaults to the current time
+        :return: Dict of count, battery and screen, or None if there's no data
+        """
+        tier = self.tier(device, start, now=now)
+        if tier is None:
+            return None
+        count, battery, screen = tier.totals(start, end)
+        if not count:
+            return None
+        return {"count": count, "battery": battery / count, "screen": screen / count}
+
+    @staticmethod
+    def mean(slot, field_sum):
+        """
+        :param slot: Record from query()
+        :param field_sum: BATT_SUM or SCREEN_SUM
+        :return: Average over the slot
+        """
+        return slot[field_sum] / slot[COUNT]
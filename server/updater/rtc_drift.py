@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Estimates how fast each device's RTC drifts, from when it was asked to wake
+against when its beacon actually arrived.
+
+The RTC is set from the server at every connected wake, so the error in a
+wake grows with how long the device slept since then.  Each beacon that
+answers a <requested> wake gives a sample of (sleep, lateness), and a straight
+line through them gives the drift as its slope.  The intercept is the time
+from the alarm to the beacon, booting and joining WiFi plus any wake slot
+comms added, which is the same every wake so isn't corrected for.
+
+Devices wake early by the drift they were last sent, and say in their beacon
+how much that was.  It's added back on, so the fit is of the whole drift
+rather than what's left of it, which would swing back and forth each run.
+"""
+
+import argparse
+import datetime
+import logging
+from bisect import bisect_left, bisect_right
+
+import pytz
+
+gmt = pytz.timezone("GMT")
+
+# Beacons further than this from a requested wake weren't woken by it
+MATCH = datetime.timedelta(minutes=30)
+
+# Fewest samples, and least spread in sleeps, to tell drift from latency
+MIN_SAMPLES = 4
+MIN_SPREAD = datetime.timedelta(hours=1)
+
+# Only the latest samples, in case the device's been replaced or moved
+MAX_SAMPLES = 50
+
+# Anything more than this is a bad fit, not a clock
+MAX_DRIFT = 2000
+
+
+def _log_time(node):
+    return datetime.datetime.strptime(
+        node.attrib["time"].split("+")[0], "%Y-%m-%dT%H:%M:%S"
+    ).timestamp()
+
+
+def _requested_time(node):
+    # Written in GMT by the generator, unlike the log which is local
+    return gmt.localize(
+        datetime.datetime.strptime(
+            node.attrib["time"].split(".")[0], "%Y-%m-%dT%H:%M:%S"
+        )
+    ).timestamp()
+
+
+def _applied_drift(node):
+    # What the device corrected its alarm by, none from older devices
+    try:
+        return float(node.attrib.get("drift", 0))
+    except ValueError:
+        return 0.0
+
+
+def observations(metadata):
+    """
+    :param metadata: Server metadata XML, with client/log and client/requested
+    :return: Dict of device to list of (seconds slept, seconds late) samples,
+    late as if the device hadn't corrected for its drift
+    """
+    requested = sorted(
+        _requested_time(node) for node in metadata.iterfind("./client/requested")
+    )
+    beacons = {}
+    for node in metadata.iterfind("./client/log"):
+        if "ip" in node.attrib:
+            beacons.setdefault(node.attrib["ip"], []).append(
+                (_log_time(node), node.attrib.get("reset"), _applied_drift(node))
+            )
+
+    match = MATCH.total_seconds()
+    samples = {}
+    for device, times in beacons.items():
+        times.sort()
+        for (synced, _, _), (actual, reset, applied) in zip(times, times[1:]):
+            # Only the RTC woke it, and only it was set at the beacon before
+            if reset != "sleep":
+                continue
+            first = bisect_right(requested, max(synced, actual - match))
+            wakes = requested[first : bisect_left(requested, actual + match)]
+            if not wakes:
+                continue
+            wake = min(wakes, key=lambda when: abs(actual - when))
+            # How much earlier it woke than its RTC alone would have
+            corrected = (wake - synced) * applied * 1e-6
+            samples.setdefault(device, []).append(
+                (wake - synced, actual - wake + corrected)
+            )
+    return samples
+
+
+def fit(samples):
+    """
+    Least squares line through the samples
+    :param samples: List of (seconds slept, seconds late)
+    :return: (drift in parts per million, latency in seconds), or None if
+    there's too little to go on
+    """
+    samples = samples[-MAX_SAMPLES:]
+    if len(samples) < MIN_SAMPLES:
+        return None
+    mean_sleep = sum(sleep for sleep, _ in samples) / len(samples)
+    mean_late = sum(late for _, late in samples) / len(samples)
+    spread = sum((sleep - mean_sleep) ** 2 for sleep, _ in samples)
+    if (spread / len(samples)) ** 0.5 < MIN_SPREAD.total_seconds():
+        return None
+    slope = (
+        sum((sleep - mean_sleep) * (late - mean_late) for sleep, late in samples)
+        / spread
+    )
+    drift = slope * 1e6
+    if abs(drift) > MAX_DRIFT:
+        return None
+    return drift, mean_late - slope * mean_sleep
+
+
+def estimate_drift(metadata):
+    """
+    :param metadata: Server metadata XML
+    :return: Dict of device to dict of drift (whole ppm, positive if it wakes
+    late), latency and samples, that's fine to json.dump()
+    """
+    drifts = {}
+    for device, samples in observations(metadata).items():
+        fitted = fit(samples)
+        if fitted is None:
+            logging.debug("Not enough wakes from %s to fit its drift", device)
+            continue
+        drift, latency = fitted
+        drifts[device] = {
+            "drift": int(round(drift)),
+            "latency": round(latency, 1),
+            "samples": min(len(samples), MAX_SAMPLES),
+        }
+    return drifts
+
+
+if __name__ == "__main__":
+    from lxml import etree
+
+    parser = argparse.ArgumentParser(description="Estimate device RTC drift")
+    parser.add_argument("-x", "--xml", help="Server metadata", default="server.xml")
+    args = parser.parse_args()
+
+    drifts = estimate_drift(etree.parse(args.xml))
+    for device, result in sorted(drifts.items()):
+        print(
+            "%s: %+d ppm (%+.1fs a day), %.1fs to beacon, from %d wakes"
+            % (
+                device,
+                result["drift"],
+                result["drift"] * 86400 / 1e6,
+                result["latency"],
+                result["samples"],
+            )
+        )
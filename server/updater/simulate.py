@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""
+Replays the updater over a range of days against recorded tides (and
+optionally weather), printing the wake schedule, a fingerprint of each frame
+and how long rendering took.  Nothing is written, so it's safe to point at
+the production data directory.
+"""
+
+import argparse
+import configparser
+import datetime
+import hashlib
+import logging
+import multiprocessing
+import os.path
+import statistics
+import time
+
+import ephem_tools
+from display_renderer import DisplayRenderer
+from epd_generator import EPDGenerator
+from lxml import etree
+from panel import DEFAULT_PANEL, PANELS
+from render_ahead import choose_tides
+from tide import TideTable, find_tides_node, station
+from tide_curve import curve_from_config
+from tideclock_generator import SERVER_METADATA, SLACK, next_wakeup, slack_from_config
+
+# MUST BE TZLOCAL 4.x!
+from tzlocal import get_localzone
+from wake_planner import WakePlanner
+from weather import Weather
+
+# How often run.sh runs the generator
+RUN_PERIOD = datetime.timedelta(minutes=10)
+
+
+def load_tides(path, name=None):
+    """
+    :param path: server.xml, or any file with the same <tides> node
+    :param name: Station, as from tide.station(), or None for the first stored
+    :return: TideTable
+    """
+    return TideTable.load_xml(find_tides_node(etree.parse(path), name))
+
+
+def schedule(tides, start, end, tz=None, planner=None, forecast_times=()):
+    """
+    Step through the generator's runs, noting those that would make a new image
+    :param tides: TideTable
+    :param start: Timezone-aware start of the replay
+    :param end: Timezone-aware end of the replay
+    :param tz: Local timezone
+    :param planner: WakePlanner, or None for a wake per tide
+    :param forecast_times: For the planner, from Weather.forecast_times()
+    :return: List of (run time, wakeup requested)
+    """
+    cycles = []
+    slack = planner.lead if planner else SLACK
+    next_wake = None
+    when = start
+    while when < end:
+        if next_wake is None or when >= next_wake - slack:
+            next_wake = None
+            if planner:
+                next_wake = planner.next_wake(tides, when, tz, forecast_times)
+            if next_wake is None:
+                _, _, tide_change = choose_tides(tides, when, tz)
+                next_wake = next_wakeup(when, tide_change, slack)
+            cycles.append((when, next_wake))
+        when += RUN_PERIOD
+    return cycles
+
+
+# Per-process state, so each job only has to carry its times
+_worker = {}
+
+
+def _init_worker(tides, tz, weather_files, renderer_args):
+    # Build ephemeris tables in memory rather than into the data directory
+    ephem_tools.SAVE_TABLES = False
+    # Weather is loaded here as lxml trees don't pickle
+    weather = Weather.from_files(*weather_files) if any(weather_files) else None
+    _worker.update(tides=tides, tz=tz, weather=weather, renderer_args=renderer_args)
+
+
+def render_cycle(cycle):
+    """
+    :param cycle: (run time, wakeup) from schedule()
+    :return: Dict describing the cycle and its frame
+    """
+    when, wake = cycle
+    tz = _worker["tz"]
+    tide1, tide2, _ = choose_tides(_worker["tides"], when, tz)
+    result = {"time": when, "wakeup": wake, "tide": None, "frame": None, "ms": 0}
+    if tide1 is None:
+        return result
+
+    weather = _worker["weather"]
+    started = time.perf_counter()
+    d = DisplayRenderer(
+        tide1,
+        tide2,
+        tz=tz,
+        when=when,
+        weather=weather.at(when) if weather else None,
+        **_worker["renderer_args"],
+    )
+    d.render()
+    d._gen_bw()
+    data = EPDGenerator(d.surface_bw, panel=d.panel).to_bytes()
+    result["ms"] = (time.perf_counter() - started) * 1000
+    result["tide"] = str(tide1)
+    # Same id comms sends the device in X-Frame
+    result["frame"] = hashlib.sha1(data).hexdigest()[:16]
+    return result
+
+
+def simulate(
+    tides,
+    start,
+    end,
+    tz=None,
+    weather_files=(None, None),
+    jobs=None,
+    planner=None,
+    **renderer_args
+):
+    """
+    :param tides: TideTable
+    :param start: Timezone-aware start of the replay
+    :param end: Timezone-aware end of the replay
+    :param tz: Local timezone
+    :param weather_files: (land, marine) fixture paths for Weather.from_files()
+    :param jobs: Worker processes, defaults to one per core.  1 runs in-process
+    :param planner: WakePlanner, or None for a wake per tide
+    :param renderer_args: battery, location, dither, panel, curve for DisplayRenderer
+    :return: List of render_cycle() results in time order
+    """
+    forecast_times = []
+    if planner and any(weather_files):
+        forecast_times = Weather.from_files(*weather_files).forecast_times()
+    cycles = schedule(tides, start, end, tz, planner, forecast_times)
+    init_args = (tides, tz, weather_files, renderer_args)
+    if jobs == 1:
+        _init_worker(*init_args)
+        return [render_cycle(cycle) for cycle in cycles]
+
+    with multiprocessing.Pool(jobs, _init_worker, init_args) as pool:
+        return pool.map(render_cycle, cycles, chunksize=4)
+
+
+def summarise(results, days):
+    """
+    :param results: From simulate()
+    :param days: Length of the replay
+    :return: Dict of totals and render timings
+    """
+    timings = [r["ms"] for r in results if r["frame"]]
+    summary = {
+        "cycles": len(results),
+        "wakes_per_day": len(results) / days if days else 0,
+        "frames": len({r["frame"] for r in results if r["frame"]}),
+        "blank": len(results) - len(timings),
+    }
+    if timings:
+        timings.sort()
+        summary.update(
+            mean_ms=statistics.mean(timings),
+            p95_ms=timings[int(0.95 * (len(timings) - 1))],
+            max_ms=timings[-1],
+        )
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay the updater over days")
+    parser.add_argument("-d", "--dir", default=".")
+    parser.add_argument("-c", "--config", help="Configuration", required=True)
+    parser.add_argument("-s", "--start", help="First day, %%Y-%%m-%%d", required=True)
+    parser.add_argument("-n", "--days", type=int, default=28)
+    parser.add_argument("-x", "--tides", help="Tide fixture, defaults to server.xml")
+    parser.add_argument("--land", help="Land forecast fixture XML")
+    parser.add_argument("--marine", help="Marine observation fixture XML")
+    parser.add_argument("-b", "--battery", type=int, default=-1)
+    parser.add_argument("-j", "--jobs", type=int, help="Worker processes")
+    parser.add_argument(
+        "-v", "--verbose", action="store_const", const=True, default=False
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        format="%(asctime)s %(levelname)s %(message)s",
+        level=logging.DEBUG if args.verbose else logging.INFO,
+    )
+
+    config = configparser.ConfigParser()
+    config.read(args.config)
+
+    our_tz = get_localzone()
+    start = our_tz.localize(datetime.datetime.strptime(args.start, "%Y-%m-%d"))
+    end = start + datetime.timedelta(days=args.days)
+
+    tides = load_tides(
+        args.tides
+        or config.get(
+            "General",
+            "ServerMetadata",
+            fallback=os.path.join(args.dir, SERVER_METADATA),
+        ),
+        station(config),
+    )
+    started = time.perf_counter()
+    results = simulate(
+        tides,
+        start,
+        end,
+        tz=our_tz,
+        weather_files=(args.land, args.marine),
+        jobs=args.jobs,
+        planner=WakePlanner.from_config(config, slack_from_config(config)),
+        battery=args.battery,
+        location=(
+            config.getfloat("Geo", "Latitude", fallback=0),
+            config.getfloat("Geo", "Longitude", fallback=0),
+        ),
+        dither=config.get("Display", "Dither", fallback="diffusion"),
+        panel=PANELS[config.get("Display", "Panel", fallback=DEFAULT_PANEL.name)],
+        curve=curve_from_config(config, tides),
+    )
+    elapsed = time.perf_counter() - started
+
+    for r in results:
+        print(
+            "%s  wake %s  %s  %6.1fms  %s"
+            % (
+                r["time"].strftime("%Y-%m-%d %H:%M"),
+                r["wakeup"].astimezone(our_tz).strftime("%Y-%m-%d %H:%M"),
+                r["frame"] or "-" * 16,
+                r["ms"],
+                r["tide"] or "no tides",
+            )
+        )
+
+    summary = summarise(results, args.days)
+    print(
+        "%d cycles over %d days, %.1f wakes/day, %d distinct frames, %d blank"
+        % (
+            summary["cycles"],
+            args.days,
+            summary["wakes_per_day"],
+            summary["frames"],
+            summary["blank"],
+        )
+    )
+    if "mean_ms" in summary:
+        print(
+            "Render mean %.1fms, p95 %.1fms, max %.1fms"
+            % (summary["mean_ms"], summary["p95_ms"], summary["max_ms"])
+        )
+    print("Took %.2fs" % elapsed)
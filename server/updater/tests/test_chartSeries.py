@@ -0,0 +1,97 @@
+import datetime
+import os.path
+import tempfile
+from unittest import TestCase
+
+from chart_series import ChartSeries, saved_cursor
+from lxml import etree
+
+
+def make_log(when, battery, screen=20):
+    node = etree.Element("log")
+    node.attrib["battery"] = str(battery)
+    node.attrib["reset"] = "sleep"
+    node.attrib["screen"] = str(screen)
+    node.attrib["time"] = when.strftime("%Y-%m-%dT%H:%M:%S")
+    return node
+
+
+class TestChartSeries(TestCase):
+    def test_update_only_adds_new_events(self):
+        now = datetime.datetime(2024, 6, 1, 12, 0)
+        events = [make_log(now - datetime.timedelta(hours=h), h) for h in (3, 2, 1)]
+        series = ChartSeries()
+        self.assertTrue(series.update(events, now))
+        self.assertEqual(series.battery, [3, 2, 1])
+
+        self.assertFalse(series.update(events, now))
+        events.append(make_log(now, 0))
+        self.assertTrue(series.update(events, now))
+        self.assertEqual(series.battery, [3, 2, 1, 0])
+
+    def test_update_expires_old_points(self):
+        now = datetime.datetime(2024, 6, 1, 12, 0)
+        events = [
+            make_log(now - datetime.timedelta(days=3), 50),
+            make_log(now - datetime.timedelta(hours=1), 40),
+        ]
+        series = ChartSeries(days=2)
+        series.update(events, now)
+        self.assertEqual(series.battery, [40])
+
+    def test_points_within_budget(self):
+        now = datetime.datetime(2024, 6, 1, 12, 0)
+        events = [
+            make_log(now - datetime.timedelta(minutes=10 * m), m % 101)
+            for m in range(2000, 0, -1)
+        ]
+        series = ChartSeries(budget=100)
+        series.update(events, now)
+        points = series.points("battery")
+        self.assertEqual(len(points), 100)
+        self.assertEqual(points[0][1], series.battery[0])
+        self.assertEqual(points[-1][1], series.battery[-1])
+        self.assertIn(100, [p[1] for p in points])
+
+    def test_selected_kept_for_window(self):
+        now = datetime.datetime(2024, 6, 1, 12, 0)
+        events = [
+            make_log(now - datetime.timedelta(minutes=10 * m), m % 101)
+            for m in range(500, 0, -1)
+        ]
+        series = ChartSeries(budget=50)
+        series.update(events, now)
+        selected = series.selected("battery")
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "series.json")
+            series.save(path)
+            loaded = ChartSeries.load(path, budget=50)
+        self.assertIs(loaded.selected("battery"), loaded.selected("battery"))
+        self.assertEqual(loaded.selected("battery"), selected)
+
+        # A new point moves the window, so the last one picked is the new one
+        events.append(make_log(now, 0))
+        loaded.update(events, now)
+        self.assertEqual(loaded.selected("battery")[-1], len(loaded.times) - 1)
+        self.assertEqual(len(loaded.selected("battery")), 50)
+
+    def test_repeated_hour_not_skipped(self):
+        # The clocks went back, both at 01:30 local but an hour apart
+        first = make_log(datetime.datetime(2024, 10, 27, 1, 30), 50)
+        first.attrib["utc"] = "1729989000.000"
+        second = make_log(datetime.datetime(2024, 10, 27, 1, 30), 49)
+        second.attrib["utc"] = "1729992600.000"
+        now = datetime.datetime(2024, 10, 27, 3, 0)
+
+        series = ChartSeries()
+        self.assertTrue(series.update([first], now))
+        self.assertTrue(series.update([first, second], now))
+        self.assertEqual(series.battery, [50, 49])
+        self.assertEqual(series.cursor, 1729992600)
+
+        # Cursors saved as a local time still work
+        series = ChartSeries()
+        series.cursor = saved_cursor("2024-10-26T12:00:00")
+        self.assertTrue(series.update([first, second], now))
+        self.assertEqual(series.battery, [50, 49])
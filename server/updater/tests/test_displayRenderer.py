@@ -1,8 +1,12 @@
 import datetime
+import os.path
+import tempfile
 from unittest import TestCase
 
 import pytz
-from display_renderer import DisplayRenderer
+from display_renderer import DisplayRenderer, clock_hand_table
+from epd_generator import EPDGenerator
+from panel import PANEL_4_2, PanelProfile
 from tide import Tide
 
 
@@ -16,3 +20,49 @@ class TestDisplayRenderer(TestCase):
         default.render()
         with_tz = DisplayRenderer(tide1, tz=gmt)
         with_tz.render()
+
+    def test_background_shared(self):
+        gmt = pytz.timezone("GMT")
+        tide1 = Tide(gmt.localize(datetime.datetime(2024, 5, 1, 3, 17)), "high", 3.3)
+        first = DisplayRenderer(tide1, battery=50)
+        first.render()
+        second = DisplayRenderer(tide1, battery=50)
+        self.assertIs(first.background(), second.background())
+        second.render()
+        self.assertEqual(first.surface.tobytes(), second.surface.tobytes())
+
+    def test_clock_hand_table(self):
+        tl, br = (20, 50), (240, 265)
+        table = clock_hand_table(tl, br)
+        self.assertEqual(len(table), 720)
+        # 3:30, the tip of each hand is the third point
+        big_hand, little_hand = table[3 * 60 + 30]
+        self.assertEqual(
+            tuple(big_hand[4:6]), DisplayRenderer.polar_to_cartesian(tl, br, 0.9, 0.5)
+        )
+        self.assertEqual(
+            tuple(little_hand[4:6]),
+            DisplayRenderer.polar_to_cartesian(tl, br, 0.55, 3.5 / 12),
+        )
+
+    def test_panel_profile(self):
+        gmt = pytz.timezone("GMT")
+        tide1 = Tide(gmt.localize(datetime.datetime(2024, 5, 1, 3, 17)), "high", 3.3)
+        wide = PanelProfile("test-wide", (600, 300), 0x33, PANEL_4_2.layout)
+        d = DisplayRenderer(tide1, battery=50, panel=wide)
+        d.render()
+        self.assertEqual(d.surface.size, (600, 300))
+        self.assertIsNot(
+            d.background(), DisplayRenderer(tide1, battery=50).background()
+        )
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "wide.bin")
+            d._gen_bw()
+            EPDGenerator(d.surface_bw, panel=wide).save(path)
+            with open(path, "rb") as epd:
+                data = epd.read()
+        self.assertEqual(len(data), wide.image_size)
+        self.assertEqual(data[:16], wide.header())
+        self.assertEqual(PanelProfile.image_size_from_header(data[:16]), len(data))
+        self.assertEqual(PANEL_4_2.image_size, 15016)
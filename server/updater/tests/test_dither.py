@@ -0,0 +1,31 @@
+import os.path
+from unittest import TestCase
+
+from dither import MODES, to_1bpp
+from PIL import Image
+
+GOLDEN_DIR = os.path.join(os.path.dirname(__file__), "golden")
+
+
+class TestDither(TestCase):
+    def test_golden_images(self):
+        source = Image.linear_gradient("L").resize((64, 48))
+        for mode in MODES:
+            with self.subTest(mode=mode):
+                golden = Image.open(os.path.join(GOLDEN_DIR, "dither_%s.png" % mode))
+                result = to_1bpp(source, mode)
+                self.assertEqual(result.mode, "1")
+                self.assertEqual(result.tobytes(), golden.tobytes())
+
+    def test_black_and_white_kept(self):
+        source = Image.new("L", (8, 8), 255)
+        source.paste(0, (0, 0, 4, 8))
+        for mode in MODES:
+            with self.subTest(mode=mode):
+                self.assertEqual(
+                    to_1bpp(source, mode).tobytes(), source.convert("1").tobytes()
+                )
+
+    def test_unknown_mode(self):
+        with self.assertRaises(ValueError):
+            to_1bpp(Image.new("L", (8, 8)), "sierra")
@@ -0,0 +1,20 @@
+from unittest import TestCase
+
+from epd_generator import EPDGenerator
+from panel import DEFAULT_PANEL, HEADER_SIZE, PanelProfile
+from PIL import Image
+
+
+class TestEPDGenerator(TestCase):
+    def test_size_matches_header(self):
+        data = EPDGenerator(Image.new("1", DEFAULT_PANEL.res), panel=DEFAULT_PANEL)
+        data = data.to_bytes()
+        self.assertEqual(len(data), DEFAULT_PANEL.image_size)
+        self.assertEqual(
+            PanelProfile.image_size_from_header(data[:HEADER_SIZE]), len(data)
+        )
+
+    def test_rejects_deeper_panels(self):
+        grey = PanelProfile("grey", (8, 8), 0x34, DEFAULT_PANEL.layout, bpp=2)
+        with self.assertRaises(ValueError):
+            EPDGenerator(Image.new("1", grey.res), panel=grey)
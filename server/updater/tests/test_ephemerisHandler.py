@@ -1,8 +1,10 @@
+import os.path
+import tempfile
 from datetime import date, datetime, timedelta
 from unittest import TestCase
 
 import pytz
-from ephem_tools import EphemerisHandler
+from ephem_tools import EphemerisHandler, EphemerisTable
 
 
 class TestEphemerisHandler(TestCase):
@@ -26,3 +28,50 @@ class TestEphemerisHandler(TestCase):
             gmt.localize(datetime(2016, 10, 27, 16, 35, 0)),
             delta=timedelta(seconds=60),
         )
+
+    def test_table_matches_live(self):
+        table = EphemerisTable.build((51.85, 1.28), 2016)
+        for day in (date(2016, 1, 1), date(2016, 6, 21), date(2016, 12, 31)):
+            live = EphemerisHandler((51.85, 1.28), day)
+            self.assertEqual(
+                table.sunrise_on(day), int(live.calculate_sunrise().timestamp())
+            )
+            self.assertEqual(
+                table.sunset_on(day), int(live.calculate_sunset().timestamp())
+            )
+            self.assertEqual(table.moon_on(day), live.calculate_moon_phase())
+        self.assertIsNone(table.moon_on(date(2017, 1, 1)))
+
+    def test_table_saved(self):
+        table = EphemerisTable.build((51.85, 1.28), 2016)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "table.npz")
+            table.save(path)
+            loaded = EphemerisTable.load(path, (51.85, 1.28), 2016)
+            self.assertIsNone(EphemerisTable.load(path, (50.0, 1.28), 2016))
+        self.assertEqual(
+            loaded.sunset_on(date(2016, 10, 27)), table.sunset_on(date(2016, 10, 27))
+        )
+        self.assertEqual(loaded.moon.tobytes(), table.moon.tobytes())
+
+    def test_truncated_table_rebuilt(self):
+        table = EphemerisTable.build((51.85, 1.28), 2016)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "table.npz")
+            table.save(path)
+            with open(path, "r+b") as table_file:
+                table_file.truncate(os.path.getsize(path) // 2)
+            self.assertIsNone(EphemerisTable.load(path, (51.85, 1.28), 2016))
+            # Nothing's left behind from the save
+            self.assertEqual(os.listdir(tmp), ["table.npz"])
+
+    def test_tables_fall_back(self):
+        # Not midnight, so the tables don't apply and it's solved live
+        e = EphemerisHandler((51.85, 1.28), tables=True)
+        e.observer.date = datetime(2016, 10, 27, 12)
+        gmt = pytz.timezone("GMT")
+        self.assertAlmostEqual(
+            e.calculate_sunset(),
+            gmt.localize(datetime(2016, 10, 27, 16, 35, 0)),
+            delta=timedelta(seconds=60),
+        )
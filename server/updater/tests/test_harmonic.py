@@ -0,0 +1,79 @@
+import configparser
+import datetime
+from unittest import TestCase
+
+import numpy as np
+from harmonic import SPEEDS, HarmonicModel
+from tide import TideTable
+
+START = int(datetime.datetime(2024, 5, 1, tzinfo=datetime.timezone.utc).timestamp())
+DAY = 86400
+
+
+class TestHarmonicModel(TestCase):
+    def setUp(self):
+        self.model = HarmonicModel(
+            2.1,
+            {
+                "M2": (1.4, 317.0),
+                "S2": (0.45, 12.0),
+                "N2": (0.25, 290.0),
+                "K1": (0.1, 40.0),
+                "O1": (0.12, 200.0),
+            },
+        )
+
+    def test_pure_m2(self):
+        model = HarmonicModel(1.0, {"M2": (2.0, 0.0)})
+        period = 360 / SPEEDS["M2"] * 3600
+        table = model.extremes(START, START + 10 * DAY)
+        # Two highs and two lows a lunar day, alternating
+        self.assertIn(len(table), (38, 39))
+        self.assertTrue(np.allclose(np.diff(table.times), period / 2, atol=2))
+        highs = [table.is_high(i) for i in range(len(table))]
+        self.assertTrue(all(a != b for a, b in zip(highs, highs[1:])))
+        for i in range(len(table)):
+            self.assertAlmostEqual(
+                float(table.heights[i]), 3.0 if highs[i] else -1.0, places=4
+            )
+
+    def test_extremes_are_turning_points(self):
+        table = self.model.extremes(START, START + 60 * DAY)
+        self.assertGreater(len(table), 110)
+        # Rate of change at each is about zero, a minute either side sets the type
+        self.assertTrue(np.all(np.abs(self.model.rates(table.times)) < 2e-6))
+        for i in range(0, len(table), 7):
+            before = self.model.heights([table.times[i] - 60])[0]
+            self.assertEqual(table.is_high(i), before < table.heights[i])
+
+    def test_fit_samples(self):
+        times = np.arange(START, START + 30 * DAY, 1800)
+        fitted = HarmonicModel.fit(
+            times, self.model.heights(times), names=self.model.names
+        )
+        later = np.arange(START + 60 * DAY, START + 61 * DAY, 600)
+        self.assertTrue(
+            np.allclose(fitted.heights(later), self.model.heights(later), atol=1e-6)
+        )
+
+    def test_fit_extremes(self):
+        observed = self.model.extremes(START, START + 30 * DAY)
+        fitted = HarmonicModel.fit_extremes(observed, names=self.model.names)
+        later = np.arange(START + 40 * DAY, START + 41 * DAY, 600)
+        self.assertTrue(
+            np.allclose(fitted.heights(later), self.model.heights(later), atol=0.01)
+        )
+        with self.assertRaises(ValueError):
+            HarmonicModel.fit_extremes(
+                TideTable(observed.times[:3], observed.heights[:3], observed.high[:1])
+            )
+
+    def test_config(self):
+        config = configparser.ConfigParser()
+        config.read_string(self.model.to_config())
+        loaded = HarmonicModel.from_config(config)
+        self.assertEqual(loaded.names, self.model.names)
+        times = np.arange(START, START + DAY, 3600)
+        self.assertTrue(
+            np.allclose(loaded.heights(times), self.model.heights(times), atol=1e-3)
+        )
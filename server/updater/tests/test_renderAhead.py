@@ -0,0 +1,103 @@
+import datetime
+import json
+import os
+import os.path
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+
+import pytz
+from render_ahead import FrameQueue, choose_tides, plan_frames
+from tide import Tide, TideTable
+
+gmt = pytz.timezone("GMT")
+
+
+def make_tides(start, count):
+    return TideTable.from_tides(
+        Tide(
+            start + datetime.timedelta(minutes=745 * i),
+            "HIGH" if i % 2 == 0 else "LOW",
+            3.5 if i % 2 == 0 else 0.5,
+        )
+        for i in range(count)
+    )
+
+
+class TestRenderAhead(TestCase):
+    def test_choose_tides(self):
+        tides = make_tides(gmt.localize(datetime.datetime(2024, 5, 1, 3)), 4)
+        times = [tide.time for tide in tides]
+        tide1, tide2, changes = choose_tides(tides, times[0], gmt)
+        self.assertEqual(tide1.time, times[1])
+        self.assertEqual(tide2.time, times[2])
+        self.assertEqual(changes, times[1])
+
+        tide1, tide2, changes = choose_tides(tides, times[3], gmt)
+        self.assertEqual(tide1.time, times[2])  # fallback to the first of the day
+        self.assertIsNone(tide2)
+        self.assertIsNone(changes)
+
+    def test_plan_frames(self):
+        tides = make_tides(gmt.localize(datetime.datetime(2024, 5, 1, 3)), 6)
+        start = gmt.localize(datetime.datetime(2024, 5, 1, 1))
+        frames = plan_frames(tides, start, 4, gmt)
+        times = [tide.time for tide in tides]
+        self.assertEqual([f[0] for f in frames], [start] + times[:3])
+        self.assertEqual([f[1].time for f in frames], times[:4])
+
+        # A wake between tides gets a frame of its own, one on a tide doesn't
+        wake = times[0] + datetime.timedelta(hours=1)
+        frames = plan_frames(tides, start, 5, gmt, breaks=[start, wake, times[1]])
+        self.assertEqual([f[0] for f in frames], [start, times[0], wake] + times[1:3])
+        self.assertEqual([f[1].time for f in frames], times[:2] + times[1:4])
+
+    def test_frame_queue(self):
+        tides = make_tides(gmt.localize(datetime.datetime(2024, 5, 1, 3)), 6)
+        start = gmt.localize(datetime.datetime(2024, 5, 1, 1))
+        with tempfile.TemporaryDirectory() as tmp:
+            queue = FrameQueue(os.path.join(tmp, "frames"))
+            self.assertTrue(queue.render(tides, start, 3, tz=gmt, battery=50))
+            index = queue.load_index()
+            self.assertEqual(
+                [f["valid_from"] for f in index["frames"]],
+                [start.isoformat()]
+                + [tide.time.astimezone(gmt).isoformat() for tide in list(tides)[:2]],
+            )
+            first = sorted(os.listdir(queue.frame_dir))
+            self.assertEqual(
+                first,
+                sorted(
+                    ["frames.json"]
+                    + [f["epd"] for f in index["frames"]]
+                    + [f["png"] for f in index["frames"]]
+                ),
+            )
+
+            # Nothing's changed and it still covers the time
+            self.assertFalse(queue.render(tides, start, 3, tz=gmt, battery=50))
+
+            # Old frames are only removed once the new index is in place
+            later = list(tides)[1].time
+            removed = []
+
+            def remove(path):
+                with open(queue.index_path) as index_file:
+                    serving = json.load(index_file)["frames"]
+                self.assertNotIn(os.path.basename(path), [f["epd"] for f in serving])
+                removed.append(os.path.basename(path))
+                os.unlink(path)
+
+            with patch("render_ahead.os.remove", remove):
+                self.assertTrue(queue.render(tides, later, 3, tz=gmt, battery=40))
+            index = queue.load_index()
+            kept = {f["epd"] for f in index["frames"]}
+            self.assertIn(first[0], removed)
+            self.assertTrue(kept)
+            for name in os.listdir(queue.frame_dir):
+                self.assertNotIn(".tmp", name)
+            for name in kept:
+                self.assertTrue(os.path.exists(os.path.join(queue.frame_dir, name)))
+
+            queue.clear()
+            self.assertEqual(queue.load_index(), {"inputs": None, "frames": []})
@@ -0,0 +1,75 @@
+import configparser
+import datetime
+import os.path
+import tempfile
+from unittest import TestCase
+
+import pytz
+from lxml import etree
+from render_service import RenderService, parse_time
+from tide import Tide
+
+gmt = pytz.timezone("GMT")
+
+
+class TestRenderService(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        root = etree.Element("display")
+        tides = etree.SubElement(etree.SubElement(root, "server"), "tides")
+        for hour, kind in ((3, "high"), (9, "low"), (15, "high"), (21, "low")):
+            when = gmt.localize(datetime.datetime(2024, 5, 1, hour, 10))
+            tides.append(Tide(when, kind, 3.0 if kind == "high" else 0.5).to_xml())
+        self.metadata_path = os.path.join(self.tmp.name, "server.xml")
+        etree.ElementTree(root).write(self.metadata_path)
+        self.service = RenderService(
+            configparser.ConfigParser(), self.tmp.name, tz=gmt, max_renders=2
+        )
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_parse_time(self):
+        self.assertEqual(
+            parse_time("2024-05-01 10:30", gmt),
+            gmt.localize(datetime.datetime(2024, 5, 1, 10, 30)),
+        )
+        self.assertEqual(
+            parse_time("10:30", gmt, today=datetime.date(2024, 5, 1)),
+            gmt.localize(datetime.datetime(2024, 5, 1, 10, 30)),
+        )
+        with self.assertRaises(ValueError):
+            parse_time("half ten", gmt)
+
+    def test_render_cached(self):
+        when = parse_time("2024-05-01 10:30", gmt)
+        png = self.service.render(when)
+        self.assertTrue(png.startswith(b"\x89PNG"))
+        self.assertIs(self.service.render(when.replace(second=20)), png)
+        self.assertEqual(self.service.cache.hits, 1)
+
+        epd = self.service.render(when, "epd")
+        self.assertEqual(len(epd), 15016)
+        # Oldest is dropped once the LRU is full
+        self.service.render(parse_time("2024-05-01 11:30", gmt))
+        self.assertEqual(len(self.service.cache.renders), 2)
+        self.assertIsNot(self.service.render(when), png)
+
+        # Nothing is written next to the metadata
+        self.assertEqual(os.listdir(self.tmp.name), ["server.xml"])
+
+    def test_no_tides(self):
+        self.assertIsNone(self.service.render(parse_time("2024-05-02 10:30", gmt)))
+
+    def test_partly_written_metadata(self):
+        when = parse_time("2024-05-01 10:30", gmt)
+        self.assertIsNotNone(self.service.render(when))
+        read = self.service.mtime
+        with open(self.metadata_path, "r+b") as metadata:
+            metadata.truncate(100)
+        os.utime(self.metadata_path, (0, 0))
+        self.service.cache.renders.clear()
+
+        # The last tides are kept, and it's read again on the next request
+        self.assertIsNotNone(self.service.render(when))
+        self.assertEqual(self.service.mtime, read)
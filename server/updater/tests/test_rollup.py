@@ -0,0 +1,98 @@
+import os
+import tempfile
+from unittest import TestCase
+
+from rollup import BATT_MAX, BATT_MIN, BATT_SUM, COUNT, RESETS, RollupStore
+
+DAY = 24 * 60 * 60
+
+
+class TestRollupStore(TestCase):
+    def test_hourly_aggregates(self):
+        store = RollupStore()
+        base = 1700000000 - 1700000000 % 3600
+        store.add("clock", base + 60, 80, 20, "sleep")
+        store.add("clock", base + 120, 70, 22, "sleep")
+        store.add("clock", base + 180, 75, 21, "wdt")
+
+        tier, slots = store.query("clock", base, base + 3600, 3600, now=base + 3600)
+        self.assertEqual(tier, "hourly")
+        self.assertEqual(len(slots), 1)
+        self.assertEqual(slots[0][COUNT], 3)
+        self.assertEqual(slots[0][BATT_MIN], 70)
+        self.assertEqual(slots[0][BATT_MAX], 80)
+        self.assertEqual(RollupStore.mean(slots[0], BATT_SUM), 75)
+        self.assertDictEqual(slots[0][RESETS], {"sleep": 2, "wdt": 1})
+
+    def test_query_picks_covering_tier(self):
+        store = RollupStore()
+        now = 1700000000
+        for day in range(200):
+            store.add("clock", now - day * DAY, 50, 20, "sleep")
+
+        self.assertEqual(store.query("clock", now - DAY, now, now=now)[0], "raw")
+        tier, slots = store.query("clock", now - 150 * DAY, now + 1, now=now)
+        self.assertEqual(tier, "daily")
+        self.assertEqual(len(slots), 151)
+
+    def test_ring_overwrites_old_laps(self):
+        store = RollupStore()
+        now = 1700000000
+        store.add("clock", now - 8 * DAY, 10, 20, "sleep")
+        store.add("clock", now - 8 * DAY + 7 * DAY, 90, 20, "sleep")
+        raw = store.tiers("clock")[0]
+        self.assertEqual(len(raw.slots), 1)
+        self.assertEqual(raw.fetch(now - 9 * DAY, now - 7 * DAY), [])
+
+    def test_summary_from_two_slots(self):
+        store = RollupStore()
+        # On a minute, so the range lines up with the raw slots
+        now = 1700000000 - 1700000000 % 60
+        samples = [(now - i * 600, 50 + i % 30, 15 + i % 7) for i in range(500)]
+        # Mostly in order, as beacons arrive, with a late one to fix up
+        for when, battery, screen in reversed(samples[1:]):
+            store.add("clock", when, battery, screen, "sleep")
+        store.add("clock", samples[0][0], samples[0][1], samples[0][2], "sleep")
+        store.add("clock", now - 3 * DAY - 30, 40, 20, "wdt")
+        samples.append((now - 3 * DAY - 30, 40, 20))
+
+        start, end = now - 2 * DAY, now - DAY // 2
+        inside = [s for s in samples if start <= s[0] < end]
+        summary = store.summary("clock", start, end, now=now)
+        self.assertEqual(summary["count"], len(inside))
+        self.assertAlmostEqual(
+            summary["battery"], sum(s[1] for s in inside) / len(inside)
+        )
+        self.assertAlmostEqual(
+            summary["screen"], sum(s[2] for s in inside) / len(inside)
+        )
+        self.assertEqual(store.summary("clock", now + DAY, now + 2 * DAY), None)
+
+        # Totals are rebuilt on load
+        raw = store.tiers("clock")[0]
+        saved = {k: v[: COUNT + 8] for k, v in raw.slots.items()}
+        raw.slots = saved
+        raw.reindex()
+        self.assertEqual(store.summary("clock", start, end, now=now), summary)
+
+    def test_save_drops_lapped_slots(self):
+        store = RollupStore()
+        now = 1700000000
+        store.add("clock", now - 10 * DAY, 10, 20, "sleep")
+        store.add("clock", now, 90, 20, "sleep")
+        # Older than the raw ring reaches back from the newest
+        store.add("clock", now - 9 * DAY, 30, 20, "sleep")
+        raw = store.tiers("clock")[0]
+        self.assertEqual(len(raw.slots), 2)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "rollup.json")
+            store.save(path)
+            loaded = RollupStore.load(path)
+        raw = loaded.tiers("clock")[0]
+        self.assertEqual(len(raw.slots), 1)
+        self.assertEqual(
+            loaded.summary("clock", now - DAY, now + 1, now=now)["battery"], 90
+        )
+        # All still in the daily tier
+        self.assertEqual(len(loaded.tiers("clock")[2].slots), 3)
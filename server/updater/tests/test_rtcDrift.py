@@ -0,0 +1,84 @@
+import datetime
+from unittest import TestCase
+
+import pytz
+from lxml import etree
+from rtc_drift import estimate_drift, fit, observations
+
+gmt = pytz.timezone("GMT")
+
+
+class TestRtcDrift(TestCase):
+    def setUp(self):
+        self.metadata = etree.ElementTree(etree.Element("display"))
+        self.client = etree.SubElement(self.metadata.getroot(), "client")
+        self.start = gmt.localize(datetime.datetime(2024, 5, 1, 2))
+
+    def beacon(self, device, when, reset="sleep", **attrs):
+        etree.SubElement(
+            self.client,
+            "log",
+            battery="90",
+            reset=reset,
+            screen="18",
+            ip=device,
+            # comms writes local time
+            time=when.astimezone().strftime("%Y-%m-%dT%H:%M:%S"),
+            **attrs,
+        )
+
+    def request(self, when):
+        etree.SubElement(self.client, "requested", time=when.isoformat().split("+")[0])
+
+    def test_fits_slow_clock(self):
+        synced = self.start
+        self.beacon("clock", synced, "power")
+        for hours in (6, 24, 12, 48, 18, 36, 30):
+            wake = synced + datetime.timedelta(hours=hours)
+            self.request(wake)
+            # 100ppm slow, and 20s from the alarm to the beacon
+            late = 20 + (wake - synced).total_seconds() * 100e-6
+            synced = wake + datetime.timedelta(seconds=round(late))
+            self.beacon("clock", synced)
+        # Too few wakes from this one
+        self.beacon("other", self.start, "power")
+        self.beacon("other", self.start + datetime.timedelta(hours=6, seconds=20))
+
+        self.assertEqual(len(observations(self.metadata)["clock"]), 7)
+        drifts = estimate_drift(self.metadata)
+        self.assertEqual(list(drifts), ["clock"])
+        self.assertAlmostEqual(drifts["clock"]["drift"], 100, delta=5)
+        self.assertAlmostEqual(drifts["clock"]["latency"], 20, delta=1)
+        self.assertEqual(drifts["clock"]["samples"], 7)
+
+    def test_adds_back_applied_drift(self):
+        synced = self.start
+        self.beacon("clock", synced, "power")
+        for hours in (6, 24, 12, 48, 18, 36, 30):
+            wake = synced + datetime.timedelta(hours=hours)
+            self.request(wake)
+            # Still 100ppm slow, but the alarm was brought forward by 60ppm
+            late = 20 + (wake - synced).total_seconds() * (100 - 60) * 1e-6
+            synced = wake + datetime.timedelta(seconds=round(late))
+            self.beacon("clock", synced, drift="60")
+
+        drifts = estimate_drift(self.metadata)
+        self.assertAlmostEqual(drifts["clock"]["drift"], 100, delta=5)
+        self.assertAlmostEqual(drifts["clock"]["latency"], 20, delta=1)
+
+    def test_ignores_unrequested(self):
+        self.beacon("clock", self.start, "power")
+        self.request(self.start + datetime.timedelta(hours=6))
+        # Button presses and wakes nowhere near a request don't count
+        self.beacon("clock", self.start + datetime.timedelta(hours=6), "user")
+        self.beacon("clock", self.start + datetime.timedelta(hours=9))
+        self.assertEqual(observations(self.metadata), {})
+
+    def test_needs_spread(self):
+        # Can't tell drift from latency if every sleep is the same length
+        samples = [(6 * 3600, 20 + i % 2) for i in range(10)]
+        self.assertIsNone(fit(samples))
+        samples = [(3600 * (1 + i), 3600 * (1 + i) * 50e-6) for i in range(10)]
+        drift, latency = fit(samples)
+        self.assertAlmostEqual(drift, 50)
+        self.assertAlmostEqual(latency, 0)
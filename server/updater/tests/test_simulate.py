@@ -0,0 +1,41 @@
+import datetime
+from unittest import TestCase
+
+import pytz
+from simulate import schedule, simulate, summarise
+from tide import Tide, TideTable
+from tideclock_generator import SLACK
+
+gmt = pytz.timezone("GMT")
+
+
+class TestSimulate(TestCase):
+    def setUp(self):
+        first = gmt.localize(datetime.datetime(2024, 5, 1, 3, 12))
+        self.tides = TideTable.from_tides(
+            Tide(
+                first + datetime.timedelta(minutes=745 * i),
+                "HIGH" if i % 2 == 0 else "LOW",
+                3.5 if i % 2 == 0 else 0.6,
+            )
+            for i in range(8)
+        )
+        self.start = gmt.localize(datetime.datetime(2024, 5, 1))
+        self.end = self.start + datetime.timedelta(days=2)
+
+    def test_schedule(self):
+        cycles = schedule(self.tides, self.start, self.end, gmt)
+        self.assertEqual(cycles[0][0], self.start)
+        self.assertEqual(cycles[0][1], self.tides.tide(0).time + SLACK)
+        for (when, wake), (next_when, _) in zip(cycles, cycles[1:]):
+            # Each run that does any work is the first one in the slack window
+            self.assertGreaterEqual(next_when, wake - SLACK)
+            self.assertLess(next_when - datetime.timedelta(minutes=10), wake - SLACK)
+
+    def test_parallel_matches(self):
+        serial = simulate(self.tides, self.start, self.end, gmt, jobs=1)
+        parallel = simulate(self.tides, self.start, self.end, gmt, jobs=2)
+        self.assertEqual([r["frame"] for r in serial], [r["frame"] for r in parallel])
+        summary = summarise(serial, 2)
+        self.assertEqual(summary["cycles"], len(serial))
+        self.assertEqual(summary["blank"], 0)
@@ -0,0 +1,83 @@
+import datetime
+from unittest import TestCase
+
+import numpy as np
+import pytz
+from display_renderer import DisplayRenderer
+from harmonic import HarmonicModel
+from panel import PANEL_4_2, PanelProfile
+from tide import Tide, TideTable
+from tide_curve import CosineCurve, HarmonicCurve
+
+gmt = pytz.timezone("GMT")
+
+
+class TestTideCurve(TestCase):
+    def setUp(self):
+        first = gmt.localize(datetime.datetime(2024, 5, 1, 3, 12))
+        self.table = TideTable.from_tides(
+            Tide(
+                first + datetime.timedelta(minutes=745 * i),
+                "HIGH" if i % 2 == 0 else "LOW",
+                3.5 if i % 2 == 0 else 0.5,
+            )
+            for i in range(6)
+        )
+
+    def test_cosine(self):
+        curve = CosineCurve(self.table)
+        times = self.table.times
+        heights = curve.heights(
+            [times[0] - 1, times[0], (times[0] + times[1]) / 2, times[1], times[-1]]
+        )
+        self.assertTrue(np.isnan(heights[0]))
+        self.assertTrue(np.allclose(heights[1:], [3.5, 2.0, 0.5, 0.5]))
+
+        # Always between the two tides either side
+        samples = curve.heights(np.arange(times[0], times[-1], 60))
+        self.assertTrue(np.all((samples >= 0.5) & (samples <= 3.5)))
+        self.assertTrue(np.all(np.isnan(CosineCurve(TideTable()).heights([0, 1]))))
+
+    def test_cosine_duplicate_times(self):
+        times = self.table.times
+        # Both feeds gave the same tides
+        table = TideTable.from_tides(list(self.table) * 2)
+        with np.errstate(all="raise"):
+            heights = CosineCurve(table).heights(
+                np.append(np.arange(times[0], times[-1], 600), times[-1])
+            )
+        self.assertTrue(np.all((heights >= 0.5) & (heights <= 3.5)))
+        self.assertAlmostEqual(heights[-1], 0.5)
+
+    def test_harmonic(self):
+        model = HarmonicModel(2.0, {"M2": (1.5, 30.0)})
+        times = np.arange(0, 86400, 900)
+        self.assertTrue(
+            np.array_equal(HarmonicCurve(model).heights(times), model.heights(times))
+        )
+
+    def test_render(self):
+        curve = CosineCurve(self.table)
+        when = gmt.localize(datetime.datetime(2024, 5, 1, 12))
+        tide1 = self.table.next_tide(when)
+        box = ((10, 10), (190, 90))
+        layout = dict(PANEL_4_2.layout, curve=box)
+        panel = PanelProfile("test-curve", (400, 300), 0x33, layout)
+
+        d = DisplayRenderer(tide1, tz=gmt, when=when, curve=curve, panel=panel)
+        expected = curve.heights([when.timestamp()])[0]
+        self.assertAlmostEqual(d.height_now, expected)
+        d.render()
+        inside = np.asarray(d.surface)[box[0][1] + 2 : box[1][1] - 1, 12:189]
+        self.assertTrue((inside == 0).any())
+
+    def test_render_default_panel(self):
+        curve = CosineCurve(self.table)
+        when = gmt.localize(datetime.datetime(2024, 5, 1, 12))
+        tide1 = self.table.next_tide(when)
+        (left, top), (right, bottom) = PANEL_4_2.layout["curve"]
+
+        d = DisplayRenderer(tide1, tz=gmt, when=when, curve=curve)
+        d.render()
+        inside = np.asarray(d.surface)[top + 2 : bottom - 1, left + 2 : right - 1]
+        self.assertTrue((inside == 0).any())
@@ -0,0 +1,114 @@
+import datetime
+from unittest import TestCase
+
+import pytz
+from lxml import etree
+from tide import Tide, TideTable, find_tides_node
+
+gmt = pytz.timezone("GMT")
+
+
+class TestTideTable(TestCase):
+    def setUp(self):
+        first = gmt.localize(datetime.datetime(2024, 5, 1, 3, 12))
+        self.tides = [
+            Tide(
+                first + datetime.timedelta(minutes=745 * i),
+                "HIGH" if i % 2 == 0 else "LOW",
+                3.5 if i % 2 == 0 else 0.5,
+            )
+            for i in range(11)
+        ]
+        # Out of order on purpose
+        self.table = TideTable.from_tides(reversed(self.tides))
+
+    def test_lookups(self):
+        self.assertEqual(len(self.table), 11)
+        tide = self.table.next_tide(self.tides[2].time)
+        self.assertEqual(tide.time, self.tides[3].time)
+        self.assertEqual(tide.type, "LOW")
+        self.assertEqual(tide.height, 0.5)
+        self.assertTrue(self.table.is_high(10))
+
+        self.assertEqual(
+            [t.time for t in self.table.next_tides(self.tides[8].time, 3)],
+            [self.tides[9].time, self.tides[10].time],
+        )
+        self.assertIsNone(self.table.next_tide(self.tides[10].time))
+        self.assertEqual(self.table.count_after(self.tides[0].time), 10)
+
+        day = self.table.tides_in_day(datetime.date(2024, 5, 2), gmt)
+        self.assertEqual([t.time for t in day], [t.time for t in self.tides[2:4]])
+
+    def test_serialise(self):
+        data = self.table.to_bytes()
+        self.assertEqual(len(data), 9 + 11 * 12 + 2)
+        copy = TideTable.from_bytes(data)
+        self.assertEqual(copy.to_bytes(), data)
+
+        node = etree.Element("tides")
+        self.table.save_xml(node)
+        loaded = TideTable.load_xml(etree.fromstring(etree.tostring(node)))
+        self.assertEqual(loaded.to_bytes(), data)
+
+    def test_load_old_layout(self):
+        node = etree.Element("tides")
+        for tide in self.tides:
+            node.append(tide.to_xml())
+        loaded = TideTable.load_xml(node)
+        self.assertEqual(loaded.to_bytes(), self.table.to_bytes())
+        self.assertEqual(len(TideTable.load_xml(None)), 0)
+        self.assertEqual(len(TideTable.from_tides([])), 0)
+
+    def test_merge(self):
+        old = TideTable.from_tides(self.tides[:6])
+        # Re-predicted a few minutes later, and two more tides
+        new = TideTable.from_tides(
+            Tide(
+                tide.time + datetime.timedelta(minutes=4), tide.type, tide.height + 0.1
+            )
+            for tide in self.tides[4:8]
+        )
+        merged = old.merge(new)
+        self.assertEqual(len(merged), 8)
+        self.assertEqual(list(merged.times[:4]), list(old.times[:4]))
+        self.assertEqual(list(merged.times[4:]), list(new.times))
+        self.assertEqual([t.type for t in merged], [t.type for t in self.tides[:8]])
+
+        # Too far apart to be the same tide, so both are kept
+        self.assertEqual(len(old.merge(new, tolerance=60)), 10)
+
+    def test_prune(self):
+        self.table.cover(0, int(self.tides[5].time.timestamp()))
+        cut = int(self.tides[3].time.timestamp())
+        pruned = self.table.prune(cut)
+        self.assertEqual(len(pruned), 8)
+        self.assertEqual(pruned.tide(0).time, self.tides[3].time)
+        self.assertEqual(pruned.coverage, [(cut, int(self.tides[5].time.timestamp()))])
+
+    def test_coverage(self):
+        self.assertEqual(self.table.uncovered(0, 100), [(0, 100)])
+        self.table.cover(10, 20)
+        self.table.cover(40, 50)
+        self.table.cover(15, 30)
+        self.assertEqual(self.table.coverage, [(10, 30), (40, 50)])
+        self.assertEqual(self.table.uncovered(0, 100), [(0, 10), (30, 40), (50, 100)])
+        self.assertEqual(self.table.uncovered(12, 28), [])
+
+        node = etree.Element("tides", station="1234")
+        self.table.save_xml(node)
+        self.assertEqual(node.get("station"), "1234")
+        loaded = TideTable.load_xml(etree.fromstring(etree.tostring(node)))
+        self.assertEqual(loaded.coverage, self.table.coverage)
+
+    def test_find_node(self):
+        root = etree.fromstring(
+            "<metadata><server><tides/><tides station='harmonic'/></server></metadata>"
+        )
+        nodes = root.findall(".//tides")
+        self.assertIs(find_tides_node(root, "harmonic"), nodes[1])
+        # The one from before stations were kept is taken as anyone's
+        self.assertIs(find_tides_node(root, "1234"), nodes[0])
+        self.assertIs(find_tides_node(root), nodes[0])
+        nodes[0].attrib["station"] = "1234"
+        self.assertIsNone(find_tides_node(root, "5678"))
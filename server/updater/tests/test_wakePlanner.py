@@ -0,0 +1,107 @@
+import datetime
+from unittest import TestCase
+
+import pytz
+from rollup import RollupStore
+from tide import Tide, TideTable
+from wake_planner import WakePlanner, battery_days, publish, report, wakes_per_day
+
+gmt = pytz.timezone("GMT")
+
+DAY = 24 * 60 * 60
+
+
+class TestWakePlanner(TestCase):
+    def setUp(self):
+        first = gmt.localize(datetime.datetime(2024, 5, 1, 3, 12))
+        self.tides = TideTable.from_tides(
+            Tide(
+                first + datetime.timedelta(minutes=745 * i),
+                "HIGH" if i % 2 == 0 else "LOW",
+                3.5 if i % 2 == 0 else 0.6,
+            )
+            for i in range(8)
+        )
+        self.start = gmt.localize(datetime.datetime(2024, 5, 1))
+        self.lead = datetime.timedelta(minutes=15)
+
+    def test_tides_only(self):
+        planner = WakePlanner({"date": datetime.timedelta(0)}, self.lead)
+        wake = planner.next_wake(self.tides, self.start, gmt)
+        # The same as a wake per tide
+        self.assertEqual(wake, self.tides.tide(0).time + self.lead)
+
+    def test_merges_date(self):
+        planner = WakePlanner(lead=self.lead)
+        end = self.start + datetime.timedelta(days=7)
+        wakes = planner.plan(self.tides, self.start, end, gmt)
+        # Each morning's tide is within six hours of midnight, so shows the date
+        self.assertEqual([kinds for _, kinds in wakes[2:8:2]], [{"date", "tide"}] * 3)
+        # Once the tides run out the date gets wakes of its own, as late as allowed
+        self.assertEqual(
+            wakes[-1], (gmt.localize(datetime.datetime(2024, 5, 7, 6)), {"date"})
+        )
+        self.assertEqual(len(wakes), len(self.tides) + 3)
+        self.assertAlmostEqual(wakes_per_day(wakes, self.start, end), 11 / 7)
+
+    def test_every_window_is_hit(self):
+        forecast = [self.start + datetime.timedelta(hours=3 * i + 1) for i in range(16)]
+        planner = WakePlanner({"forecast": datetime.timedelta(hours=4)}, self.lead)
+        end = self.start + datetime.timedelta(days=2)
+        windows = planner.windows(self.tides, self.start, end, gmt, forecast)
+        wakes = [
+            when.timestamp()
+            for when, _ in planner.plan(self.tides, self.start, end, gmt, forecast)
+        ]
+        for earliest, latest, kind in windows:
+            self.assertTrue(any(earliest <= when <= latest for when in wakes), kind)
+        # Fewer wakes than changes, as the forecast's are shared
+        self.assertLess(len(wakes), len(windows))
+
+    def test_publish(self):
+        planner = WakePlanner(lead=self.lead)
+        end = self.start + datetime.timedelta(days=7)
+        wakes = planner.plan(self.tides, self.start, end, gmt)
+        # Nothing known about the tides, so only the next wake is sure
+        self.assertEqual(
+            publish(wakes, 4, self.tides, self.start),
+            {"schedule": [[2024, 5, 1, 3, 27, 0]], "until": [2024, 5, 1, 3, 27, 0]},
+        )
+
+        self.tides.cover(self.start.timestamp(), self.tides.times[-1])
+        published = publish(wakes, 4, self.tides, self.start)
+        self.assertEqual(
+            published["schedule"],
+            [list(when.utctimetuple()[:6]) for when, _ in wakes[:4]],
+        )
+        self.assertEqual(published["until"], published["schedule"][-1])
+
+        # Doesn't go past the tides, so not even to the wake for the last one
+        published = publish(wakes, 20, self.tides, self.start)
+        self.assertEqual(len(published["schedule"]), len(self.tides) - 1)
+        self.assertEqual(published["until"], [2024, 5, 4, 18, 7, 0])
+
+    def test_battery_days(self):
+        store = RollupStore()
+        now = self.start.timestamp() + DAY - 1
+        for day in range(5):
+            # Four wakes a day, using 1% between them
+            for wake in range(4):
+                store.add(
+                    "clock",
+                    self.start.timestamp() - (4 - day) * DAY + wake * 6 * 3600,
+                    80 - day * 4 - wake,
+                    20,
+                    "sleep",
+                )
+        estimate = battery_days(store, "clock", 2, now=now)
+        self.assertAlmostEqual(estimate["wake_cost"], 1)
+        self.assertAlmostEqual(estimate["battery"], 62.5)
+        self.assertAlmostEqual(estimate["battery_days"], 31.25)
+        self.assertIsNone(battery_days(store, "other", 2, now=now))
+
+        summary = report(
+            WakePlanner(lead=self.lead), self.tides, self.start, gmt, store=store
+        )
+        self.assertIn("clock", summary["devices"])
+        self.assertEqual(len(summary["wakes"]), len(self.tides) + 3)
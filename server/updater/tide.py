@@ -1,5 +1,40 @@
+import base64
+import datetime
+import struct
+
+import numpy as np
+import pytz
 from lxml import etree
 
+gmt = pytz.timezone("GMT")
+
+
+def station(config):
+    """
+    :param config: ConfigParser, as for tideclock_generator
+    :return: Name the configured source's tides are stored under
+    """
+    if config.get("Tides", "Source", fallback="easytide") == "harmonic":
+        return "harmonic"
+    return config.get("Tides", "Feed", fallback="")
+
+
+def find_tides_node(root, name=None):
+    """
+    :param root: server.xml tree
+    :param name: Station, as from station(), or None for whichever is first
+    :return: <tides> element, or None
+    """
+    nodes = root.findall(".//tides")
+    for node in nodes:
+        if name is None or node.get("station") == name:
+            return node
+    # One without a station is from before they were kept by station
+    for node in nodes:
+        if "station" not in node.attrib:
+            return node
+    return None
+
 
 class Tide(object):
     def __init__(self, tide_time, tide_type, height):
@@ -16,5 +51,283 @@ class Tide(object):
 
         return top
 
+    @staticmethod
+    def from_xml(node):
+        """
+        :param node: <tide> element as written by to_xml()
+        :return: Tide
+        """
+        return Tide(
+            gmt.localize(
+                datetime.datetime.strptime(node.attrib["time"], "%Y-%m-%dT%H:%M:%S")
+            ),
+            node.attrib["type"],
+            float(node.attrib["height"]),
+        )
+
     def __str__(self):
         return "%s tide (%.2fm) at %s" % (self.type, self.height, self.time)
+
+
+class TideTable(object):
+    """
+    Tides in time order as parallel arrays: epoch seconds, heights and a
+    bitmap of which are high water.  Lookups are binary searches, and Tide
+    objects are only made for the handful that get shown.
+    """
+
+    # Fetches a few hours apart can move a prediction by a minute or two
+    MERGE_TOLERANCE = 3600
+
+    MAGIC = b"TIDE"
+    VERSION = 1
+    # Magic, version, number of tides, then the arrays little-endian
+    HEADER = "<4sBI"
+
+    def __init__(self, times=None, heights=None, high=None, coverage=None):
+        """
+        :param times: Epoch seconds, sorted
+        :param heights: Metres, one per time
+        :param high: Packed bitmap, bit set for a high tide, as np.packbits()
+        :param coverage: Sorted, disjoint [start, end) epoch second spans that
+        the tides are known to be complete for
+        """
+        self.times = np.asarray(times if times is not None else [], dtype=np.int64)
+        self.heights = np.asarray(
+            heights if heights is not None else [], dtype=np.float32
+        )
+        self.high = np.asarray(high if high is not None else [], dtype=np.uint8)
+        self.coverage = [tuple(span) for span in coverage] if coverage else []
+
+    @staticmethod
+    def from_tides(tides):
+        """
+        :param tides: Iterable of Tide, any order
+        :return: TideTable
+        """
+        tides = sorted(tides, key=lambda tide: tide.time)
+        return TideTable(
+            [int(tide.time.timestamp()) for tide in tides],
+            [tide.height for tide in tides],
+            np.packbits(
+                np.array([tide.type.upper() == "HIGH" for tide in tides], bool)
+            ),
+        )
+
+    def __len__(self):
+        return len(self.times)
+
+    def __iter__(self):
+        return (self.tide(i) for i in range(len(self)))
+
+    def highs(self):
+        """
+        :return: Boolean array, True for each high tide
+        """
+        return np.unpackbits(self.high, count=len(self)).astype(bool)
+
+    def is_high(self, i):
+        return bool(self.high[i >> 3] & (0x80 >> (i & 7)))
+
+    def tide(self, i):
+        """
+        :param i: Index into the table
+        :return: Tide, time in GMT
+        """
+        return Tide(
+            datetime.datetime.fromtimestamp(int(self.times[i]), gmt),
+            "HIGH" if self.is_high(i) else "LOW",
+            float(self.heights[i]),
+        )
+
+    def after(self, when):
+        """
+        :param when: Timezone-aware time
+        :return: Index of the first tide strictly after it, len() if none
+        """
+        return int(np.searchsorted(self.times, when.timestamp(), side="right"))
+
+    def count_after(self, when):
+        return len(self) - self.after(when)
+
+    def next_tide(self, when):
+        """
+        :param when: Timezone-aware time
+        :return: First Tide after it, or None
+        """
+        i = self.after(when)
+        return self.tide(i) if i < len(self) else None
+
+    def next_tides(self, when, k):
+        """
+        :param when: Timezone-aware time
+        :param k: Maximum number wanted
+        :return: List of up to k Tides after it
+        """
+        i = self.after(when)
+        return [self.tide(j) for j in range(i, min(i + k, len(self)))]
+
+    def tides_in_day(self, day, tz):
+        """
+        :param day: date
+        :param tz: Timezone the day is in
+        :return: List of Tides from midnight to midnight
+        """
+        start = datetime.datetime.combine(day, datetime.time(0))
+        end = start + datetime.timedelta(days=1)
+        if hasattr(tz, "localize"):
+            start, end = tz.localize(start), tz.localize(end)
+        else:
+            start, end = start.replace(tzinfo=tz), end.replace(tzinfo=tz)
+        first = int(np.searchsorted(self.times, start.timestamp(), side="left"))
+        last = int(np.searchsorted(self.times, end.timestamp(), side="left"))
+        return [self.tide(j) for j in range(first, last)]
+
+    def merge(self, other, tolerance=MERGE_TOLERANCE):
+        """
+        Upsert another table's tides into this one.  A new tide replaces any
+        stored one of the same type within the tolerance, as it's the same
+        tide re-predicted.
+        :param other: TideTable of newer tides
+        :param tolerance: Seconds
+        :return: New TideTable, with both coverages
+        """
+        own_highs, new_highs = self.highs(), other.highs()
+        replaced = np.zeros(len(self), dtype=bool)
+        if len(other):
+            # Nearest new tide of each type either side of every stored one
+            for kind in (True, False):
+                new_times = other.times[new_highs == kind]
+                mine = own_highs == kind
+                if not len(new_times) or not mine.any():
+                    continue
+                pos = np.searchsorted(new_times, self.times[mine])
+                after = new_times[np.minimum(pos, len(new_times) - 1)]
+                before = new_times[np.maximum(pos - 1, 0)]
+                nearest = np.minimum(
+                    np.abs(after - self.times[mine]), np.abs(self.times[mine] - before)
+                )
+                replaced[mine] = nearest <= tolerance
+
+        keep = ~replaced
+        times = np.concatenate((self.times[keep], other.times))
+        order = np.argsort(times, kind="stable")
+        merged = TideTable(
+            times[order],
+            np.concatenate((self.heights[keep], other.heights))[order],
+            np.packbits(np.concatenate((own_highs[keep], new_highs))[order]),
+            self.coverage,
+        )
+        for span in other.coverage:
+            merged.cover(*span)
+        return merged
+
+    def prune(self, before):
+        """
+        :param before: Epoch seconds, tides and coverage older are dropped
+        :return: New TideTable
+        """
+        keep = self.times >= before
+        return TideTable(
+            self.times[keep],
+            self.heights[keep],
+            np.packbits(self.highs()[keep]),
+            [(max(start, before), end) for start, end in self.coverage if end > before],
+        )
+
+    def cover(self, start, end):
+        """
+        Record that the tides from start to end are complete
+        :param start: Epoch seconds
+        :param end: Epoch seconds
+        """
+        spans = sorted(self.coverage + [(int(start), int(end))])
+        self.coverage = [spans[0]]
+        for span_start, span_end in spans[1:]:
+            last_start, last_end = self.coverage[-1]
+            if span_start <= last_end:
+                self.coverage[-1] = (last_start, max(last_end, span_end))
+            else:
+                self.coverage.append((span_start, span_end))
+
+    def uncovered(self, start, end):
+        """
+        :param start: Epoch seconds
+        :param end: Epoch seconds
+        :return: List of (start, end) spans within it the table doesn't cover
+        """
+        gaps = []
+        for span_start, span_end in self.coverage:
+            if span_end <= start:
+                continue
+            if span_start >= end:
+                break
+            if span_start > start:
+                gaps.append((start, span_start))
+            start = max(start, span_end)
+        if start < end:
+            gaps.append((start, end))
+        return gaps
+
+    def to_bytes(self):
+        """
+        :return: Compact binary form, about 12 bytes a tide
+        """
+        return (
+            struct.pack(TideTable.HEADER, TideTable.MAGIC, TideTable.VERSION, len(self))
+            + self.times.astype("<i8").tobytes()
+            + self.heights.astype("<f4").tobytes()
+            + self.high.tobytes()
+        )
+
+    @staticmethod
+    def from_bytes(data):
+        """
+        :param data: From to_bytes()
+        :return: TideTable
+        """
+        magic, version, count = struct.unpack_from(TideTable.HEADER, data)
+        if magic != TideTable.MAGIC or version != TideTable.VERSION:
+            raise ValueError("Not a version %d tide table" % TideTable.VERSION)
+        offset = struct.calcsize(TideTable.HEADER)
+        times = np.frombuffer(data, "<i8", count, offset)
+        offset += times.nbytes
+        heights = np.frombuffer(data, "<f4", count, offset)
+        offset += heights.nbytes
+        high = np.frombuffer(data, np.uint8, (count + 7) // 8, offset)
+        return TideTable(times, heights, high)
+
+    def save_xml(self, node):
+        """
+        Replace the contents of a <tides> element with this table
+        :param node: <tides> element, its station is kept
+        """
+        station = node.get("station")
+        node.clear()
+        if station is not None:
+            node.attrib["station"] = station
+        node.attrib["format"] = "table"
+        node.attrib["covered"] = " ".join("%d-%d" % span for span in self.coverage)
+        node.text = base64.b64encode(self.to_bytes()).decode("ascii")
+
+    @staticmethod
+    def load_xml(node):
+        """
+        :param node: <tides> element, either from save_xml() or of <tide> elements
+        :return: TideTable
+        """
+        if node is None:
+            return TideTable()
+        if node.attrib.get("format") == "table":
+            table = TideTable.from_bytes(base64.b64decode(node.text or ""))
+        else:
+            table = TideTable.from_tides(
+                Tide.from_xml(tide) for tide in node.iter("tide")
+            )
+        if "covered" in node.attrib:
+            for span in node.attrib["covered"].split():
+                table.cover(*(int(part) for part in span.split("-")))
+        elif len(table):
+            # Saved before coverage was kept, these were whole fetches
+            table.cover(int(table.times[0]), int(table.times[-1]))
+        return table
@@ -0,0 +1,80 @@
+"""
+Tide height at any instant, not just at high and low water
+"""
+
+import numpy as np
+from harmonic import HarmonicModel
+
+
+class CosineCurve(object):
+    """
+    Heights between stored highs and lows, following half a cosine from each
+    to the next.  That's the usual rule of twelfths shape without its steps.
+    """
+
+    def __init__(self, table):
+        """
+        :param table: TideTable of highs and lows
+        """
+        self.table = table
+
+    def heights(self, times):
+        """
+        :param times: Array of epoch seconds
+        :return: Array of heights in metres, NaN outside the table
+        """
+        times = np.asarray(times, dtype=np.float64)
+        # Two tides at the same second would divide by zero, the first one stands
+        stored, first = np.unique(self.table.times, return_index=True)
+        stored_heights = self.table.heights[first].astype(np.float64)
+        if len(stored) < 2:
+            return np.full(times.shape, np.nan)
+
+        following = np.searchsorted(stored, times, side="right")
+        # An exact hit on the last tide still counts as inside
+        inside = ((following > 0) & (following < len(stored))) | (times == stored[-1])
+        after = np.clip(following, 1, len(stored) - 1)
+        before = after - 1
+
+        t0, t1 = stored[before], stored[after]
+        h0, h1 = stored_heights[before], stored_heights[after]
+        frac = (times - t0) / (t1 - t0)
+        heights = h0 + (h1 - h0) * (1 - np.cos(np.pi * frac)) / 2
+        return np.where(inside, heights, np.nan)
+
+    def __repr__(self):
+        # The table is fingerprinted on its own, see render_ahead.fingerprint()
+        return "CosineCurve()"
+
+
+class HarmonicCurve(object):
+    """
+    Heights straight from the harmonic model the tides were predicted with
+    """
+
+    def __init__(self, model):
+        """
+        :param model: harmonic.HarmonicModel
+        """
+        self.model = model
+
+    def heights(self, times):
+        """
+        :param times: Array of epoch seconds
+        :return: Array of heights in metres
+        """
+        return self.model.heights(times)
+
+    def __repr__(self):
+        return "HarmonicCurve(%s)" % self.model.to_config().replace("\n", "; ")
+
+
+def curve_from_config(config, table):
+    """
+    :param config: ConfigParser, as for tideclock_generator
+    :param table: TideTable of the stored highs and lows
+    :return: HarmonicCurve if tides are predicted from harmonics, else CosineCurve
+    """
+    if config.get("Tides", "Source", fallback="easytide") == "harmonic":
+        return HarmonicCurve(HarmonicModel.from_config(config))
+    return CosineCurve(table)
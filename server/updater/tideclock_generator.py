@@ -7,108 +7,119 @@ import json
 import logging
 import os.path
 import sys
-from typing import Optional, TextIO
+from typing import TextIO
 
 import pygal
 import pytz
+from chart_series import ChartSeries
 from display_renderer import DisplayRenderer
 from epd_generator import EPDGenerator
+from harmonic import HarmonicModel
 from lxml import etree
+from panel import DEFAULT_PANEL, PANELS
 from pygal.style import LightColorizedStyle
-from tide import Tide
+from render_ahead import FrameQueue, choose_tides
+from rollup import BATT_SUM, START, RollupStore
+from rtc_drift import estimate_drift
+from tide import TideTable, find_tides_node, station
+from tide_curve import curve_from_config
 from tide_parser import TideParser
 
 # MUST BE TZLOCAL 4.x!
 from tzlocal import get_localzone
+from wake_planner import HORIZON, WakePlanner, publish, report
 from weather import Weather
 
-
-def generate_status_page(
-    metadata_supplied: etree.ElementTree,
-    wake_up_time: datetime.datetime,
-    status_path: str,
-    output_png_time: Optional[datetime.datetime],
-) -> None:
+STATUS_SHELL = """<!doctype html>
+<html lang="en" xmlns="http://www.w3.org/1999/xhtml">
+<head>
+    <title>Current status</title>
+</head>
+<body>
+<p>Next wakeup due at <span id="wakeup">?</span></p>
+<p>Last image update at <span id="image_time">?</span></p>
+<p>Last events:</p>
+<ol id="events"></ol>
+<br /><figure><embed type="image/svg+xml" src="chart.svg"/></figure>
+<figure><embed type="image/svg+xml" src="trend.svg"/></figure>
+<img src="data.png" height="300" width="400"/>
+<form id="preview_form">
+    <p>Preview at <input type="time" id="preview_time" required/> <input type="submit" value="Show"/></p>
+</form>
+<img id="preview" alt=""/>
+<script type="text/javascript">
+    var cursor = 0;
+    var events = [];
+
+    function refresh() {
+        fetch("status.json?since=" + cursor)
+            .then(function (rsp) { return rsp.json(); })
+            .then(function (status) {
+                cursor = status.cursor;
+                document.getElementById("wakeup").textContent = status.wakeup;
+                document.getElementById("image_time").textContent = status.image_time;
+                events = status.events.reverse().concat(events).slice(0, 5);
+                var list = document.getElementById("events");
+                list.innerHTML = "";
+                events.forEach(function (ev) {
+                    var item = document.createElement("li");
+                    item.textContent = ev.time + ": " + ev.reset + " - " + ev.battery + "%";
+                    list.appendChild(item);
+                });
+            });
+    }
+
+    document.getElementById("preview_form").addEventListener("submit", function (ev) {
+        ev.preventDefault();
+        var when = document.getElementById("preview_time").value;
+        document.getElementById("preview").src = "preview.png?time=" + encodeURIComponent(when);
+    });
+
+    refresh();
+    setInterval(refresh, 60000);
+</script>
+</body>
+</html>
+"""
+
+
+def generate_status_page(status_path: str) -> None:
     """
-    Creates an HTML status page of what's currently going on:
+    Writes the HTML status page if it isn't already there.  It is a static
+    shell now: the values come from comms' status.json and the graph from
+    chart.svg, so there's nothing to regenerate each run.
 
     * When the next wakeup is due by the display
-    * When we last updated the PNG (checking the file timestamp
+    * When we last updated the PNG
     * The last five beacons in plain text
     * A graph of responses
     * The current PNG
+    * A preview at any time today, rendered on demand through comms
     """
+    try:
+        with open(status_path) as status_file:
+            if status_file.read() == STATUS_SHELL:
+                return
+    except OSError:
+        pass
+
     try:
         status_file: TextIO
 
         with open(status_path, "w") as status_file:
             logging.debug("Generating status page at %s", status_path)
-            status_file.write(
-                """<!doctype html>
-<html lang="en" xmlns="http://www.w3.org/1999/xhtml">
-<head>
-    <title>Current status</title>
-    <script type="text/javascript" src="http://kozea.github.com/pygal.js/latest/pygal-tooltips.min.js">
-    </script>
-</head>
-<body>\n"""
-            )
-            status_file.write(
-                "<p>Next wakeup due at %s</p>\n" % wake_up_time.isoformat()
-            )
-
-            if output_png_time:
-                status_file.write(
-                    "<p>Last image update at %s</p>\n" % output_png_time.isoformat()
-                )
-
-            status_file.write("<p>Last events:</p>\n<ol>\n")
-
-            events = metadata_supplied.findall("./client/log")
-
-            for ev in events[:-6:-1]:  # iterate back over the last five
-                status_file.write(
-                    """<li>{time}: {reason} - {battery}%</li>\n""".format(
-                        time=ev.attrib["time"],
-                        reason=ev.attrib["reset"],
-                        battery=ev.attrib["battery"],
-                    )
-                )
-
-            # draw a graph
-            chart = generate_chart(28, events)
-
-            status_file.write(
-                "</ol>\n<br /><figure>\n%s</figure>\n"
-                % chart.render(disable_xml_declaration=True)
-            )
-
-            status_file.write(
-                """<img src="data.png" height="300" width="400"/></body>\n</html>
-            """
-            )
-
-    except (IOError, KeyError):
+            status_file.write(STATUS_SHELL)
+    except IOError:
         logging.exception("Failed to generate status page at %s", status_path)
 
 
-def generate_chart(days: int, events: etree.ElementTree) -> pygal.DateTimeLine:
+def generate_chart(series: ChartSeries) -> pygal.DateTimeLine:
     """
-    Generate a nice SVG chart in Pygal for the last N days of events
-    :param days:
-    :param events: The client/log events in the XML
+    Generate a nice SVG chart in Pygal for the days held in the series
+    :param series: Client telemetry, already trimmed to the window
     :return: pygal object for rendering
     """
-    cutoff = datetime.datetime.now() - datetime.timedelta(days=days)
-    events = [ev for ev in events if "screen" in ev.attrib.keys()]
-    dates = [
-        datetime.datetime.strptime(pt.attrib["time"].split("+")[0], "%Y-%m-%dT%H:%M:%S")
-        for pt in events
-    ]
-    charge = [int(pt.attrib["battery"]) for pt in events]
-    screen_temp = [int(pt.attrib["screen"]) for pt in events]
-    charge_pts = [y for y in zip(dates, charge) if y[0] >= cutoff]
-    screen_pts = [y for y in zip(dates, screen_temp) if y[0] >= cutoff]
+    days = series.days
 
     # Configure the chart style to look nice
     conf = pygal.Config()
@@ -125,8 +136,48 @@ def generate_chart(days: int, events: etree.ElementTree) -> pygal.DateTimeLine:
     # Generate the chart
     chart = pygal.DateTimeLine(conf)
     chart.title = "Client logging"
-    chart.add("Battery", charge_pts)
-    chart.add("Screen temp", screen_pts)
+    chart.add("Battery", series.points("battery"))
+    chart.add("Screen temp", series.points("screen"))
+    chart.range = [0, 100]
+    return chart
+
+
+def generate_trend_chart(days: int, store: RollupStore) -> pygal.DateTimeLine:
+    """
+    Generate a chart of daily mean battery charge for each device from the
+    rollups, so months of history cost a point per day
+    :param days: How far back to go
+    :param store: Telemetry rollups
+    :return: pygal object for rendering
+    """
+    end = datetime.datetime.now()
+    start = end - datetime.timedelta(days=days)
+
+    conf = pygal.Config()
+    conf.style = LightColorizedStyle
+    conf.legend_at_bottom = True
+    conf.tooltip_border_radius = 5
+    conf.truncate_label = 11
+
+    chart = pygal.DateTimeLine(conf)
+    chart.title = "Battery trend"
+    for device in sorted(store.devices):
+        _, slots = store.query(
+            device,
+            start.timestamp(),
+            end.timestamp(),
+            min_step=24 * 60 * 60,
+        )
+        chart.add(
+            device,
+            [
+                (
+                    datetime.datetime.fromtimestamp(slot[START]),
+                    RollupStore.mean(slot, BATT_SUM),
+                )
+                for slot in slots
+            ],
+        )
     chart.range = [0, 100]
     return chart
 
@@ -136,6 +187,49 @@ def print_time(dt: datetime.datetime) -> str:
     return dt.strftime("%Y-%m-%dT%H:%M:%S")
 
 
+def next_wakeup(
+    current_local: datetime.datetime,
+    tide_change: datetime.datetime = None,
+    slack: datetime.timedelta = None,
+) -> datetime.datetime:
+    """
+    When the client should next come in for a new image
+    :param current_local: Time of this run
+    :param tide_change: When the tide on the clock passes, from choose_tides()
+    :param slack: From slack_from_config(), defaults to SLACK
+    :return: Wakeup time, with slack so the new image is ready
+    """
+    if tide_change:
+        # Wakeup when we need to change the clock
+        wake_up_time_gmt = tide_change  # GMT! not astimezone(london)
+    else:
+        # Wakeup into tomorrow, although the RSS feed is a bit slower
+        wake_up_time_gmt = gmt.localize(
+            datetime.datetime.combine(
+                current_local.date() + datetime.timedelta(days=1),
+                datetime.time(hour=1, minute=15),
+            )
+        )
+
+    # Remove microseconds
+    return (wake_up_time_gmt + (slack or SLACK)).replace(microsecond=0)
+
+
+def slack_from_config(config) -> datetime.timedelta:
+    """
+    [Schedule]
+    Slack = 15
+
+    Runs are 10 minutes apart, so it needs to be more than that, plus any RTC
+    drift that devices haven't corrected for yet
+    :param config: ConfigParser, slack in minutes
+    :return: How long after a change to wake, and how early to render for it
+    """
+    return datetime.timedelta(
+        minutes=config.getint("Schedule", "Slack", fallback=SLACK.seconds // 60)
+    )
+
+
 class DateTimeEncoder(json.JSONEncoder):
     """JSON encoder that overloads the datetime format to output as a string"""
 
@@ -153,8 +247,15 @@ SLACK = datetime.timedelta(minutes=15)
 CLIENT_METADATA = "metadata.json"
 SERVER_METADATA = "server.xml"
 SERVER_STATUS = "status.html"
+STATUS_CHART = "chart.svg"
+STATUS_TREND = "trend.svg"
+CHART_SERIES = "series.json"
+ROLLUPS = "rollup.json"
+SCHEDULE = "schedule.json"
+DRIFT = "drift.json"
 OUTPUT_EPD = "data.bin"
 OUTPUT_PNG = "data.png"
+FRAME_DIR = "frames"
 
 our_tz = get_localzone()
 gmt = pytz.timezone("GMT")
@@ -204,12 +305,32 @@ if __name__ == "__main__":
     server_status_path = config.get(
         "General", "ServerStatus", fallback=os.path.join(args.dir, SERVER_STATUS)
     )
+    status_chart_path = config.get(
+        "General", "StatusChart", fallback=os.path.join(args.dir, STATUS_CHART)
+    )
+    chart_series_path = config.get(
+        "General", "ChartSeries", fallback=os.path.join(args.dir, CHART_SERIES)
+    )
+    status_trend_path = config.get(
+        "General", "StatusTrend", fallback=os.path.join(args.dir, STATUS_TREND)
+    )
+    rollups_path = config.get(
+        "General", "Rollups", fallback=os.path.join(args.dir, ROLLUPS)
+    )
     output_epd_path = config.get(
         "General", "DisplayOutput", fallback=os.path.join(args.dir, OUTPUT_EPD)
     )
     output_png_path = config.get(
         "General", "DebugOutput", fallback=os.path.join(args.dir, OUTPUT_PNG)
     )
+    frame_dir_path = config.get(
+        "General", "FrameDir", fallback=os.path.join(args.dir, FRAME_DIR)
+    )
+    schedule_path = config.get(
+        "General", "Schedule", fallback=os.path.join(args.dir, SCHEDULE)
+    )
+    drift_path = config.get("General", "Drift", fallback=os.path.join(args.dir, DRIFT))
+    slack = slack_from_config(config)
 
     # Filter tides
     if not args.time:
@@ -260,23 +381,18 @@ if __name__ == "__main__":
         logging.info("Using default wake time")
         next_wake = datetime.datetime(year=1980, month=1, day=1, tzinfo=our_tz)
 
-    # Load tides
-    tides_node = metadata.find("./server/tides")
-    if not tides_node:
+    # Load tides, kept per station so switching between them doesn't mix them up
+    tides_station = station(config)
+    harmonic = tides_station == "harmonic"
+    tides_node = find_tides_node(server_node, tides_station)
+    if tides_node is None:
         logging.info("Creating new tides node")
         tides_node = etree.SubElement(server_node, "tides")
+    tides_node.attrib["station"] = tides_station
 
-    loaded_tides = []
-    for node in metadata.findall("./server/tides/tide"):
-        t = Tide(
-            gmt.localize(
-                datetime.datetime.strptime(node.attrib["time"], "%Y-%m-%dT%H:%M:%S")
-            ),
-            node.attrib["type"],
-            float(node.attrib["height"]),
-        )
-        loaded_tides.append(t)
-        logging.debug("Loading stored %s", t)
+    # Reads the old one node per tide layout too, and saves it compactly below
+    loaded_tides = TideTable.load_xml(tides_node)
+    logging.debug("Loaded %d stored tides", len(loaded_tides))
 
     # Pull the last battery for putting in the display
     last_log_node = metadata.find("./client/log[last()]")
@@ -286,11 +402,34 @@ if __name__ == "__main__":
     except AttributeError:
         logging.info("No last battery information to display")
 
+    # Once per run, for the battery estimates and the trend chart
+    rollups = RollupStore.load(rollups_path)
+    rollups_changed = rollups.update(metadata.findall("./client/log"))
+    if rollups_changed:
+        # Before the chart, so a failed render doesn't lose the beacons
+        try:
+            rollups.save(rollups_path)
+        except OSError:
+            logging.exception("Cannot save rollups")
+
     # Is new data needed yet? (or forced)
-    if args.force or current_local >= (next_wake - SLACK):
-        valid_tides = [tide for tide in loaded_tides if tide.time > day_start]
-        tides_downloaded = []
-        if len(valid_tides) < 7:
+    if args.force or current_local >= (next_wake - slack):
+        tides_downloaded = loaded_tides
+        # Only go for more tides when what's stored doesn't reach far enough ahead
+        ahead = datetime.timedelta(days=config.getint("Tides", "AheadDays", fallback=3))
+        gaps = loaded_tides.uncovered(
+            int(current_local.timestamp()), int((current_local + ahead).timestamp())
+        )
+        if gaps and harmonic:
+            # Predicted locally, so there's no limit on how far ahead
+            days = config.getint("Tides", "PredictDays", fallback=28)
+            logging.info("Predicting %d days of tides", days)
+            start = int(day_start.timestamp())
+            end = int((day_start + datetime.timedelta(days=days)).timestamp())
+            predicted = HarmonicModel.from_config(config).extremes(start, end)
+            predicted.cover(start, end)
+            tides_downloaded = loaded_tides.merge(predicted)
+        elif gaps:
             try:
                 logging.info("Fetching new tides")
 
@@ -299,12 +438,25 @@ if __name__ == "__main__":
                 if not feed_loc:
                     raise ValueError("No feed configuration, can't fetch tides")
                 t = TideParser(feed_loc)
-                tides_downloaded = t.fetch(args.verbose)
+                fetched_at = int(datetime.datetime.now().timestamp())
+                fetched = TideTable.from_tides(t.fetch(args.verbose))
+                if len(fetched):
+                    # It returns everything from now, so that's all known
+                    fetched.cover(fetched_at, int(fetched.times[-1]))
+                tides_downloaded = loaded_tides.merge(fetched)
+                logging.info("Merged %d fetched tides", len(fetched))
             except ConnectionError:
                 logging.error("Failed to fetch tides")
         else:
             logging.debug("Using cached data")
-            tides_downloaded = loaded_tides
+
+        # Keep some history, harmonic.py can fit to it
+        retention = datetime.timedelta(
+            days=config.getint("Tides", "RetentionDays", fallback=35)
+        )
+        tides_downloaded = tides_downloaded.prune(
+            int((day_start - retention).timestamp())
+        )
 
         location = (
             config.getfloat("Geo", "Latitude"),
@@ -320,20 +472,11 @@ if __name__ == "__main__":
             # TODO handle error
             logging.warning("No tides remaining")
 
-        future_tides = [tide for tide in tides_downloaded if tide.time > current_local]
-        today_tides = [tide for tide in tides_downloaded if tide.time > day_start]
-
         if args.verbose:
             logging.debug("Future tide times:")
-            for t in future_tides:
-                logging.debug(t)
-
-        # Wakeup into tomorrow, although the RSS feed is a bit slower
-        wake_up_time_gmt = datetime.datetime.combine(
-            current_local.date() + datetime.timedelta(days=1),
-            datetime.time(hour=1, minute=15),
-        )
-        wake_up_time_gmt = gmt.localize(wake_up_time_gmt)
+            for t in tides_downloaded:
+                if t.time > current_local:
+                    logging.debug(t)
 
         weather = None
         try:
@@ -347,43 +490,44 @@ if __name__ == "__main__":
         except Exception as e:
             logging.exception("Failed to fetch weather information")
 
+        dither = config.get("Display", "Dither", fallback="diffusion")
+        panel = PANELS[config.get("Display", "Panel", fallback=DEFAULT_PANEL.name)]
+        curve = curve_from_config(config, tides_downloaded)
+
         d = None
-        if len(future_tides) >= 2:
-            # Otherwise wakeup when we need to change the clock
-            wake_up_time_gmt = future_tides[0].time  # GMT! not astimezone(london)
-            d = DisplayRenderer(
-                future_tides[0],
-                future_tides[1],
-                battery=battery,
-                location=location,
-                weather=weather,
-                tz=our_tz,
-            )
-        elif len(future_tides) == 1:
+        tide1, tide2, tide_change = choose_tides(
+            tides_downloaded, current_local, our_tz
+        )
+        # Fewest wakes that keep the clock, date and forecast fresh enough
+        planner = WakePlanner.from_config(config, slack)
+        forecast_times = weather.forecast_times() if weather else []
+        wakes = planner.plan(
+            tides_downloaded,
+            current_local,
+            current_local + HORIZON,
+            our_tz,
+            forecast_times,
+        )
+        if wakes:
+            wake_up_time_gmt = wakes[0][0]
+        else:
+            wake_up_time_gmt = next_wakeup(current_local, tide_change, slack)
+            wakes = [(wake_up_time_gmt, set())]
+        if tide1:
             d = DisplayRenderer(
-                future_tides[0],
+                tide1,
+                tide2,
                 battery=battery,
                 location=location,
                 weather=weather,
                 tz=our_tz,
-            )
-            wake_up_time_gmt = future_tides[0].time  # GMT! not astimezone(london)
-        else:
-            # For the sake of something to show we show this morning's, as next morning
-            d = DisplayRenderer(
-                today_tides[0], battery=battery, location=location, weather=weather
+                dither=dither,
+                panel=panel,
+                curve=curve,
             )
 
-        tides_node.clear()
+        tides_downloaded.save_xml(tides_node)
 
-        for tide in tides_downloaded:
-            tides_node.append(tide.to_xml())
-
-        # Now the time for the client to wakeup
-        wake_up_time_gmt += SLACK
-
-        # Remove microseconds
-        wake_up_time_gmt = wake_up_time_gmt.replace(microsecond=0)
         # isoformat puts out tz info in the wrong format to be able to bloody load it again
         wut = wake_up_time_gmt.isoformat().split("+")[0]
         wakeup_node.attrib["time"] = wut
@@ -409,50 +553,106 @@ if __name__ == "__main__":
         logging.info("Next client wakeup requested %s", wake_up_time_gmt)
 
         client_metadata = {"wakeup": wake_up_time_gmt.timetuple()}
+        # The next few too, so the device needn't ask again while they hold
+        published = config.getint("Schedule", "Publish", fallback=4)
+        client_metadata.update(
+            publish(wakes, published, tides_downloaded, current_local)
+        )
 
         logging.info("Writing client json")
         with open(client_metadata_path, "w") as meta_out:
             json.dump(client_metadata, meta_out)
 
+        schedule = report(
+            planner,
+            tides_downloaded,
+            current_local,
+            our_tz,
+            forecast_times,
+            rollups,
+        )
+        logging.info("Planning %.1f wakes a day", schedule["wakes_per_day"])
+        for device, estimate in schedule["devices"].items():
+            if estimate["battery_days"]:
+                logging.info(
+                    "%s has about %.0f days of battery left",
+                    device,
+                    estimate["battery_days"],
+                )
+        try:
+            with open(schedule_path, "w") as schedule_out:
+                json.dump(schedule, schedule_out)
+        except OSError:
+            logging.exception("Cannot save wake schedule")
+
+        # Comms passes each device its drift, so it can correct its alarms
+        drifts = estimate_drift(metadata)
+        for device, drift in drifts.items():
+            logging.info("%s drifts %+d ppm", device, drift["drift"])
+        try:
+            with open(drift_path, "w") as drift_out:
+                json.dump(drifts, drift_out)
+        except OSError:
+            logging.exception("Cannot save RTC drift")
+
         # Actually save the pic
         if d:
             logging.info("Creating forecast images")
             d.render()
             d.save(output_png_path)
 
-            e = EPDGenerator(d.surface_bw)
+            e = EPDGenerator(d.surface_bw, panel=panel)
             e.save(output_epd_path)
 
+            queue = FrameQueue(frame_dir_path)
+            render_ahead = config.getint("Display", "RenderAhead", fallback=0)
+            if render_ahead > 0:
+                logging.info("Rendering %d frames ahead", render_ahead)
+                queue.render(
+                    tides_downloaded,
+                    current_local,
+                    render_ahead,
+                    tz=our_tz,
+                    # Devices can fetch the frames for their next wakes in advance
+                    breaks=[when for when, _ in wakes[:published]],
+                    battery=battery,
+                    location=location,
+                    weather=weather,
+                    dither=dither,
+                    panel=panel,
+                    curve=curve,
+                )
+            else:
+                # Otherwise comms would carry on serving an old queue
+                queue.clear()
+
         else:
             logging.warning("Skipping render, no RSS data")
     else:
 
-        logging.info("Waking too early (not yet %s)", (next_wake - SLACK))
-        wake_up_time_gmt = next_wake.astimezone(gmt)
+        logging.info("Waking too early (not yet %s)", (next_wake - slack))
 
-    # Now generate the status page anyway because the client could have connected
-    png_create_time = None
-    try:
-        log_time = png_create_time = datetime.datetime.fromtimestamp(
-            os.path.getmtime(output_png_path)
-        )
-        status_create_time = datetime.datetime.fromtimestamp(
-            os.path.getmtime(server_status_path)  # TODO fails if it doesn't exist
-        )
-        if last_log_node is not None:
-            log_time = datetime.datetime.strptime(
-                last_log_node.attrib["time"], "%Y-%m-%dT%H:%M:%S"
-            )
-            logging.info("Last client login was " + str(log_time))
-        else:
-            logging.info("No beacon yet")
-        logging.info("Last PNG change was " + str(png_create_time))
-        logging.info("Last status page update was " + str(status_create_time))
-        if status_create_time < png_create_time or status_create_time < log_time:
-            logging.info("Generating new status page")
-            generate_status_page(
-                metadata, wake_up_time_gmt, server_status_path, png_create_time
-            )
-            logging.info("All done")
-    except OSError:
-        logging.exception("Cannot generate status page, no PNG to check")  #
+    # Now update the status page anyway because the client could have connected
+    generate_status_page(server_status_path)
+    series = ChartSeries.load(
+        chart_series_path, budget=config.getint("Status", "ChartPoints", fallback=500)
+    )
+    if series.update(metadata.findall("./client/log")) or not os.path.exists(
+        status_chart_path
+    ):
+        logging.info("Generating new status chart")
+        try:
+            generate_chart(series).render_to_file(status_chart_path)
+            series.save(chart_series_path)
+        except OSError:
+            logging.exception("Cannot save status chart")
+
+    if rollups_changed or not os.path.exists(status_trend_path):
+        logging.info("Generating new trend chart")
+        try:
+            generate_trend_chart(
+                config.getint("Status", "TrendDays", fallback=365), rollups
+            ).render_to_file(status_trend_path)
+        except OSError:
+            logging.exception("Cannot save trend chart")
+    logging.info("All done")
@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+"""
+Plans the fewest wakes that keep everything the display shows fresh enough.
+
+Every change to what's shown needs a wake no sooner than the change and no
+later than that value's staleness bound after it.  The changes are:
+
+* a tide passing, which moves the clock on
+* the date turning over, which also brings that day's sunrise, sunset and moon
+* the land forecast moving on to its next step
+* optionally, the height now drifting, as a tick every bound
+
+Choosing the fewest times that land in every such window is interval
+stabbing, which is solved exactly by waking at the earliest deadline and
+dropping every window that wake lands in, then repeating.  On the cmdline it
+prints the plan for the next few days and what it means for the batteries.
+"""
+
+import argparse
+import configparser
+import datetime
+import logging
+import os.path
+
+import pytz
+from rollup import BATT_SUM, COUNT, RollupStore
+
+gmt = pytz.timezone("GMT")
+
+# Minutes each value may be shown out of date for, 0 to not wake for it at all
+DEFAULT_STALENESS = {"tide": 15, "date": 360, "forecast": 360, "height": 0}
+
+# Percent of charge a wake costs, if the rollups can't say
+DEFAULT_WAKE_COST = 0.1
+
+# Far enough ahead that there's always a tide or a date change in it
+HORIZON = datetime.timedelta(days=2)
+
+DAY = 24 * 60 * 60
+
+
+class WakePlanner(object):
+    def __init__(self, staleness=None, lead=datetime.timedelta(0)):
+        """
+        :param staleness: Dict of change kind to timedelta, as DEFAULT_STALENESS
+        :param lead: Don't wake any sooner than this after a change, so an
+        early RTC still gets the new image
+        """
+        self.staleness = {
+            kind: datetime.timedelta(minutes=minutes)
+            for kind, minutes in DEFAULT_STALENESS.items()
+        }
+        self.staleness.update(staleness or {})
+        self.lead = lead
+
+    @staticmethod
+    def from_config(config, lead=datetime.timedelta(0)):
+        """
+        [Schedule]
+        TideStaleness = 15
+        DateStaleness = 360
+
+        :param config: ConfigParser, staleness in minutes per kind
+        :param lead: As for __init__()
+        :return: WakePlanner
+        """
+        return WakePlanner(
+            {
+                kind: datetime.timedelta(
+                    minutes=config.getint(
+                        "Schedule", "%sStaleness" % kind.title(), fallback=minutes
+                    )
+                )
+                for kind, minutes in DEFAULT_STALENESS.items()
+            },
+            lead,
+        )
+
+    def _window(self, change, kind):
+        """
+        :param change: Epoch seconds
+        :param kind: Key into staleness
+        :return: (earliest, latest, kind) in epoch seconds
+        """
+        earliest = change + self.lead.total_seconds()
+        return (
+            earliest,
+            max(earliest, change + self.staleness[kind].total_seconds()),
+            kind,
+        )
+
+    def windows(self, tides, start, end, tz=None, forecast_times=()):
+        """
+        :param tides: TideTable
+        :param start: Timezone-aware time, changes before it are already shown
+        :param end: Timezone-aware time
+        :param tz: Local timezone, for when the date turns over
+        :param forecast_times: Times the forecast moves on, from Weather.forecast_times()
+        :return: List of (earliest, latest, kind) wake windows, epoch seconds
+        """
+        first, last = start.timestamp(), end.timestamp()
+        windows = []
+        if self.staleness["tide"]:
+            for change in tides.times[(tides.times > first) & (tides.times < last)]:
+                windows.append(self._window(int(change), "tide"))
+
+        if self.staleness["date"]:
+            local = start.astimezone(tz) if tz else start
+            day = local.date()
+            while True:
+                day += datetime.timedelta(days=1)
+                midnight = datetime.datetime.combine(day, datetime.time(0))
+                if hasattr(tz, "localize"):
+                    midnight = tz.localize(midnight)
+                else:
+                    midnight = midnight.replace(tzinfo=tz or start.tzinfo)
+                if midnight.timestamp() >= last:
+                    break
+                windows.append(self._window(midnight.timestamp(), "date"))
+
+        if self.staleness["forecast"]:
+            for change in forecast_times:
+                if first < change.timestamp() < last:
+                    windows.append(self._window(change.timestamp(), "forecast"))
+
+        tick = self.staleness["height"].total_seconds()
+        if tick:
+            change = first + tick
+            while change < last:
+                windows.append(self._window(change, "height"))
+                change += tick
+        return windows
+
+    def plan(self, tides, start, end, tz=None, forecast_times=()):
+        """
+        :param tides: TideTable
+        :param start: Timezone-aware time of this run
+        :param end: Timezone-aware time to plan up to
+        :param tz: Local timezone
+        :param forecast_times: As for windows()
+        :return: List of (wake time in GMT, set of change kinds it shows)
+        """
+        wakes = []
+        windows = self.windows(tides, start, end, tz, forecast_times)
+        for earliest, latest, kind in sorted(windows, key=lambda window: window[1]):
+            # Taken in order of deadline, so the last wake is never after this one's
+            if wakes and wakes[-1][0] >= earliest:
+                wakes[-1][1].add(kind)
+                continue
+            wakes.append((int(latest), {kind}))
+        return [
+            (datetime.datetime.fromtimestamp(when, gmt), kinds) for when, kinds in wakes
+        ]
+
+    def next_wake(self, tides, now, tz=None, forecast_times=()):
+        """
+        :param tides: TideTable
+        :param now: Timezone-aware time of this run
+        :param tz: Local timezone
+        :param forecast_times: As for windows()
+        :return: First planned wake in GMT, or None if nothing changes soon
+        """
+        wakes = self.plan(tides, now, now + HORIZON, tz, forecast_times)
+        return wakes[0][0] if wakes else None
+
+
+def publish(wakes, count, tides, now):
+    """
+    Compact schedule for metadata.json, which the device keeps so it can set
+    later alarms without asking again
+    :param wakes: From WakePlanner.plan(), the first is the next wake
+    :param count: Most wakes to send
+    :param tides: TideTable the plan came from
+    :param now: Timezone-aware time of this run
+    :return: Dict of schedule and until, GMT times as [Y, m, d, H, M, S]
+    """
+    times = [when for when, _ in wakes[:count]]
+    until = times[-1]
+    # Past what's known of the tides the plan is a guess
+    for start, end in tides.coverage:
+        if start <= now.timestamp() < end:
+            until = min(until, datetime.datetime.fromtimestamp(end, gmt))
+            break
+    else:
+        until = times[0]
+    return {
+        "schedule": [list(when.utctimetuple()[:6]) for when in times if when <= until],
+        "until": list(until.utctimetuple()[:6]),
+    }
+
+
+def wakes_per_day(wakes, start, end):
+    """
+    :param wakes: From WakePlanner.plan()
+    :param start: Timezone-aware start of the plan
+    :param end: Timezone-aware end of the plan
+    :return: Mean wakes a day
+    """
+    days = (end - start).total_seconds() / DAY
+    return len(wakes) / days if days > 0 else 0
+
+
+def battery_days(
+    store, device, per_day, days=14, now=None, wake_cost=DEFAULT_WAKE_COST
+):
+    """
+    Estimate how long a device's charge lasts at some rate of wakes.  Sleeping
+    costs next to nothing, so the charge lost over the last few days is put
+    down to the beacons in them.
+
+    :param store: RollupStore
+    :param device: Device name
+    :param per_day: Wakes a day, as from wakes_per_day()
+    :param days: How far back to look
+    :param now: For testing, defaults to the current time
+    :param wake_cost: Percent of charge a wake costs, if there's too little history
+    :return: Dict of battery, wake_cost and battery_days, or None if unknown
+    """
+    if now is None:
+        now = datetime.datetime.now().timestamp()
+    _, slots = store.query(device, now - days * DAY, now, min_step=DAY, now=now)
+    if not slots:
+        return None
+
+    if len(slots) > 1:
+        used = RollupStore.mean(slots[0], BATT_SUM) - RollupStore.mean(
+            slots[-1], BATT_SUM
+        )
+        # Means run from mid-day to mid-day, so only half the end days' beacons count
+        beacons = (
+            sum(slot[COUNT] for slot in slots)
+            - (slots[0][COUNT] + slots[-1][COUNT]) / 2
+        )
+        if used > 0 and beacons > 0:
+            wake_cost = used / beacons
+
+    battery = RollupStore.mean(slots[-1], BATT_SUM)
+    return {
+        "battery": battery,
+        "wake_cost": wake_cost,
+        "battery_days": battery / (wake_cost * per_day) if per_day else None,
+    }
+
+
+def report(planner, tides, now, tz=None, forecast_times=(), store=None, days=7):
+    """
+    :param planner: WakePlanner
+    :param tides: TideTable
+    :param now: Timezone-aware time of this run
+    :param tz: Local timezone
+    :param forecast_times: As for WakePlanner.windows()
+    :param store: RollupStore, for battery estimates per device
+    :param days: How far ahead to plan
+    :return: Dict that's fine to json.dump()
+    """
+    end = now + datetime.timedelta(days=days)
+    wakes = planner.plan(tides, now, end, tz, forecast_times)
+    per_day = wakes_per_day(wakes, now, end)
+    devices = {}
+    if store is not None:
+        for device in store.devices:
+            estimate = battery_days(store, device, per_day, now=now.timestamp())
+            if estimate:
+                devices[device] = estimate
+    return {
+        "wakes_per_day": per_day,
+        "wakes": [
+            {"time": when.isoformat(), "shows": sorted(kinds)} for when, kinds in wakes
+        ],
+        "devices": devices,
+    }
+
+
+if __name__ == "__main__":
+    from lxml import etree
+    from tide import TideTable, find_tides_node, station
+    from tideclock_generator import ROLLUPS, SERVER_METADATA, slack_from_config
+    from tzlocal import get_localzone
+
+    parser = argparse.ArgumentParser(description="Plan wakes for the next few days")
+    parser.add_argument("-d", "--dir", default=".")
+    parser.add_argument("-c", "--config", help="Configuration", required=True)
+    parser.add_argument("-n", "--days", type=int, default=7)
+    parser.add_argument("-l", "--list", action="store_true", help="List every wake")
+    args = parser.parse_args()
+
+    logging.basicConfig(format="%(asctime)s %(levelname)s %(message)s")
+
+    config = configparser.ConfigParser()
+    config.read(args.config)
+    metadata = etree.parse(
+        config.get(
+            "General",
+            "ServerMetadata",
+            fallback=os.path.join(args.dir, SERVER_METADATA),
+        )
+    )
+    our_tz = get_localzone()
+    summary = report(
+        WakePlanner.from_config(config, slack_from_config(config)),
+        TideTable.load_xml(find_tides_node(metadata, station(config))),
+        datetime.datetime.now(our_tz),
+        our_tz,
+        store=RollupStore.load(
+            config.get("General", "Rollups", fallback=os.path.join(args.dir, ROLLUPS))
+        ),
+        days=args.days,
+    )
+    if args.list:
+        for wake in summary["wakes"]:
+            print("%s  %s" % (wake["time"], ", ".join(wake["shows"])))
+    print("%.1f wakes/day" % summary["wakes_per_day"])
+    for device, estimate in sorted(summary["devices"].items()):
+        print(
+            "%s: %.0f%%, %.2f%% a wake, %s"
+            % (
+                device,
+                estimate["battery"],
+                estimate["wake_cost"],
+                (
+                    "%.0f days left" % estimate["battery_days"]
+                    if estimate["battery_days"]
+                    else "no wakes planned"
+                ),
+            )
+        )
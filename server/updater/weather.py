@@ -1,3 +1,4 @@
+import datetime
 import warnings
 from typing import Optional
 
@@ -30,8 +31,71 @@ class Weather(object):
     def __init__(self, key):
         self.marine = None
         self.land = None
+        self.land_rep = None
         self.api_key = key
 
+    @staticmethod
+    def from_files(land_path=None, marine_path=None):
+        """
+        Load saved responses instead of asking the Met Office, for replays
+        :param land_path: Land forecast XML, as fetch_land_observ() gets
+        :param marine_path: Marine observation XML, as fetch_sea_observ() gets
+        :return: Weather
+        """
+        weather = Weather(None)
+        if land_path:
+            weather.land = etree.parse(land_path).getroot()
+        if marine_path:
+            weather.marine = etree.parse(marine_path).getroot()
+        return weather
+
+    def _land_rep(self):
+        """
+        :return: The land forecast step we're reporting, the first unless at() chose one
+        """
+        if self.land_rep is not None:
+            return self.land_rep
+        return self.land.find("DV/Location/Period[1]/Rep[1]")
+
+    def at(self, when):
+        """
+        The forecast is a time series, so later frames can show what's expected then
+        :param when: Timezone-aware time of interest
+        :return: Weather sharing this data but reading the land forecast step covering when
+        """
+        other = Weather(self.api_key)
+        other.land = self.land
+        other.marine = self.marine
+        if self.land is None:
+            return other
+
+        when = when.astimezone(datetime.timezone.utc)
+        for starts, rep in self._land_steps():
+            if starts > when:
+                return other
+            other.land_rep = rep
+        return other
+
+    def _land_steps(self):
+        """
+        :return: Iterator of (UTC time, Rep element) for each land forecast step
+        """
+        for period in self.land.iterfind("DV/Location/Period"):
+            day = datetime.datetime.strptime(
+                period.attrib["value"], "%Y-%m-%dZ"
+            ).replace(tzinfo=datetime.timezone.utc)
+            for rep in period.iterfind("Rep"):
+                # Text is minutes after midnight
+                yield day + datetime.timedelta(minutes=int(rep.text)), rep
+
+    def forecast_times(self):
+        """
+        :return: List of UTC times the land forecast moves on to its next step
+        """
+        if self.land is None:
+            return []
+        return [starts for starts, _ in self._land_steps()]
+
     def fetch_land_observ(self, weather_id):
         # walton forecast id 354073
         # http://datapoint.metoffice.gov.uk/public/data/val/wxfcs/all/xml/354073?res=3hourly&key=xxx
@@ -85,7 +149,7 @@ class Weather(object):
 
         :return: Wind speed (not gusts) in mph
         """
-        return float(self.land.find("DV/Location/Period[1]/Rep[1]").attrib["S"])
+        return float(self._land_rep().attrib["S"])
 
     def get_wind_direction(self):
         """
@@ -99,21 +163,21 @@ class Weather(object):
         Wind direction
         :return: 16 point compass direction as a string (e.g. WSW)
         """
-        return self.land.find("DV/Location/Period[1]/Rep[1]").attrib["D"]
+        return self._land_rep().attrib["D"]
 
     def get_temperature(self):
         """
 
         :return: Temperature in Celsius
         """
-        return float(self.land.find("DV/Location/Period[1]/Rep[1]").attrib["T"])
+        return float(self._land_rep().attrib["T"])
 
     def get_uv(self):
         """
         Get UV as WHO index (range is 1-8 for the UK)
         :return:
         """
-        val = int(self.land.find("DV/Location/Period[1]/Rep[1]").attrib["U"])
+        val = int(self._land_rep().attrib["U"])
         if val <= 2:
             val_str = "Low"
         elif val <= 5: